@@ -0,0 +1,419 @@
+import os
+import sys
+import heapq
+from array import array
+from collections import deque
+
+import numpy as np
+
+import StreamReader
+
+"""
+Vertex roles, in the order they are coded in CSRGraph.role
+"""
+ROLES = ('gateway','virtnode')
+ROLE_GATEWAY = 0
+ROLE_VIRTNODE = 1
+
+INF = float('inf')
+
+class CSRGraph(object):
+    """
+    A compact, array backed representation of a ModelNet .graph
+    file. Vertices are numbered by their position in the file;
+    the outgoing edges of vertex v are the edges between
+    offsets[v] and offsets[v+1].
+
+    Vertex arrays:
+        ids     -- the int_idx of each vertex
+        vn      -- the int_vn of each vertex, or -1 for gateways
+        role    -- the index in ROLES of the vertex's role
+
+    Edge arrays:
+        offsets -- V+1 offsets into the edge arrays
+        sources -- the vertex each edge leaves
+        targets -- the vertex each edge enters
+        delay   -- the int_delayms of each edge
+        idx     -- the int_idx of each edge
+
+    Lookup tables:
+        vertex_by_vn -- the vertex with each int_vn, or -1
+        edge_by_idx  -- the edge with each int_idx, or -1
+    """
+
+    def __init__(self,ids,vn,role,sources,targets,delay,idx):
+        self.ids = ids
+        self.vn = vn
+        self.role = role
+
+        order = np.argsort(sources,kind='mergesort')
+        self.sources = sources[order]
+        self.targets = targets[order]
+        self.delay = delay[order]
+        self.idx = idx[order]
+        self.offsets = np.zeros(len(ids)+1,dtype=np.int64)
+        np.cumsum(np.bincount(self.sources,minlength=len(ids)),out=self.offsets[1:])
+
+        self.vertex_by_vn = _lookup_table(self.vn)
+        self.edge_by_idx = _lookup_table(self.idx)
+
+        self._adjacency = None
+
+    @property
+    def num_vertices(self):
+        return len(self.ids)
+
+    @property
+    def num_edges(self):
+        return len(self.targets)
+
+    def virtnodes(self):
+        """
+        Return the vertices that have a virtual node number
+        """
+        return np.flatnonzero(self.vn != -1)
+
+    def vertex_for_vn(self,vn):
+        """
+        Return the vertex with virtual node number <b>vn</b>
+        """
+        if not 0 <= vn < len(self.vertex_by_vn) or self.vertex_by_vn[vn] == -1:
+            raise KeyError(vn)
+        return int(self.vertex_by_vn[vn])
+
+    def vertices_for_vns(self,vns,strict=True):
+        """
+        Return the vertices with the virtual node numbers in
+        <b>vns</b>, raising KeyError if any are missing. If
+        <b>strict</b> is False, missing vertices are given as -1.
+        """
+        vns = np.asarray(vns,dtype=np.int64)
+        bad = (vns < 0) | (vns >= len(self.vertex_by_vn))
+        if not strict:
+            vertices = np.empty(len(vns),dtype=np.int64)
+            vertices.fill(-1)
+            vertices[~bad] = self.vertex_by_vn[vns[~bad]]
+            return vertices
+        if bad.any():
+            raise KeyError(int(vns[bad][0]))
+        vertices = self.vertex_by_vn[vns]
+        if (vertices == -1).any():
+            raise KeyError(int(vns[vertices == -1][0]))
+        return vertices
+
+    def edge_for_idx(self,idx):
+        """
+        Return the position of the edge with int_idx <b>idx</b>
+        """
+        if not 0 <= idx < len(self.edge_by_idx) or self.edge_by_idx[idx] == -1:
+            raise KeyError(idx)
+        return int(self.edge_by_idx[idx])
+
+    def route_edges(self,route,strict=True):
+        """
+        Return the edge positions of the int_idx values in
+        <b>route</b>, raising KeyError if any are missing. If
+        <b>strict</b> is False, missing edges are given as -1.
+        """
+        route = np.asarray(route,dtype=np.int64)
+        bad = (route < 0) | (route >= len(self.edge_by_idx))
+        if not strict:
+            edges = np.empty(len(route),dtype=np.int64)
+            edges.fill(-1)
+            edges[~bad] = self.edge_by_idx[route[~bad]]
+            return edges
+        if bad.any():
+            raise KeyError(int(route[bad][0]))
+        edges = self.edge_by_idx[route]
+        if (edges == -1).any():
+            raise KeyError(int(route[edges == -1][0]))
+        return edges
+
+    def __adjacency(self):
+        """
+        The edge arrays as typed Python arrays, which are far
+        faster to index one element at a time than numpy arrays.
+        """
+        if self._adjacency is None:
+            self._adjacency = (array('l',self.offsets.tolist()),
+                               array('l',self.sources.tolist()),
+                               array('l',self.targets.tolist()),
+                               array('l',self.delay.tolist()))
+        return self._adjacency
+
+    def shortest_paths(self,src,weighted=True):
+        """
+        Compute the shortest path tree rooted at <b>src</b>,
+        weighted by int_delayms, or by hop count if <b>weighted</b>
+        is False.
+
+        Returns a pair of lists (dist,pred), where dist[v] is the
+        distance to v (INF if unreachable) and pred[v] is the
+        position of the edge used to reach v (-1 for src and
+        unreachable vertices).
+        """
+        offsets,_,targets,delay = self.__adjacency()
+        dist = [INF] * self.num_vertices
+        pred = [-1] * self.num_vertices
+        dist[src] = 0
+
+        if not weighted:
+            queue = deque([src])
+            while queue:
+                u = queue.popleft()
+                d = dist[u] + 1
+                for e in xrange(offsets[u],offsets[u+1]):
+                    v = targets[e]
+                    if dist[v] == INF:
+                        dist[v] = d
+                        pred[v] = e
+                        queue.append(v)
+            return dist,pred
+
+        settled = bytearray(self.num_vertices)
+        heap = [(0,src)]
+        while heap:
+            d,u = heapq.heappop(heap)
+            if settled[u]:
+                continue
+            settled[u] = 1
+            for e in xrange(offsets[u],offsets[u+1]):
+                v = targets[e]
+                nd = d + delay[e]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    pred[v] = e
+                    heapq.heappush(heap,(nd,v))
+        return dist,pred
+
+    def path_edges(self,pred,dst):
+        """
+        Return the edge positions on the path to <b>dst</b> in
+        the shortest path tree <b>pred</b>, in path order.
+        """
+        sources = self.__adjacency()[1]
+        edges = []
+        e = pred[dst]
+        while e != -1:
+            edges.append(e)
+            e = pred[sources[e]]
+        edges.reverse()
+        return edges
+
+    def path_vertices(self,pred,dst):
+        """
+        Return the vertices on the path to <b>dst</b> in the
+        shortest path tree <b>pred</b>, including both endpoints.
+        """
+        edges = self.path_edges(pred,dst)
+        if not edges:
+            return [dst]
+        return [int(self.sources[edges[0]])] + [int(self.targets[e]) for e in edges]
+
+    def routes(self,src,weighted=True):
+        """
+        Yield (dst_vn,hops) for every virtual node reachable from
+        <b>src</b>, where hops is the list of edge int_idx values
+        along the shortest path.
+        """
+        dist,pred = self.shortest_paths(src,weighted)
+        idx = self.idx
+        for dst in self.virtnodes():
+            if dst == src or dist[dst] == INF:
+                continue
+            yield (int(self.vn[dst]),
+                   [int(idx[e]) for e in self.path_edges(pred,dst)])
+
+def _lookup_table(keys):
+    """
+    Return an array mapping each non-negative value in
+    <b>keys</b> to its first position in <b>keys</b>, and
+    every other value up to the largest key to -1.
+    """
+    valid = np.flatnonzero(keys >= 0)
+    table = np.empty(int(keys[valid].max()) + 1 if len(valid) else 0,dtype=np.int64)
+    table.fill(-1)
+    # Assign in reverse so the first occurrence of a key wins
+    table[keys[valid[::-1]]] = valid[::-1]
+    return table
+
+"""
+Graph cache files hold the columns of a ModelNet .graph file, so
+loaders can memory map them instead of parsing the XML. The
+layout is a 16 byte header (the magic string and the number of
+columns as a little endian uint64), followed by one CACHE_ENTRY
+per column giving its name, numpy dtype string, length and byte
+offset from the start of the file. Column data starts at 8 byte
+aligned offsets.
+
+Vertex columns, in file order:
+    ids     -- int_idx
+    vn      -- int_vn, or -1 for gateways
+    role    -- the index in ROLES of the vertex's role
+
+Edge columns, in file order:
+    sources -- the position of the int_src vertex
+    targets -- the position of the int_dst vertex
+    idx     -- int_idx
+    delay   -- int_delayms
+    kbps    -- dbl_kbps, or NaN if the edge doesn't set it
+    spec    -- the index in SPECS of the edge's specs
+"""
+CACHE_MAGIC = "MNGRAPH1"
+CACHE_SUFFIX = ".cache"
+CACHE_ENTRY = np.dtype([('name','S16'),('dtype','S8'),('length','<u8'),('offset','<u8')])
+CACHE_COLUMNS = (('ids','<i8'),('vn','<i8'),('role','<i1'),
+                 ('sources','<i8'),('targets','<i8'),('idx','<i8'),
+                 ('delay','<i8'),('kbps','<f8'),('spec','<i1'))
+SPECS = ('client-stub','stub-stub')
+
+def cache_path(graph_file):
+    return graph_file + CACHE_SUFFIX
+
+def read_graph_columns(graph_file):
+    """
+    Parse the ModelNet .graph file <b>graph_file</b> into a dict
+    of the graph cache columns.
+    """
+    ids,vn,role = array('l'),array('l'),array('b')
+    position = dict()
+    sources,targets,delay,idx = array('l'),array('l'),array('l'),array('l')
+    kbps,spec = array('d'),array('b')
+    spec_codes = dict((name,code) for code,name in enumerate(SPECS))
+
+    for tag,record in StreamReader.iter_records(graph_file,('vertex','edge')):
+        if tag == 'vertex':
+            position[int(record['int_idx'])] = len(ids)
+            ids.append(int(record['int_idx']))
+            vn.append(int(record['int_vn']) if record.get('int_vn') else -1)
+            role.append(ROLE_VIRTNODE if record.get('role') == 'virtnode' else ROLE_GATEWAY)
+        else:
+            try:
+                sources.append(position[int(record['int_src'])])
+                targets.append(position[int(record['int_dst'])])
+            except KeyError as e:
+                raise ValueError("Edge %s of '%s' refers to vertex %s, which isn't in the file"
+                                 % (record['int_idx'],graph_file,e.args[0]))
+            delay.append(int(record['int_delayms']))
+            idx.append(int(record['int_idx']))
+            kbps.append(float(record['dbl_kbps']) if record.get('dbl_kbps') else float('nan'))
+            try:
+                spec.append(spec_codes[record.get('specs')])
+            except KeyError:
+                raise ValueError("Edge %s of '%s' has unknown specs '%s'"
+                                 % (record['int_idx'],graph_file,record.get('specs')))
+
+    del position
+
+    columns = dict(ids=ids,vn=vn,role=role,sources=sources,targets=targets,
+                   idx=idx,delay=delay,kbps=kbps,spec=spec)
+    return dict((name,np.array(columns[name],dtype=dtype)) for name,dtype in CACHE_COLUMNS)
+
+def write_graph_cache(columns,cache_file):
+    """
+    Write the dict of graph cache <b>columns</b> to <b>cache_file</b>
+    """
+    table = np.zeros(len(CACHE_COLUMNS),dtype=CACHE_ENTRY)
+    offset = 16 + table.nbytes
+    for i,(name,dtype) in enumerate(CACHE_COLUMNS):
+        offset += -offset % 8
+        table[i] = (name,dtype,len(columns[name]),offset)
+        offset += len(columns[name]) * np.dtype(dtype).itemsize
+
+    with open(cache_file,'wb') as out:
+        out.write(CACHE_MAGIC)
+        out.write(np.array([len(table)],dtype='<u8').tostring())
+        out.write(table.tostring())
+        for name,dtype in CACHE_COLUMNS:
+            out.write("\0" * (-out.tell() % 8))
+            out.write(np.asarray(columns[name],dtype=dtype).tostring())
+
+def build_graph_cache(graph_file,cache_file=None):
+    """
+    Write the graph cache for <b>graph_file</b>. Returns the path
+    to the cache file.
+    """
+    if cache_file is None:
+        cache_file = cache_path(graph_file)
+    write_graph_cache(read_graph_columns(graph_file),cache_file)
+    return cache_file
+
+def load_graph_cache(cache_file):
+    """
+    Memory map the columns of the graph cache <b>cache_file</b>,
+    returning them as a dict of read only arrays.
+    """
+    with open(cache_file,'rb') as f:
+        header = f.read(16)
+        if len(header) != 16 or header[:8] != CACHE_MAGIC:
+            raise IOError("'%s' is not a graph cache file" % cache_file)
+        count = int(np.frombuffer(header[8:],dtype='<u8')[0])
+        table = np.frombuffer(f.read(count * CACHE_ENTRY.itemsize),dtype=CACHE_ENTRY)
+    if len(table) != count:
+        raise IOError("'%s' is truncated" % cache_file)
+
+    columns = dict()
+    for name,dtype,length,offset in table.tolist():
+        if length:
+            columns[name] = np.memmap(cache_file,dtype=dtype,mode='r',
+                                      offset=offset,shape=(length,))
+        else:
+            columns[name] = np.empty(0,dtype=dtype)
+
+    missing = [name for name,_ in CACHE_COLUMNS if name not in columns]
+    if missing:
+        raise IOError("'%s' is missing the column(s) %s" % (cache_file,", ".join(missing)))
+    return columns
+
+def open_graph_cache(graph_file):
+    """
+    Return the memory mapped columns of the graph cache for
+    <b>graph_file</b> if it has one that is at least as new as
+    the graph file, or None otherwise.
+    """
+    cache_file = cache_path(graph_file)
+    try:
+        if os.path.getmtime(cache_file) < os.path.getmtime(graph_file):
+            sys.stderr.write("Warning: ignoring graph cache '%s' because it is "
+                             "older than '%s'\n" % (cache_file,graph_file))
+            return None
+    except OSError:
+        return None
+
+    return load_graph_cache(cache_file)
+
+def graph_columns(graph_file):
+    """
+    Return the graph cache columns of <b>graph_file</b>, from its
+    cache if it has an up to date one, and by parsing it otherwise.
+    """
+    columns = open_graph_cache(graph_file)
+    if columns is None:
+        columns = read_graph_columns(graph_file)
+    return columns
+
+def load_graph_csr(graph_file):
+    """
+    Load a ModelNet .graph file into a CSRGraph. Only the
+    attributes needed for routing are kept. The graph cache is
+    used instead of the XML if it is up to date.
+    """
+    columns = graph_columns(graph_file)
+
+    if len(columns['ids']) == 0:
+        sys.stderr.write("warning: didn't find any vertices. did you provide a .graph file as input?\n")
+        return
+
+    return csr_from_columns(columns)
+
+def csr_from_columns(columns):
+    """
+    Build a CSRGraph from the graph cache <b>columns</b>
+    """
+    return CSRGraph(np.array(columns['ids'],dtype=np.int64),
+                    np.array(columns['vn'],dtype=np.int64),
+                    np.array(columns['role'],dtype=np.int8),
+                    np.array(columns['sources'],dtype=np.int64),
+                    np.array(columns['targets'],dtype=np.int64),
+                    np.array(columns['delay'],dtype=np.int64),
+                    np.array(columns['idx'],dtype=np.int64))
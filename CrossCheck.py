@@ -0,0 +1,208 @@
+"""
+Check that a ModelNet .graph file, the .model file mkmodel built
+from it and a route file agree with each other.
+
+Virtnodes are joined on int_vn and edges on int_idx, so every
+vertex, virtnode and route endpoint that doesn't line up is
+reported, rather than just the first one ModelNet trips over.
+Each file is read once. The joins search sorted copies of the
+ids, so the time and memory they take grow with the number of
+records, however large (or corrupt) the ids in them are.
+"""
+
+import numpy as np
+
+import CompactGraph
+import ModelFunctions
+import RouteFiles
+
+class CrossCheckReport(ModelFunctions.ConsistencyReport):
+    """
+    The problems cross_check found between the files
+    """
+
+    PROBLEMS = ('malformed','graph_virtnodes_missing','model_virtnodes_missing',
+                'virtnode_idx_mismatch','graph_edges_missing','model_hops_missing',
+                'hop_endpoint_mismatch','route_endpoints_unknown','route_hops_unknown',
+                'route_paths_broken')
+
+    DESCRIPTIONS = {
+        'malformed':"model records with missing or non-integer ids",
+        'graph_virtnodes_missing':"graph virtnodes whose int_vn isn't in the model",
+        'model_virtnodes_missing':"model virtnodes whose int_vn isn't in the graph",
+        'virtnode_idx_mismatch':"int_vn values with a different int_idx in the graph and the model",
+        'graph_edges_missing':"graph edges whose int_idx isn't a model hop",
+        'model_hops_missing':"model hops whose int_idx isn't a graph edge",
+        'hop_endpoint_mismatch':"int_idx values with different endpoints in the graph and the model",
+        'route_endpoints_unknown':"paths whose int_vnsrc or int_vndst isn't a model virtnode",
+        'route_hops_unknown':"paths with a hop that isn't in the model",
+        'route_paths_broken':"paths whose hops don't lead from int_vnsrc to int_vndst"}
+
+def _index(keys):
+    """
+    Return the index of the id array <b>keys</b> that _find
+    searches: the keys in sorted order, and the position of each
+    in <b>keys</b>. The sort is stable, so duplicates are in file
+    order.
+    """
+    keys = np.asarray(keys,dtype=np.int64)
+    order = np.argsort(keys,kind='mergesort')
+    return keys[order],order
+
+def _find(index,values):
+    """
+    Return the position of the first occurrence of each of
+    <b>values</b> in the keys of <b>index</b>, or -1 for values
+    that aren't among them
+    """
+    values = np.asarray(values,dtype=np.int64)
+    keys,order = index
+    found = np.empty(len(values),dtype=np.int64)
+    found.fill(-1)
+    if len(keys):
+        positions = np.minimum(np.searchsorted(keys,values),len(keys) - 1)
+        hit = keys[positions] == values
+        found[hit] = order[positions[hit]]
+    return found
+
+def _hop_list(hops):
+    return " ".join(str(hop) for hop in hops)
+
+def check_virtnodes(report,graph,model):
+    """
+    Join the virtnodes of the <b>graph</b> and <b>model</b>
+    columns on int_vn
+    """
+    ids,vn = graph['ids'],graph['vn']
+    vn_idx,model_vn = model['vn_idx'],model['vn']
+
+    virtnodes = np.flatnonzero(vn >= 0)
+    in_model = _find(_index(model_vn),vn[virtnodes])
+    report.found('graph_virtnodes_missing',virtnodes[in_model < 0],
+                 lambda i: "vertex %d (int_vn %d)" % (ids[i],vn[i]))
+
+    in_graph = _find(_index(vn[virtnodes]),model_vn)
+    in_graph[in_graph >= 0] = virtnodes[in_graph[in_graph >= 0]]
+    report.found('model_virtnodes_missing',np.flatnonzero(in_graph < 0),
+                 lambda i: "virtnode %d (int_vn %d)" % (vn_idx[i],model_vn[i]))
+
+    both = np.flatnonzero(in_graph >= 0)
+    report.found('virtnode_idx_mismatch',both[ids[in_graph[both]] != vn_idx[both]],
+                 lambda i: "int_vn %d: vertex %d in the graph, virtnode %d in the model"
+                           % (model_vn[i],ids[in_graph[i]],vn_idx[i]))
+
+def check_hops(report,graph,model):
+    """
+    Join the edges of the <b>graph</b> columns and the hops of
+    the <b>model</b> columns on int_idx
+    """
+    idx = graph['idx']
+    src = graph['ids'][graph['sources']]
+    dst = graph['ids'][graph['targets']]
+    hop_idx,hop_src,hop_dst = model['hop_idx'],model['hop_src'],model['hop_dst']
+
+    in_model = _find(_index(hop_idx),idx)
+    report.found('graph_edges_missing',np.flatnonzero(in_model < 0),
+                 lambda i: "edge %d: %d -> %d" % (idx[i],src[i],dst[i]))
+
+    in_graph = _find(_index(idx),hop_idx)
+    report.found('model_hops_missing',np.flatnonzero(in_graph < 0),
+                 lambda i: "hop %d: %d -> %d" % (hop_idx[i],hop_src[i],hop_dst[i]))
+
+    both = np.flatnonzero(in_graph >= 0)
+    edges = in_graph[both]
+    report.found('hop_endpoint_mismatch',
+                 both[(src[edges] != hop_src[both]) | (dst[edges] != hop_dst[both])],
+                 lambda i: "int_idx %d: %d -> %d in the graph, %d -> %d in the model"
+                           % (hop_idx[i],src[in_graph[i]],dst[in_graph[i]],hop_src[i],hop_dst[i]))
+
+def check_routes(report,route_file,model):
+    """
+    Check that every path in <b>route_file</b> joins two model
+    virtnodes through a chain of model hops. Returns the number
+    of paths checked.
+    """
+    # Each array gets a trailing -1, so the -1 _find gives for a
+    # missing id indexes it.
+    vn_idx = np.append(model['vn_idx'],-1)
+    hop_src = np.append(model['hop_src'],-1)
+    hop_dst = np.append(model['hop_dst'],-1)
+    vertex_of_vn = _index(model['vn'])
+    hop_by_idx = _index(model['hop_idx'])
+
+    paths = 0
+    for src,dsts,lengths,hops in RouteFiles.iter_blocks(route_file):
+        count = len(dsts)
+        paths += count
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+        path = np.repeat(np.arange(count),lengths)
+
+        def describe(i,src=src,dsts=dsts,hops=hops,starts=starts,ends=ends):
+            return "path %d -> %d: hops %s" % (src,dsts[i],_hop_list(hops[starts[i]:ends[i]]))
+
+        src_vertex = vn_idx[_find(vertex_of_vn,[src])[0]]
+        dst_vertex = vn_idx[_find(vertex_of_vn,dsts)]
+        unknown_ends = (dst_vertex < 0) | (src_vertex < 0)
+        report.found('route_endpoints_unknown',np.flatnonzero(unknown_ends),describe)
+
+        positions = _find(hop_by_idx,hops)
+        unknown_hops = np.zeros(count,dtype=bool)
+        unknown_hops[path[positions < 0]] = True
+        report.found('route_hops_unknown',np.flatnonzero(unknown_hops & ~unknown_ends),describe)
+
+        # Each hop has to start where the one before it ended, the
+        # first at the source and the last at the destination. An
+        # empty path only goes from a virtnode to itself.
+        entered = hop_dst[positions]
+        left = hop_src[positions]
+        broken = np.zeros(count,dtype=bool)
+        empty = lengths == 0
+        broken[empty] = dst_vertex[empty] != src_vertex
+        used = ~empty
+        broken[used] = ((left[starts[used]] != src_vertex)
+                        | (entered[ends[used] - 1] != dst_vertex[used]))
+        same_path = path[1:] == path[:-1]
+        broken[path[1:][same_path & (entered[:-1] != left[1:])]] = True
+        report.found('route_paths_broken',np.flatnonzero(broken & ~(unknown_ends | unknown_hops)),
+                     describe)
+
+    report.checked.append("%d paths in '%s'" % (paths,route_file))
+    return paths
+
+def cross_check(graph_file,model_file,route_file=None,max_examples=ModelFunctions.EXAMPLES):
+    """
+    Check that <b>graph_file</b>, <b>model_file</b> and, if it is
+    given, <b>route_file</b> (XML or binary) number the virtnodes
+    and hops the same way. Returns a CrossCheckReport with up to
+    <b>max_examples</b> examples of each problem.
+
+    The graph cache is used instead of the graph's XML if it is
+    up to date. Routes are checked against the model, since that
+    is what ModelNet loads. Duplicate ids are matched by their
+    first occurrence; check_model reports them.
+    """
+    report = CrossCheckReport(max_examples)
+    model = ModelFunctions.read_model_columns(model_file,report)
+
+    columns = CompactGraph.graph_columns(graph_file)
+    graph = dict(ids=np.asarray(columns['ids'],dtype=np.int64),
+                 vn=np.asarray(columns['vn'],dtype=np.int64),
+                 sources=np.asarray(columns['sources'],dtype=np.int64),
+                 targets=np.asarray(columns['targets'],dtype=np.int64),
+                 idx=np.asarray(columns['idx'],dtype=np.int64))
+    del columns
+    report.checked.insert(0,"%d vertices and %d edges in '%s'"
+                          % (len(graph['ids']),len(graph['idx']),graph_file))
+
+    check_virtnodes(report,graph,model)
+    check_hops(report,graph,model)
+    del graph
+
+    if route_file is not None:
+        check_routes(report,route_file,model)
+    else:
+        report.problems = [problem for problem in report.problems
+                           if not problem.startswith('route_')]
+
+    return report
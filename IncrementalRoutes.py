@@ -0,0 +1,170 @@
+import numpy as np
+
+import CompactGraph
+import RouteFiles
+import ValidatePathDistances
+
+def _edge_table(graph,size):
+    """
+    Return an array mapping each int_idx to its edge position
+    in <b>graph</b>, or -1 if there is no such edge.
+    """
+    table = np.empty(size,dtype=np.int64)
+    table.fill(-1)
+    table[graph.idx] = np.arange(graph.num_edges)
+    return table
+
+def changed_edges(old,new,weighted=True):
+    """
+    Compare the edges of two CSRGraphs over the same vertices.
+
+    Returns (worse,better), where <b>worse</b> is the set of
+    int_idx values of old edges that were removed, moved or made
+    slower, and <b>better</b> is an array of the positions in
+    <b>new</b> of edges that were added, moved or made faster.
+    Delay changes are ignored if <b>weighted</b> is False.
+    """
+    size = int(max(old.idx.max() if old.num_edges else 0,
+                   new.idx.max() if new.num_edges else 0)) + 1
+    old_pos = _edge_table(old,size)
+    new_pos = _edge_table(new,size)
+
+    in_old = old_pos != -1
+    in_new = new_pos != -1
+    both = np.flatnonzero(in_old & in_new)
+
+    moved = both[(old.sources[old_pos[both]] != new.sources[new_pos[both]]) |
+                 (old.targets[old_pos[both]] != new.targets[new_pos[both]])]
+    kept = np.setdiff1d(both,moved)
+
+    worse = [np.flatnonzero(in_old & ~in_new),moved]
+    better = [new_pos[in_new & ~in_old],new_pos[moved]]
+    if weighted:
+        old_delay = old.delay[old_pos[kept]]
+        new_delay = new.delay[new_pos[kept]]
+        worse.append(kept[new_delay > old_delay])
+        better.append(new_pos[kept[new_delay < old_delay]])
+
+    return set(np.concatenate(worse).tolist()),np.concatenate(better)
+
+def affected_sources(old,new,route_file,weighted=True):
+    """
+    Work out which sources' routes can differ between the
+    graphs <b>old</b> and <b>new</b>, given the routes
+    <b>route_file</b> computed on <b>old</b>.
+
+    A source is affected if one of its routes uses an edge that
+    was removed or slowed down, or if an edge (u,v) that was
+    added or sped up would give it a path to v at least as short
+    as its old one, i.e. d(s,u) + w(u,v) <= d(s,v). The distances
+    to u and v from every source are found with one search from
+    each of them over the reversed old graph.
+
+    Returns the set of int_vn values of the affected sources.
+    """
+    worse,better = changed_edges(old,new,weighted)
+    affected = set()
+
+    if worse:
+        with open(route_file) as f:
+            for line in f:
+                m = RouteFiles.PATHREGEX.match(line)
+                if not m:
+                    continue
+                src = int(m.group(2))
+                if src in affected:
+                    continue
+                if not worse.isdisjoint(map(int,m.group(3).split())):
+                    affected.add(src)
+
+    if len(better):
+        reverse = CompactGraph.CSRGraph(old.ids,old.vn,old.role,
+                                        old.targets,old.sources,old.delay,old.idx)
+        sources = old.virtnodes()
+        dist_to = dict()
+
+        def distances(v):
+            if v not in dist_to:
+                dist_to[v] = np.array(reverse.shortest_paths(v,weighted)[0])[sources]
+            return dist_to[v]
+
+        for e in better.tolist():
+            u = int(new.sources[e])
+            v = int(new.targets[e])
+            wt = new.delay[e] if weighted else 1
+            to_u = distances(u)
+            closer = np.isfinite(to_u) & (to_u + wt <= distances(v))
+            affected.update(old.vn[sources[closer]].tolist())
+
+    return affected
+
+def update_routes(old_graph_file,new_graph_file,route_file,out,wt_attr=None,csr=False):
+    """
+    Write the route file for <b>new_graph_file</b> to <b>out</b>,
+    given the route file <b>route_file</b> that allpairs produced
+    for <b>old_graph_file</b> with the same <b>wt_attr</b> and
+    <b>csr</b> options.
+
+    Only the sources whose routes can have changed are routed
+    again; the paths of every other source are copied through.
+    Affected sources that had no paths in <b>route_file</b> are
+    routed just before its closing tag. Like allpairs' output,
+    <b>route_file</b> must list each source's paths together.
+
+    Returns the number of sources that were rerouted.
+    """
+    if wt_attr not in (None,'int_delayms'):
+        raise ValueError("Incremental updates only support weighting by 'int_delayms'")
+    if RouteFiles.is_binary(route_file):
+        raise ValueError("Incremental updates need an XML route file. "
+                         "Use 'convert_routes' to convert '%s'" % route_file)
+
+    old = CompactGraph.load_graph_csr(old_graph_file)
+    new = CompactGraph.load_graph_csr(new_graph_file)
+    if (old.num_vertices != new.num_vertices
+            or (old.ids != new.ids).any() or (old.vn != new.vn).any()):
+        raise ValueError("The vertices of '%s' and '%s' differ. Run allpairs instead."
+                         % (old_graph_file,new_graph_file))
+
+    affected = affected_sources(old,new,route_file,weighted=bool(wt_attr))
+    del old
+
+    if csr:
+        gr = new
+        vertex_for_vn = gr.vertex_for_vn
+    else:
+        del new
+        gr = ValidatePathDistances.load_graph(new_graph_file)
+        by_vn = dict((gr.node[v]['vn'],v) for v in gr.nodes())
+        vertex_for_vn = by_vn.__getitem__
+
+    writer = RouteFiles.XMLRouteWriter(out,header=False)
+    unseen = set(affected)
+    current = None
+
+    def route_unseen():
+        # Sources that had no paths at all, such as a virtnode the
+        # old graph left unconnected
+        sources = [vertex_for_vn(src) for src in sorted(unseen)]
+        ValidatePathDistances._route_sources(gr,sources,wt_attr,writer)
+        unseen.clear()
+
+    with open(route_file) as f:
+        for line in f:
+            m = RouteFiles.PATHREGEX.match(line)
+            if not m:
+                if line.strip() == RouteFiles.XML_FOOTER.strip():
+                    route_unseen()
+                out.write(line)
+                continue
+
+            src = int(m.group(2))
+            if src not in affected:
+                out.write(line)
+            elif src != current:
+                ValidatePathDistances._route_sources(gr,[vertex_for_vn(src)],wt_attr,writer)
+                unseen.discard(src)
+            current = src
+    route_unseen()
+
+    return len(affected)
@@ -1,42 +1,121 @@
 #!/opt/local/bin/pypy-c
 
 from pygraph.classes.graph import graph
-import string
 import argparse
 import pygraph.readwrite.markup as xmlwriter
 import sys
+import os
 import re
+from array import array
 
-def get_attribute(graph,element,attr,cast=str):
-    if isinstance(element, basestring):
-        function = graph.node_attributes
-    else:
-        function = graph.edge_attributes
-    return [cast(attrib[1]) for attrib in function(element) if attrib[0] == attr]
+import StreamReader
 
-def write(gr,out):
-    writer = MNXMLWriter(gr,out)
+def write(gr,out,columns=False):
+    writer = MNXMLWriter(gr,out,columns)
     writer.write_header()
     writer.write_vertices()
     writer.write_edges()
     writer.write_specs()
     writer.write_close()
-
+    return writer
+
+
+def node_info(attributes):
+    """
+    Format the (attr,value) pairs in <b>attributes</b> that
+    ModelNet keeps as attributes of a <vertex>
+    """
+    printset = {'bandwidth (kb/s)':'bw',
+                'ip address':'ip_address',
+                'router name':'nickname',
+                'as':'as',
+                'nodetype':'nodetype',
+                'flag - exit':'exit',
+                'flag - authority':'authority'
+               }
+    return " %s " % (" ".join(["%s='%s'" % (printset[x[0]],x[1])
+                                for x in attributes
+                                if x[0] in printset.keys()]))
 
 def BYTES2BITS(x):
    return float(x) * 8
 
+"""
+Vertex kinds, as stored in MNXMLWriter.kinds. Relays, clients
+and destinations are virtual nodes; gateways are not.
+"""
+GATEWAY,RELAY,CLIENT,DEST = range(4)
+
+def vertex_kind(vertex):
+    """
+    Classify the TorTopology node id <b>vertex</b> as one of
+    the vertex kinds
+    """
+    if MNXMLWriter.IPPATTERN.match(vertex):
+        return RELAY
+    if MNXMLWriter.CLIPATTERN.match(vertex):
+        return CLIENT
+    if MNXMLWriter.DSTPATTERN.match(vertex):
+        return DEST
+    return GATEWAY
+
+def bandwidth_values(kind,attributes):
+    """
+    Return the (download,upload) dbl_kbps values of the links
+    to a vertex of kind <b>kind</b> with the (attr,value) pairs
+    <b>attributes</b>. Either is None if the vertex doesn't set it.
+    """
+    def value(name):
+        values = [value for attr,value in attributes if attr == name]
+        if len(values) != 1:
+            return None
+        return BYTES2BITS(values[0])
+
+    if kind == RELAY:
+        bw = value("bandwidth (kb/s)")
+        return (bw,bw)
+    if kind == CLIENT:
+        #We assume client BWs are provided in bits/s
+        return (value("download_bw"),value("upload_bw"))
+    return (None,None)
+
+def bandwidth_fields(bandwidths):
+    """
+    Format the (download,upload) <b>bandwidths</b> as dbl_kbps
+    fields, or "" where they are None
+    """
+    return tuple('dbl_kbps="%s"' % bw if bw is not None else "" for bw in bandwidths)
+
 class MNXMLWriter():
 
     IPREGEX = "([0-9]{1,3}_){3}[0-9]{1,3}"
     CLIREGEX = "client_node_[0-9]+"
     DSTREGEX = "dest_node_[0-9]+"
 
-    def __init__(self,gr,out):
+    IPPATTERN = re.compile(IPREGEX)
+    CLIPATTERN = re.compile(CLIREGEX)
+    DSTPATTERN = re.compile(DSTREGEX)
+
+    EDGE = '<edge int_dst="%s" int_src="%s" int_idx="%s" specs="%s" int_delayms="%s" %s/>\n'
+
+    def __init__(self,gr,out,columns=False):
         self.gr = gr
         self.out = out
         self.vertices = dict()
         self.vert_indices = dict()
+        # Indexed by int_idx
+        self.names = []
+        self.kinds = array('b')
+        self.bandwidths = []
+
+        # The graph cache columns of everything written, if asked for
+        if columns:
+            self.columns = dict(ids=array('l'),vn=array('l'),role=array('b'),
+                                sources=array('l'),targets=array('l'),idx=array('l'),
+                                delay=array('l'),kbps=array('d'),spec=array('b'))
+            self.kbps = []
+        else:
+            self.columns = None
 
     def write_close(self):
         self.out.write("</topology>\n")
@@ -45,113 +124,131 @@ class MNXMLWriter():
         self.out.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n')
         self.out.write('<topology>\n')
 
+    def add_vertex(self,vertex,attributes,vertNum):
+        """
+        Classify <b>vertex</b>, record it in the vertex tables
+        and write its <vertex> line, giving it virtual node
+        number <b>vertNum</b> if it is a virtual node.
+
+        Returns the next free virtual node number.
+        """
+        vertIdx = len(self.kinds)
+        kind = vertex_kind(vertex)
+        self.vertices[vertex] = (vertIdx,vertNum)
+        self.vert_indices[vertNum] = (vertIdx,vertex)
+        self.names.append(vertex)
+        self.kinds.append(kind)
+        bandwidths = bandwidth_values(kind,attributes)
+        self.bandwidths.append(bandwidth_fields(bandwidths))
+
+        if self.columns is not None:
+            self.columns['ids'].append(vertIdx)
+            self.columns['vn'].append(vertNum if kind != GATEWAY else -1)
+            # Coded as in CompactGraph.ROLES
+            self.columns['role'].append(1 if kind != GATEWAY else 0)
+            self.kbps.append(tuple(float('nan') if bw is None else bw for bw in bandwidths))
+
+        if kind != GATEWAY:
+            #This is a IP (virtual node)
+            self.out.write('<vertex int_idx="%s" role="virtnode" int_vn="%s" %s/>\n' %
+                             (vertIdx,vertNum,node_info(attributes)))
+            return vertNum + 1
+
+        self.out.write('<vertex int_idx="%s" role="gateway"/>\n' % (vertIdx))
+        return vertNum
+
     def write_vertices(self):
-        vertIdx = 0
         vertNum = 0
         self.out.write('<vertices>\n')
         for vertex in self.gr.nodes():
-            self.vertices[vertex] = (vertIdx,vertNum)
-            self.vert_indices[vertNum] = (vertIdx,vertex)
-            if (re.match(MNXMLWriter.IPREGEX,vertex) or
-                re.match(MNXMLWriter.CLIREGEX,vertex) or
-                re.match(MNXMLWriter.DSTREGEX,vertex)):
-                #This is a IP (virtual node)
-                self.out.write('<vertex int_idx="%s" role="virtnode" int_vn="%s" %s/>\n' %
-                                 (vertIdx,vertNum,self.__node_info(vertex)))
-                                #(vertIdx,vertNum,""))
-                vertNum += 1
-            else:
-                self.out.write('<vertex int_idx="%s" role="gateway"/>\n' % (vertIdx))
-
-            vertIdx += 1
-
+            vertNum = self.add_vertex(vertex,self.gr.node_attributes(vertex),vertNum)
         self.out.write('</vertices>\n')
 
-    def __node_info(self,vertex_id):
-        printset = {'bandwidth (kb/s)':'bw',
-                    'ip address':'ip_address',
-                    'router name':'nickname',
-                    'as':'as',
-                    'nodetype':'nodetype',
-                    'flag - exit':'exit',
-                    'flag - authority':'authority'
-                   }
-        return " %s " % (" ".join(["%s='%s'" % (printset[x[0]],x[1])
-                                    for x in self.gr.node_attributes(vertex_id)
-                                    if x[0] in printset.keys()]))
-
-    def __get_spec(self,edge):
-        if (not re.match(MNXMLWriter.IPREGEX,edge[0])
-            and not re.match(MNXMLWriter.IPREGEX,edge[1])
-            and (not re.match(MNXMLWriter.CLIREGEX,edge[0])
-                and not re.match(MNXMLWriter.CLIREGEX,edge[1]))):
-            return 'stub-stub'
+    def edge_fields(self,endpoint1,endpoint2,table=None,missing=""):
+        """
+        Return the (spec,dbw,ubw) of the link between the
+        vertices <b>endpoint1</b> and <b>endpoint2</b>, where
+        ubw is the bandwidth towards endpoint1 and dbw the
+        bandwidth towards endpoint2. They are taken from a relay
+        endpoint if there is one, and from a client otherwise,
+        and are looked up in <b>table</b> (the formatted fields
+        by default), or are <b>missing</b> if neither is.
+        """
+        if table is None:
+            table = self.bandwidths
+        kind1 = self.kinds[endpoint1]
+        kind2 = self.kinds[endpoint2]
+        if kind1 == RELAY or (kind1 == CLIENT and kind2 != RELAY):
+            dbw,ubw = table[endpoint1]
+        elif kind2 == RELAY or kind2 == CLIENT:
+            ubw,dbw = table[endpoint2]
         else:
-            return 'client-stub'
-
-    def __bandwidth_field(self,edge):
-        if re.match(MNXMLWriter.IPREGEX,edge[0]):
-            return get_attribute(self.gr,edge[0],"bandwidth (kb/s)")
-        if re.match(MNXMLWriter.IPREGEX,edge[1]):
-            return get_attribute(self.gr,edge[1],"bandwidth (kb/s)")
-        if re.match(MNXMLWriter.CLIREGEX,edge[0]):
-            return (get_attribute(self.gr,edge[0],"download_bw"),
-                    get_attribute(self.gr,edge[0],"upload_bw"))
-        if re.match(MNXMLWriter.CLIREGEX,edge[1]):
-            return (get_attribute(self.gr,edge[1],"upload_bw"),
-                    get_attribute(self.gr,edge[1],"download_bw"))
-        return None
+            return 'stub-stub',missing,missing
+        return 'client-stub',dbw,ubw
+
+    def __add_edge_column(self,src,dst,idx,spec,latency,kbps):
+        columns = self.columns
+        columns['sources'].append(src)
+        columns['targets'].append(dst)
+        columns['idx'].append(idx)
+        columns['delay'].append(latency)
+        columns['kbps'].append(kbps)
+        # Coded as in CompactGraph.SPECS
+        columns['spec'].append(0 if spec == 'client-stub' else 1)
+
+    def graph_columns(self):
+        """
+        Return the graph cache columns (see CompactGraph) of
+        the graph written, if the writer was asked to keep them
+        """
+        import numpy as np
+        import CompactGraph
+
+        return dict((name,np.array(self.columns[name],dtype=dtype))
+                    for name,dtype in CompactGraph.CACHE_COLUMNS)
+
+    def write_link(self,endpoint1,endpoint2,latency,allIdx,both=True):
+        """
+        Write the edge from <b>endpoint2</b> to <b>endpoint1</b>
+        with int_idx <b>allIdx</b>, followed by the reverse edge
+        if <b>both</b> is set.
+
+        Returns the next free edge index.
+        """
+        spec,dbw,ubw = self.edge_fields(endpoint1,endpoint2)
+        self.out.write(MNXMLWriter.EDGE % (endpoint1,endpoint2,allIdx,spec,latency,ubw))
+        if self.columns is not None:
+            _,dkbps,ukbps = self.edge_fields(endpoint1,endpoint2,self.kbps,float('nan'))
+            self.__add_edge_column(endpoint2,endpoint1,allIdx,spec,latency,ukbps)
+        allIdx += 1
+
+        if both:
+            # Print the reverse link
+            self.out.write(MNXMLWriter.EDGE % (endpoint2,endpoint1,allIdx,spec,latency,dbw))
+            if self.columns is not None:
+                self.__add_edge_column(endpoint1,endpoint2,allIdx,spec,latency,dkbps)
+            allIdx += 1
+
+        return allIdx
 
     def write_edges(self):
-        self.written = dict()
+        """
+        Write both directions of every link, visiting vertices in
+        int_idx order and each vertex's neighbors in adjacency
+        order. A link is written from its lower numbered end, so
+        each is seen once without remembering what was written.
+        """
         self.out.write('<edges>')
-        edgeIdx = {'client-stub':0,'stub-stub':0}
         allIdx = 0
-        for edge in self.gr.edges():
-            endpoint1 = self.vertices[edge[0]][0]
-            endpoint2 = self.vertices[edge[1]][0]
-            bw = self.__bandwidth_field(edge)
-            if bw is None:
-                dbw,ubw = "",""
-            elif len(bw) == 1:
-                ubw = 'dbl_kbps="%s"' % (BYTES2BITS(bw[0]))
-                dbw = ubw
-            elif len(bw) == 2:
-                (bw1,bw2) = map(lambda x: BYTES2BITS(x[0]),bw) #We assume client BWs are provided in bits/s
-                dbw = 'dbl_kbps="%s"' % bw1
-                ubw = 'dbl_kbps="%s"' % bw2
-            else:
-                dbw,ubw = "",""
-
-
-            line = string.Template(
-                '<edge int_dst="$dst" int_src="$src" int_idx="$idx" specs="$spec" int_delayms="$latency" $bw/>\n')
-
-            attrs = {'dst':endpoint1,
-                     'src':endpoint2,
-                     'idx':allIdx,
-                     'spec':self.__get_spec(edge),
-                     'latency':int(self.gr.edge_weight(edge)),
-                     'bw':ubw
-                    }
-
-            if (endpoint1,endpoint2) not in self.written:
-                self.out.write(line.substitute(attrs))
-                self.written[(endpoint1,endpoint2)] = 1
-                edgeIdx[self.__get_spec(edge)] += 1
-                allIdx += 1
+        for endpoint1,vertex in enumerate(self.names):
+            for neighbor in self.gr.neighbors(vertex):
+                endpoint2 = self.vertices[neighbor][0]
+                if endpoint2 < endpoint1:
+                    continue
 
-            # Print the reverse link
-            attrs['dst'] = endpoint2
-            attrs['src'] = endpoint1
-            attrs['idx'] = allIdx
-            attrs['bw'] = dbw
-
-            if (endpoint2,endpoint1) not in self.written:
-                self.out.write(line.substitute(attrs))
-                self.written[(endpoint2,endpoint1)] = 1
-                edgeIdx[self.__get_spec(edge)] += 1
-                allIdx += 1
+                allIdx = self.write_link(endpoint1,endpoint2,
+                                         int(self.gr.edge_weight((vertex,neighbor))),allIdx,
+                                         both=endpoint1 != endpoint2)
 
         self.out.write('</edges>\n')
 
@@ -161,13 +258,107 @@ class MNXMLWriter():
         self.out.write('<stub-stub dbl_plr="0" dbl_kbps="10000000" int_delayms="0" int_qlen="100"/>\n')
         self.out.write('</specs>\n')
 
-def main_fun(xmlgraphfile):
+class StreamingMNXMLWriter(MNXMLWriter):
+    """
+    Writes a ModelNet .graph file straight from a TorTopology
+    graph file, without building a pygraph graph.
+
+    The file is read twice. The first pass numbers the vertices in
+    document order and writes them out, keeping only the vertex
+    tables. The second pass streams the edges. Each link must be
+    listed in both orientations, as TorTopology writes them, and
+    is emitted once, when it is read in the orientation that
+    leaves the lower numbered vertex.
+    """
+
+    def __init__(self,xmlgraphfile,out,columns=False):
+        MNXMLWriter.__init__(self,None,out,columns)
+        self.xmlgraphfile = xmlgraphfile
+
+    def write_vertices(self):
+        vertNum = 0
+        # Links seen in one orientation and not yet in the other
+        unmatched = set()
+        self.out.write('<vertices>\n')
+        for record in StreamReader.topology_records(self.xmlgraphfile):
+            if record[0] == 'node':
+                vertNum = self.add_vertex(record[1],record[2],vertNum)
+                continue
+
+            _,src,dst,_ = record
+            if src not in self.vertices or dst not in self.vertices:
+                raise ValueError("Edge (%s,%s) comes before its vertices. The streaming "
+                                 "writer needs every <node> before the first <edge>" % (src,dst))
+            if src == dst:
+                continue
+            if (dst,src) in unmatched:
+                unmatched.remove((dst,src))
+            else:
+                unmatched.add((src,dst))
+
+        self.out.write('</vertices>\n')
+
+        if unmatched:
+            src,dst = min(unmatched)
+            raise ValueError("'%s' lists %d links in only one orientation, such as (%s,%s). "
+                             "The streaming writer needs every link in both orientations"
+                             % (self.xmlgraphfile,len(unmatched),src,dst))
+
+    def write_edges(self):
+        self.out.write('<edges>')
+        allIdx = 0
+        for record in StreamReader.topology_records(self.xmlgraphfile):
+            if record[0] != 'edge':
+                continue
+            _,src,dst,wt = record
+            endpoint1 = self.vertices[src][0]
+            endpoint2 = self.vertices[dst][0]
+            if endpoint1 > endpoint2:
+                continue
+
+            allIdx = self.write_link(endpoint1,endpoint2,int(wt),allIdx,
+                                     both=endpoint1 != endpoint2)
+
+        self.out.write('</edges>\n')
+def stream_write(xmlgraphfile,out,columns=False):
+    writer = StreamingMNXMLWriter(xmlgraphfile,out,columns)
+    writer.write_header()
+    writer.write_vertices()
+    writer.write_edges()
+    writer.write_specs()
+    writer.write_close()
+    return writer
+
+def convert(xmlgraphfile,streaming=False,output=None,columns=False):
+    """
+    Write the ModelNet .graph file for the TorTopology file
+    <b>xmlgraphfile</b> to <b>output</b> (stdout if None).
+    Returns the writer, which holds the graph cache columns
+    of the output if <b>columns</b> is True.
+    """
+
+    if streaming:
+        # Write through a large buffer; the output is many small lines
+        if output is None:
+            out = os.fdopen(os.dup(sys.stdout.fileno()),'w',1 << 20)
+        else:
+            out = open(output,'w',1 << 20)
+        try:
+            return stream_write(xmlgraphfile,out,columns)
+        finally:
+            out.close()
 
     with open(xmlgraphfile) as f:
         grstr = f.read()
 
     gr = xmlwriter.read(grstr)
-    write(gr,sys.stdout)
+    if output is None:
+        return write(gr,sys.stdout,columns)
+    with open(output,'w') as out:
+        return write(gr,out,columns)
+
+def main_fun(xmlgraphfile,streaming=False,output=None):
+    convert(xmlgraphfile,streaming,output)
 
 if __name__ == "__main__":
     import argparse
@@ -0,0 +1,176 @@
+"""
+A persistent cache of the virtnodes parsed out of ModelNet
+.model files, so that tools which only need the virtnodes don't
+have to parse the XML again every time they're run.
+
+The cache is a SQLite database with one row per model file,
+holding the virtnode records (in file order) as a zlib
+compressed marshal blob. A row is used if the file's path, size
+and mtime match it, or, failing that, if the file's size and
+SHA-1 hash match, which catches copied or touched files without
+parsing them.
+
+The database is ~/.experimentor_model_cache.sqlite, unless the
+EXPERIMENTOR_MODEL_CACHE environment variable names another.
+"""
+
+import os
+import sys
+import time
+import zlib
+import marshal
+import hashlib
+import sqlite3
+from os.path import expanduser
+
+import StreamReader
+
+DEFAULT_CACHE = os.path.join(expanduser("~"),".experimentor_model_cache.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha1 TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    cached REAL NOT NULL,
+    virtnodes BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS models_sha1 ON models (sha1,size);
+"""
+
+def cache_path():
+    return os.environ.get("EXPERIMENTOR_MODEL_CACHE",DEFAULT_CACHE)
+
+def connect(cache_file=None):
+    """
+    Open the cache database, creating it if need be
+    """
+    db = sqlite3.connect(cache_file or cache_path())
+    db.text_factory = str
+    db.executescript(SCHEMA)
+    return db
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path,'rb') as f:
+        for block in iter(lambda: f.read(1 << 20),''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _store(db,path,size,mtime,sha1,records):
+    db.execute("INSERT OR REPLACE INTO models VALUES (?,?,?,?,?,?,?)",
+               (path,size,mtime,sha1,len(records),time.time(),
+                sqlite3.Binary(zlib.compress(marshal.dumps(records),1))))
+    db.commit()
+
+def _records(blob):
+    return marshal.loads(zlib.decompress(blob))
+
+def _lookup(db,path,st):
+    """
+    Return the records cached for <b>path</b> if its size and
+    mtime in <b>st</b> match the cache, or None
+    """
+    row = db.execute("SELECT size,mtime,virtnodes FROM models WHERE path = ?",(path,)).fetchone()
+    if row is not None and row[0] == st.st_size and row[1] == st.st_mtime:
+        return _records(row[2])
+    return None
+
+def load_virtnodes(model_file,db):
+    """
+    Return the list of virtnode records of <b>model_file</b>
+    from the cache open in <b>db</b>, parsing the file and
+    caching them if they aren't there already.
+    """
+    path = os.path.abspath(model_file)
+    st = os.stat(path)
+
+    records = _lookup(db,path,st)
+    if records is not None:
+        return records
+
+    sha1 = file_sha1(path)
+    row = db.execute("SELECT virtnodes FROM models WHERE sha1 = ? AND size = ?",
+                     (sha1,st.st_size)).fetchone()
+    if row is not None:
+        records = _records(row[0])
+    else:
+        records = list(StreamReader.virtnodes(path))
+    _store(db,path,st.st_size,st.st_mtime,sha1,records)
+    return records
+
+def cached_virtnodes(model_file):
+    """
+    Return the cached virtnode records of <b>model_file</b>, or
+    None if it isn't cached, or has changed since it was. The
+    file is never parsed.
+    """
+    try:
+        db = connect()
+        try:
+            path = os.path.abspath(model_file)
+            return _lookup(db,path,os.stat(path))
+        finally:
+            db.close()
+    except sqlite3.Error:
+        return None
+
+def virtnodes(model_file,use_cache=True):
+    """
+    Return the virtnode records of <b>model_file</b>, through
+    the cache unless <b>use_cache</b> is False. If the cache
+    can't be used, because it can't be opened or is locked,
+    read-only or full, the file is parsed as usual.
+    """
+    if use_cache:
+        try:
+            db = connect()
+            try:
+                return load_virtnodes(model_file,db)
+            finally:
+                db.close()
+        except sqlite3.Error as e:
+            sys.stderr.write("Warning: not using the model cache '%s': %s\n" % (cache_path(),e))
+    return StreamReader.virtnodes(model_file)
+
+def warm(model_files,db):
+    """
+    Make sure every file in <b>model_files</b> is cached.
+    Returns the number of virtnodes in each.
+    """
+    return [len(load_virtnodes(model_file,db)) for model_file in model_files]
+
+def entries(db):
+    """
+    Return (path,size,mtime,sha1,count,cached,stale) for every
+    cached model, where stale is True if the file has changed or
+    gone since it was cached.
+    """
+    ret = []
+    for path,size,mtime,sha1,count,cached in db.execute(
+            "SELECT path,size,mtime,sha1,count,cached FROM models ORDER BY path"):
+        try:
+            st = os.stat(path)
+            stale = (st.st_size,st.st_mtime) != (size,mtime)
+        except OSError:
+            stale = True
+        ret.append((path,size,mtime,sha1,count,cached,stale))
+    return ret
+
+def clear(db,model_files=None):
+    """
+    Remove <b>model_files</b> from the cache, or everything if
+    it is None. Returns the number of entries removed.
+    """
+    if model_files is None:
+        removed = db.execute("DELETE FROM models").rowcount
+    else:
+        removed = sum(db.execute("DELETE FROM models WHERE path = ?",
+                                 (os.path.abspath(path),)).rowcount
+                      for path in model_files)
+    db.commit()
+    if model_files is None:
+        db.execute("VACUUM")
+    return removed
@@ -1,36 +1,200 @@
-from lxml import etree
-import pdb
+"""
+Consistency checks for ModelNet .model files.
 
+Hops name their endpoints by int_idx, which is the int_idx of a
+virtnode or of a gateway that only appears in the hops. The file
+is read in a single pass, keeping just the integer ids of each
+virtnode and hop in packed arrays, so checking a model with
+millions of hops needs a few tens of bytes per hop.
+"""
 
-def check_model(modelfile):
+from array import array
 
-    with open(modelfile) as f:
-        tree = etree.parse(f)
+import numpy as np
 
-    virtnodes = tree.xpath("//virtnode")
-    hops = tree.xpath('//hop')
+import StreamReader
 
-    pdb.set_trace()
-    nodehash = dict()
-    for node in virtnodes:
-        nodehash[node.get('int_vn')] = dict()
+"""
+The number of examples of each problem check_model keeps
+"""
+EXAMPLES = 10
 
-    missing =[]
+"""
+Ids must be below this, so a hop's (src,dst) pair fits in one int64
+"""
+MAX_ID = 1 << 31
 
-    for hop in hops:
-        if hop.get('int_dst') in nodehash:
-            nodehash[hop.get('int_dst')]['dst_hop'] = hop.get('int_idx')
-        else:
-            print "Hop %s has nonexistent dst %s" % (hop.get('int_idx'),hop.get('int_dst')) 
-            missing.append(hop)
-        
-        if hop.get('int_src') in nodehash:
-            nodehash[hop.get('int_src')]['src_hop'] = hop.get('int_idx')
-        else:
-            print "Hop %s has nonexistent src %s" % (hop.get('int_idx'),hop.get('int_src')) 
-            missing.append(hop)
+class ConsistencyReport(object):
+    """
+    The problems a consistency check found. counts maps each of
+    PROBLEMS to the number found, and examples maps it to
+    descriptions of the first few, in file order. checked lists
+    what was read, for the report's header, and problems the
+    PROBLEMS that were looked for.
+    """
 
-    goodnodes = filter(lambda x: any(['dst_hop' not in x[1],'src_hop' not in x[1]]),nodehash.iteritems())
+    PROBLEMS = ()
+    DESCRIPTIONS = {}
 
-    print "%s nodes missing hops; %s hops missing nodes" % (len(goodnodes),len(missing))
+    def __init__(self,max_examples=EXAMPLES):
+        self.max_examples = max_examples
+        self.checked = []
+        self.problems = list(self.PROBLEMS)
+        self.counts = dict((problem,0) for problem in self.PROBLEMS)
+        self.examples = dict((problem,[]) for problem in self.PROBLEMS)
 
+    def found(self,problem,items,describe,count=None):
+        """
+        Record the problems in the sequence <b>items</b>, using
+        describe(item) to describe the first few. If only the
+        first few items were kept, <b>count</b> is how many
+        there were.
+        """
+        self.counts[problem] += len(items) if count is None else count
+        examples = self.examples[problem]
+        for item in items[:self.max_examples - len(examples)]:
+            examples.append(describe(item))
+
+    def ok(self):
+        return not any(self.counts.itervalues())
+
+    def write(self,out):
+        for checked in self.checked:
+            out.write("Checked %s\n" % checked)
+        for problem in self.problems:
+            out.write("%8d %s\n" % (self.counts[problem],self.DESCRIPTIONS[problem]))
+            for example in self.examples[problem]:
+                out.write("           %s\n" % example)
+            if self.counts[problem] > len(self.examples[problem]):
+                out.write("           ...\n")
+
+class ModelReport(ConsistencyReport):
+    """
+    The problems check_model found in a model file
+    """
+
+    PROBLEMS = ('malformed','duplicate_virtnodes','duplicate_vns','duplicate_hops',
+                'dangling_hops','unattached_virtnodes','asymmetric_hops')
+
+    DESCRIPTIONS = {
+        'malformed':"records with missing or non-integer ids",
+        'duplicate_virtnodes':"int_idx values shared by more than one virtnode",
+        'duplicate_vns':"int_vn values shared by more than one virtnode",
+        'duplicate_hops':"int_idx values shared by more than one hop",
+        'dangling_hops':"hops with an endpoint that is neither a virtnode nor "
+                        "a gateway with hops both in and out",
+        'unattached_virtnodes':"virtnodes without both an outgoing and an incoming hop",
+        'asymmetric_hops':"hops without a hop in the opposite direction"}
+
+def _ints(values):
+    if not values:
+        return np.zeros(0,dtype=np.int_)
+    return np.frombuffer(values,dtype=np.int_)
+
+def _duplicated(values):
+    """
+    Return the sorted distinct values that occur more than once
+    in <b>values</b>
+    """
+    values = np.sort(values)
+    return np.unique(values[1:][values[1:] == values[:-1]])
+
+def read_model_columns(model_file,report):
+    """
+    Read the ids of the virtnodes and hops in <b>model_file</b>
+    into a dict of int arrays: 'vn_idx' and 'vn' (the int_idx and
+    int_vn of each virtnode) and 'hop_idx', 'hop_src' and
+    'hop_dst' (the int_idx, int_src and int_dst of each hop), all
+    in file order. Records with bad ids are left out, and counted
+    as 'malformed' in <b>report</b>.
+    """
+    vn_idx = array('l')
+    vn_vn = array('l')
+    hop_idx = array('l')
+    hop_src = array('l')
+    hop_dst = array('l')
+
+    malformed = []
+    bad = 0
+    for record in StreamReader.model_records(model_file):
+        try:
+            if record[0] == 'hop':
+                idx,src,dst = int(record[1]),int(record[2]),int(record[3])
+                if not (0 <= idx < MAX_ID and 0 <= src < MAX_ID and 0 <= dst < MAX_ID):
+                    raise ValueError
+                hop_idx.append(idx)
+                hop_src.append(src)
+                hop_dst.append(dst)
+            else:
+                idx,vn = int(record[1]),int(record[2])
+                if not (0 <= idx < MAX_ID and 0 <= vn < MAX_ID):
+                    raise ValueError
+                vn_idx.append(idx)
+                vn_vn.append(vn)
+        except (TypeError,ValueError):
+            bad += 1
+            if len(malformed) < report.max_examples:
+                malformed.append(record)
+    report.found('malformed',malformed,
+                 lambda record: "%s %s" % (record[0],
+                                           " ".join(str(value) for value in record[1:])),
+                 bad)
+
+    report.checked.append("%d virtnodes and %d hops in '%s'"
+                          % (len(vn_idx),len(hop_idx),model_file))
+    return dict(vn_idx=_ints(vn_idx),vn=_ints(vn_vn),hop_idx=_ints(hop_idx),
+                hop_src=_ints(hop_src),hop_dst=_ints(hop_dst))
+
+def check_model(model_file,max_examples=EXAMPLES):
+    """
+    Check <b>model_file</b> for hops that lead nowhere, virtnodes
+    no hop reaches, duplicated ids and links that only go one way.
+    Returns a ModelReport with up to <b>max_examples</b>
+    examples of each problem.
+    """
+    report = ModelReport(max_examples)
+    columns = read_model_columns(model_file,report)
+    vn_idx,vn_vn = columns['vn_idx'],columns['vn']
+    hop_idx,hop_src,hop_dst = columns['hop_idx'],columns['hop_src'],columns['hop_dst']
+    del columns
+
+    def hop(i):
+        return "hop %d: %d -> %d" % (hop_idx[i],hop_src[i],hop_dst[i])
+
+    def virtnode(i):
+        return "virtnode %d (int_vn %d)" % (vn_idx[i],vn_vn[i])
+
+    for problem,values,name in (('duplicate_virtnodes',vn_idx,"virtnode"),
+                                ('duplicate_vns',vn_vn,"int_vn"),
+                                ('duplicate_hops',hop_idx,"hop")):
+        report.found(problem,_duplicated(values),
+                     lambda value,name=name,values=values:
+                         "%s %d, %d times" % (name,value,np.count_nonzero(values == value)))
+
+    # Number the distinct vertex ids densely, so the flags below
+    # take a byte per vertex that appears, however large its id.
+    _,ranks = np.unique(np.concatenate((vn_idx,hop_src,hop_dst)),return_inverse=True)
+    vn_rank,src_rank,dst_rank = np.split(ranks,[len(vn_idx),len(vn_idx) + len(hop_src)])
+    size = int(ranks.max()) + 1 if len(ranks) else 0
+
+    # A flag per vertex for each of: is a virtnode, has a hop out,
+    # has a hop in.
+    is_virtnode = np.zeros(size,dtype=bool)
+    is_virtnode[vn_rank] = True
+    has_out = np.zeros(size,dtype=bool)
+    has_out[src_rank] = True
+    has_in = np.zeros(size,dtype=bool)
+    has_in[dst_rank] = True
+
+    reachable = is_virtnode | (has_in & has_out)
+    report.found('dangling_hops',np.flatnonzero(~(reachable[src_rank] & reachable[dst_rank])),hop)
+
+    attached = (has_in & has_out)[vn_rank]
+    report.found('unattached_virtnodes',np.flatnonzero(~attached),virtnode)
+
+    # A hop is symmetric if its reverse is among the (src,dst)
+    # keys of all the hops.
+    symmetric = np.in1d((hop_dst << 32) | hop_src,(hop_src << 32) | hop_dst)
+    report.found('asymmetric_hops',np.flatnonzero(~symmetric),hop)
+
+    return report
@@ -0,0 +1,478 @@
+import os
+import re
+import shutil
+import sys
+from array import array
+
+import numpy as np
+
+PATHREGEX = re.compile("\s*<path\s+int_vndst=\"([0-9]+)\"\s+int_vnsrc=\"([0-9]+)\"\s+hops=\"([0-9 ]*)\"\s*/>")
+
+"""
+Route index files are a 16 byte header (the magic string and
+the number of entries as a little endian uint64), followed by
+one (key, offset) pair of little endian uint64s per <path> line,
+sorted by key. The key is (int_vnsrc << 32) | int_vndst, and the
+offset is the byte offset of the line in the route file.
+"""
+INDEX_MAGIC = "MNRIDX1\0"
+INDEX_DTYPE = np.dtype([('key','<u8'),('offset','<u8')])
+INDEX_SUFFIX = ".idx"
+
+def index_path(route_file):
+    return route_file + INDEX_SUFFIX
+
+def route_key(src,dst):
+    return (int(src) << 32) | int(dst)
+
+def build_route_index(route_file,index_file=None):
+    """
+    Scan <b>route_file</b> once and write an index mapping each
+    (int_vnsrc,int_vndst) pair to the byte offset of its <path>
+    line. Returns the path to the index file.
+    """
+    if index_file is None:
+        index_file = index_path(route_file)
+
+    keys = array('L')
+    offsets = array('L')
+
+    offset = 0
+    with open(route_file,'rb') as f:
+        for line in f:
+            m = PATHREGEX.match(line)
+            if m:
+                keys.append(route_key(m.group(2),m.group(1)))
+                offsets.append(offset)
+            offset += len(line)
+
+    index = np.empty(len(keys),dtype=INDEX_DTYPE)
+    index['key'] = np.frombuffer(keys,dtype='u%d' % keys.itemsize)
+    index['offset'] = np.frombuffer(offsets,dtype='u%d' % offsets.itemsize)
+    del keys, offsets
+    index.sort(order='key',kind='mergesort')
+
+    if len(index) > 1 and (index['key'][1:] == index['key'][:-1]).any():
+        sys.stderr.write("Warning: '%s' contains duplicate paths. Only the "
+                         "first of each will be found through the index\n" % route_file)
+
+    with open(index_file,'wb') as out:
+        out.write(INDEX_MAGIC)
+        out.write(np.array([len(index)],dtype='<u8').tostring())
+        index.tofile(out)
+
+    return index_file
+
+class RouteIndex(object):
+    """
+    Random access to the <path> lines of a route file through
+    an index written by build_route_index(). Lookups binary
+    search the memory mapped index and seek directly to the line.
+    """
+
+    def __init__(self,route_file,index_file=None):
+        if index_file is None:
+            index_file = index_path(route_file)
+
+        with open(index_file,'rb') as f:
+            header = f.read(16)
+        if len(header) != 16 or header[:8] != INDEX_MAGIC:
+            raise IOError("'%s' is not a route index file" % index_file)
+        count = int(np.frombuffer(header[8:],dtype='<u8')[0])
+
+        if count:
+            index = np.memmap(index_file,dtype=INDEX_DTYPE,mode='r',
+                              offset=16,shape=(count,))
+            self.keys = index['key']
+            self.offsets = index['offset']
+        else:
+            self.keys = self.offsets = np.empty(0,dtype='<u8')
+        self.routes = open(route_file,'rb')
+
+    def offset(self,src,dst):
+        """
+        Return the byte offset of the path from <b>src</b> to
+        <b>dst</b>, or None if the route file doesn't contain it.
+        """
+        key = np.uint64(route_key(src,dst))
+        pos = int(np.searchsorted(self.keys,key))
+        if pos == len(self.keys) or self.keys[pos] != key:
+            return None
+        return int(self.offsets[pos])
+
+    def lookup(self,src,dst):
+        """
+        Return the list of hops on the path from <b>src</b>
+        to <b>dst</b>, or None if there isn't one.
+        """
+        offset = self.offset(src,dst)
+        if offset is None:
+            return None
+
+        self.routes.seek(offset)
+        m = PATHREGEX.match(self.routes.readline())
+        if not m:
+            return None
+        return map(int,m.group(3).split())
+
+    def close(self):
+        self.routes.close()
+
+def open_route_index(route_file):
+    """
+    Return a RouteIndex for <b>route_file</b> if it has an index
+    that is at least as new as the route file, or None otherwise.
+    """
+    idx = index_path(route_file)
+    try:
+        if os.path.getmtime(idx) < os.path.getmtime(route_file):
+            sys.stderr.write("Warning: ignoring route index '%s' because it is "
+                             "older than '%s'\n" % (idx,route_file))
+            return None
+    except OSError:
+        return None
+
+    return RouteIndex(route_file,idx)
+
+"""
+Binary route files hold the same paths as an <allpairs> XML
+route file in a fraction of the space. The layout is:
+
+    magic       BINARY_MAGIC (8 bytes)
+    blocks      one block per source, in the order they were written
+    index       one (src, offset) pair of little endian uint64s per
+                block, sorted by src, in the same layout as a route
+                index file
+    trailer     the number of blocks as a little endian uint64,
+                followed by BINARY_END (8 bytes)
+
+Each block is the varints src, count and length, followed by
+length bytes of varints: the count destinations (zigzag deltas
+from the previous destination), the count hop list lengths, and
+then every hop of every path concatenated (zigzag deltas from the
+previous hop in the block). Varints are little endian base 128.
+"""
+BINARY_MAGIC = "MNRTBIN1"
+BINARY_END = "MNRTEND1"
+
+XML_HEADER = '<?xml version="1.0" encoding="ISO-8859-1"?>\n<allpairs>\n'
+XML_FOOTER = '</allpairs>\n'
+
+def encode_varints(values):
+    """
+    Encode an array of non-negative integers as varints
+    """
+    values = np.asarray(values,dtype=np.uint64)
+    nbytes = np.ones(len(values),dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        nbytes += rest != 0
+        rest >>= np.uint64(7)
+
+    ends = np.cumsum(nbytes)
+    which = np.repeat(np.arange(len(values)),nbytes)
+    pos = np.arange(ends[-1] if len(ends) else 0) - (ends - nbytes)[which]
+    encoded = ((values[which] >> (np.uint64(7) * pos.astype(np.uint64))) & np.uint64(0x7f)).astype(np.uint8)
+    encoded[pos < nbytes[which] - 1] |= 0x80
+    return encoded.tostring()
+
+def decode_varints(data):
+    """
+    Decode a string of varints into an array of uint64s
+    """
+    encoded = np.frombuffer(data,dtype=np.uint8)
+    ends = np.flatnonzero(encoded < 0x80)
+    if len(ends) == 0:
+        return np.empty(0,dtype=np.uint64)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    pos = np.arange(len(encoded)) - np.repeat(starts,ends - starts + 1)
+    shifted = (encoded & 0x7f).astype(np.uint64) << (np.uint64(7) * pos.astype(np.uint64))
+    return np.bitwise_or.reduceat(shifted,starts)
+
+def zigzag(values):
+    values = np.asarray(values,dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+def unzigzag(values):
+    values = np.asarray(values,dtype=np.uint64)
+    return ((values >> np.uint64(1)).view(np.int64) ^ -(values & np.uint64(1)).view(np.int64))
+
+def _read_varint(f):
+    value = shift = 0
+    while True:
+        byte = f.read(1)
+        if not byte:
+            raise EOFError
+        value |= (ord(byte) & 0x7f) << shift
+        if ord(byte) < 0x80:
+            return value
+        shift += 7
+
+def is_binary(route_file):
+    """
+    Return True if <b>route_file</b> is a binary route file
+    """
+    with open(route_file,'rb') as f:
+        return f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+class XMLRouteWriter(object):
+    """
+    Write paths as an <allpairs> XML route file. If
+    <b>header</b> is False, only the <path> lines are written,
+    as in the shards written by allpairs workers.
+    """
+
+    def __init__(self,out,header=True):
+        self.out = out
+        self.header = header
+        if header:
+            out.write(XML_HEADER)
+            out.flush()
+
+    def write_source(self,src,routes):
+        """
+        Write the paths from <b>src</b>, given as an iterable
+        of (dst,hops) pairs
+        """
+        for dst,hops in routes:
+            self.out.write('<path int_vndst="%d" int_vnsrc="%d" hops="%s"/>\n'
+                           % (dst,src," ".join(map(str,hops))))
+
+    def copy_shard(self,shard):
+        """
+        Append the paths from a headerless shard file
+        """
+        shutil.copyfileobj(shard,self.out)
+
+    def close(self):
+        if self.header:
+            self.out.write(XML_FOOTER)
+        self.out.flush()
+
+class BinaryRouteWriter(object):
+    """
+    Write paths as a binary route file. If <b>header</b> is
+    False, only the blocks are written, as in the shards
+    written by allpairs workers.
+    """
+
+    def __init__(self,out,header=True):
+        self.out = out
+        self.header = header
+        self.offset = 0
+        self.sources = array('L')
+        self.offsets = array('L')
+        if header:
+            self._write(BINARY_MAGIC)
+
+    def _write(self,data):
+        self.out.write(data)
+        self.offset += len(data)
+
+    def _write_block(self,src,count,payload):
+        self.sources.append(src)
+        self.offsets.append(self.offset)
+        self._write(encode_varints([src,count,len(payload)]))
+        self._write(payload)
+
+    def write_source(self,src,routes):
+        """
+        Write the paths from <b>src</b>, given as an iterable
+        of (dst,hops) pairs
+        """
+        dsts = array('l')
+        lengths = array('l')
+        hops = array('l')
+        for dst,path in routes:
+            dsts.append(dst)
+            lengths.append(len(path))
+            hops.extend(map(int,path))
+        if len(dsts) == 0:
+            return
+
+        dsts = np.array(dsts,dtype=np.int64)
+        hops = np.array(hops,dtype=np.int64)
+        payload = encode_varints(np.concatenate((zigzag(_deltas(dsts)),
+                                                 np.array(lengths,dtype=np.uint64),
+                                                 zigzag(_deltas(hops)))))
+        self._write_block(src,len(dsts),payload)
+
+    def copy_shard(self,shard):
+        """
+        Append the blocks from a headerless shard file
+        """
+        while True:
+            try:
+                src = _read_varint(shard)
+            except EOFError:
+                return
+            count = _read_varint(shard)
+            payload = shard.read(_read_varint(shard))
+            self._write_block(src,count,payload)
+
+    def close(self):
+        if self.header:
+            index = np.empty(len(self.sources),dtype=INDEX_DTYPE)
+            index['key'] = np.frombuffer(self.sources,dtype='u%d' % self.sources.itemsize)
+            index['offset'] = np.frombuffer(self.offsets,dtype='u%d' % self.offsets.itemsize)
+            index.sort(order='key',kind='mergesort')
+            self._write(index.tostring())
+            self._write(np.array([len(index)],dtype='<u8').tostring())
+            self._write(BINARY_END)
+        self.out.flush()
+
+def _deltas(values):
+    deltas = values.copy()
+    deltas[1:] -= values[:-1]
+    return deltas
+
+class BinaryRouteReader(object):
+    """
+    Random access to the paths in a binary route file. The
+    block index is memory mapped, and a lookup only decodes
+    the block for the path's source.
+    """
+
+    def __init__(self,route_file):
+        self.routes = open(route_file,'rb')
+        if self.routes.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise IOError("'%s' is not a binary route file" % route_file)
+
+        self.routes.seek(-16,os.SEEK_END)
+        trailer = self.routes.read(16)
+        if trailer[8:] != BINARY_END:
+            raise IOError("'%s' is truncated" % route_file)
+        count = int(np.frombuffer(trailer[:8],dtype='<u8')[0])
+        end = self.routes.tell() - 16
+
+        if count:
+            index = np.memmap(route_file,dtype=INDEX_DTYPE,mode='r',
+                              offset=end - count * INDEX_DTYPE.itemsize,shape=(count,))
+            self.keys = index['key']
+            self.offsets = index['offset']
+        else:
+            self.keys = self.offsets = np.empty(0,dtype='<u8')
+
+    def _read_block(self,offset):
+        """
+        Decode the block at <b>offset</b> into (src,dsts,lengths,hops)
+        arrays
+        """
+        self.routes.seek(offset)
+        src = _read_varint(self.routes)
+        count = _read_varint(self.routes)
+        values = decode_varints(self.routes.read(_read_varint(self.routes)))
+        dsts = np.cumsum(unzigzag(values[:count]))
+        lengths = values[count:2*count].astype(np.int64)
+        hops = np.cumsum(unzigzag(values[2*count:]))
+        return src,dsts,lengths,hops
+
+    def blocks(self):
+        """
+        Yield (src,dsts,lengths,hops) for each block in file order,
+        where hops holds the hop lists of all of the paths in the
+        block concatenated, and lengths the length of each one.
+        """
+        for offset in np.sort(self.offsets):
+            yield self._read_block(int(offset))
+
+    def lookup(self,src,dst):
+        """
+        Return the list of hops on the path from <b>src</b>
+        to <b>dst</b>, or None if there isn't one.
+        """
+        first = np.searchsorted(self.keys,np.uint64(src),'left')
+        last = np.searchsorted(self.keys,np.uint64(src),'right')
+        for offset in self.offsets[first:last]:
+            _,dsts,lengths,hops = self._read_block(int(offset))
+            found = np.flatnonzero(dsts == dst)
+            if len(found):
+                i = found[0]
+                start = lengths[:i].sum()
+                return hops[start:start + lengths[i]].tolist()
+        return None
+
+    def close(self):
+        self.routes.close()
+
+def iter_blocks(route_file):
+    """
+    Yield (src,dsts,lengths,hops) arrays for each run of paths
+    from the same source in an XML or binary route file. See
+    BinaryRouteReader.blocks().
+    """
+    if is_binary(route_file):
+        reader = BinaryRouteReader(route_file)
+        try:
+            for block in reader.blocks():
+                yield block
+        finally:
+            reader.close()
+        return
+
+    def block(src,dsts,lengths,hops):
+        return (src,np.array(dsts,dtype=np.int64),
+                np.array(lengths,dtype=np.int64),np.array(hops,dtype=np.int64))
+
+    current = None
+    with open(route_file) as f:
+        for line in f:
+            m = PATHREGEX.match(line)
+            if not m:
+                continue
+            src = int(m.group(2))
+            if src != current:
+                if current is not None:
+                    yield block(current,dsts,lengths,hops)
+                current = src
+                dsts,lengths,hops = array('l'),array('l'),array('l')
+            path = map(int,m.group(3).split())
+            dsts.append(int(m.group(1)))
+            lengths.append(len(path))
+            hops.extend(map(int,path))
+    if current is not None:
+        yield block(current,dsts,lengths,hops)
+
+def block_routes(dsts,lengths,hops):
+    """
+    Split a block from iter_blocks() into (dst,hops) pairs
+    """
+    ends = np.cumsum(lengths)
+    hops = hops.tolist()
+    start = 0
+    for dst,end in zip(dsts.tolist(),ends.tolist()):
+        yield dst,hops[start:end]
+        start = end
+
+def convert_routes(route_file,out):
+    """
+    Convert an XML route file to a binary one or vice versa,
+    writing the result to <b>out</b>. Converting an allpairs
+    route file to binary and back gives back the same file.
+    """
+    if is_binary(route_file):
+        writer = XMLRouteWriter(out)
+    else:
+        writer = BinaryRouteWriter(out)
+
+    for src,dsts,lengths,hops in iter_blocks(route_file):
+        writer.write_source(src,block_routes(dsts,lengths,hops))
+    writer.close()
+
+"""
+The route writer classes, by the name of their format
+"""
+ROUTE_WRITERS = {'xml':XMLRouteWriter,'binary':BinaryRouteWriter}
+
+def open_route_reader(route_file):
+    """
+    Return an object whose lookup(src,dst) method finds paths in
+    <b>route_file</b> without scanning it: a BinaryRouteReader
+    for binary route files, or a RouteIndex for indexed XML ones.
+    Returns None for XML route files without a usable index.
+    """
+    if is_binary(route_file):
+        return BinaryRouteReader(route_file)
+    return open_route_index(route_file)
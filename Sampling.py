@@ -0,0 +1,334 @@
+"""
+Vectorized samplers for choosing relays, or any other weighted
+items.
+
+Each sampler is called as sampler(weights,n,rng) with an array of
+non-negative weights (a relay's bw) and returns the sorted
+positions of n distinct items, so a list sorted by bandwidth stays
+sorted. Draws come from <b>rng</b>, a numpy RandomState, or from
+the numpy.random module if it is None. Items are weighted equally
+if all of the weights are zero.
+
+Seeded runs thread one random.Random through, and give the numpy
+samplers a RandomState drawn from it with numpy_rng(). Work split
+across processes gets a stream per piece from derive_seed(), so
+the numbers drawn don't depend on how many processes there are.
+"""
+
+import struct
+import hashlib
+
+import numpy as np
+
+"""
+The number of rounds of alias table draws weighted() makes before
+drawing the rest of its sample with Efraimidis-Spirakis keys
+"""
+WEIGHTED_ROUNDS = 8
+
+def _rng(rng):
+    return np.random if rng is None else rng
+
+def numpy_rng(rng):
+    """
+    Return a numpy RandomState seeded from the random.Random
+    (or the random module) <b>rng</b>
+    """
+    return np.random.RandomState(rng.getrandbits(32))
+
+def derive_seed(seed,index):
+    """
+    Return the 32 bit seed of stream <b>index</b> of the streams
+    derived from <b>seed</b>
+    """
+    return struct.unpack("<I",hashlib.sha1("%d %d" % (seed,index)).digest()[:4])[0]
+
+def _weights(weights):
+    weights = np.asarray(weights,dtype=np.float64)
+    if len(weights) and ((weights < 0).any() or not np.isfinite(weights).all()):
+        raise ValueError("Weights must be finite and non-negative")
+    if not weights.sum() > 0:
+        return np.ones(len(weights))
+    return weights
+
+def _check(count,n):
+    if n < 0 or n > count:
+        raise ValueError("Can't choose %d of %d items" % (n,count))
+
+class AliasTable(object):
+    """
+    Walker's alias method. The table takes O(n) to build, after
+    which each draw of an item, with probability proportional to
+    its weight in <b>weights</b>, takes O(1): pick a column
+    uniformly, then keep it with probability prob[column] or take
+    its alias.
+    """
+
+    def __init__(self,weights):
+        weights = _weights(weights)
+        count = len(weights)
+        prob = weights * (count / weights.sum()) if count else weights
+        alias = np.arange(count)
+
+        # Vose's construction, a round at a time: every column
+        # under 1 is topped up from the column over 1 whose share
+        # of the excess its deficit starts in. Columns that give
+        # away more than their excess drop under 1 and are topped
+        # up in the next round.
+        small = np.flatnonzero(prob < 1)
+        large = np.flatnonzero(prob >= 1)
+        while len(small) and len(large):
+            deficit = 1 - prob[small]
+            excess = np.cumsum(prob[large] - 1)
+            donor = np.minimum(np.searchsorted(excess,np.cumsum(deficit) - deficit,'right'),
+                               len(large) - 1)
+            alias[small] = large[donor]
+            prob[large] -= np.bincount(donor,weights=deficit,minlength=len(large))
+            emptied = prob[large] < 1
+            small,large = large[emptied],large[~emptied]
+        # Whatever is left over is only off by rounding
+        prob[small] = 1
+        prob[large] = 1
+
+        self.prob = prob
+        self.alias = alias
+
+    def __len__(self):
+        return len(self.prob)
+
+    def draw(self,size,rng=None):
+        """
+        Return an array of <b>size</b> positions drawn with
+        replacement
+        """
+        rng = _rng(rng)
+        column = rng.randint(len(self.prob),size=size)
+        return np.where(rng.random_sample(size) < self.prob[column],column,self.alias[column])
+
+def uniform(weights,n,rng=None):
+    """
+    Split the items into n runs of (nearly) equal length and
+    choose one from each uniformly. The weights are ignored,
+    except that on a list sorted by bandwidth this spreads the
+    sample across the whole range.
+    """
+    count = len(weights)
+    _check(count,n)
+    if n == 0:
+        return np.zeros(0,dtype=np.int64)
+    bounds = (np.arange(n + 1) * count) // n
+    return bounds[:-1] + (_rng(rng).random_sample(n) * np.diff(bounds)).astype(np.int64)
+
+def stratified(weights,n,rng=None):
+    """
+    Split the items into n runs of (nearly) equal length, as
+    uniform() does, but choose one from each in proportion to
+    its weight within the run.
+    """
+    weights = _weights(weights)
+    count = len(weights)
+    _check(count,n)
+    if n == 0:
+        return np.zeros(0,dtype=np.int64)
+    rng = _rng(rng)
+
+    bounds = (np.arange(n + 1) * count) // n
+    cumulative = np.concatenate(([0.0],np.cumsum(weights)))
+    low = cumulative[bounds[:-1]]
+    high = cumulative[bounds[1:]]
+    points = low + rng.random_sample(n) * (high - low)
+    chosen = np.clip(np.searchsorted(cumulative,points,'right') - 1,bounds[:-1],bounds[1:] - 1)
+
+    # Runs with no weight at all fall back to a uniform choice
+    weightless = np.flatnonzero(high <= low)
+    chosen[weightless] = bounds[weightless] + (rng.random_sample(len(weightless))
+                                               * np.diff(bounds)[weightless]).astype(np.int64)
+    return chosen
+
+def systematic(weights,n,rng=None):
+    """
+    Systematic sampling with probability proportional to weight:
+    the items are laid end to end by weight and chosen at n
+    evenly spaced points from a random start. Items whose weight
+    is at least the spacing would be hit more than once, so they
+    are taken outright and the spacing worked out again for the
+    rest.
+    """
+    weights = _weights(weights)
+    count = len(weights)
+    _check(count,n)
+
+    chosen = np.zeros(count,dtype=bool)
+    remaining = n
+    while remaining:
+        total = weights[~chosen].sum()
+        if not total > 0:
+            break
+        certain = np.flatnonzero(~chosen & (weights * remaining >= total))
+        if len(certain) == 0:
+            break
+        certain = certain[:remaining]
+        chosen[certain] = True
+        remaining -= len(certain)
+
+    if remaining:
+        rest = np.flatnonzero(~chosen)
+        cumulative = np.cumsum(_weights(weights[rest]))
+        step = cumulative[-1] / remaining
+        points = (_rng(rng).random_sample() + np.arange(remaining)) * step
+        chosen[rest[np.minimum(np.searchsorted(cumulative,points,'right'),len(rest) - 1)]] = True
+    return np.flatnonzero(chosen)
+
+def _weighted_keys(weights,n,rng):
+    """
+    Efraimidis-Spirakis weighted sampling without replacement:
+    give each item the key log(u)/weight and keep the n largest.
+    Items with no weight only make up the numbers, chosen
+    uniformly.
+    """
+    positive = np.flatnonzero(weights > 0)
+    if len(positive) <= n:
+        zero = np.flatnonzero(weights <= 0)
+        return np.concatenate((positive,zero[rng.permutation(len(zero))[:n - len(positive)]]))
+    keys = np.log(rng.random_sample(len(positive))) / weights[positive]
+    return positive[np.argpartition(-keys,n - 1)[:n]]
+
+def weighted(weights,n,rng=None,table=None):
+    """
+    Choose n items, each in proportion to its weight among the
+    items not chosen yet, by drawing from an AliasTable of the
+    weights (or <b>table</b>, if given) and discarding repeats.
+    If there are still items to choose after WEIGHTED_ROUNDS
+    rounds of draws, as happens when n is most of the items,
+    the rest are chosen with Efraimidis-Spirakis keys, which
+    gives the same distribution.
+    """
+    weights = _weights(weights)
+    count = len(weights)
+    _check(count,n)
+    rng = _rng(rng)
+
+    chosen = np.zeros(count,dtype=bool)
+    found = 0
+    if n <= count // 2:
+        if table is None:
+            table = AliasTable(weights)
+        for _ in xrange(WEIGHTED_ROUNDS):
+            if found == n:
+                break
+            draws = table.draw(2 * (n - found),rng)
+            draws = draws[~chosen[draws]]
+            _,first = np.unique(draws,return_index=True)
+            new = draws[np.sort(first)][:n - found]
+            chosen[new] = True
+            found += len(new)
+
+    if found < n:
+        rest = np.flatnonzero(~chosen)
+        chosen[rest[_weighted_keys(weights[rest],n - found,rng)]] = True
+    return np.flatnonzero(chosen)
+
+"""
+The samplers, by name
+"""
+SAMPLERS = {'uniform':uniform,
+            'stratified':stratified,
+            'systematic':systematic,
+            'weighted':weighted}
+
+def sample_with_quotas(sampler,weights,n,quotas=(),rng=None):
+    """
+    Choose <b>n</b> items with <b>sampler</b>, making sure there
+    are at least minimum of the items in mask for each
+    (name,mask,minimum) in <b>quotas</b>. Each quota is filled
+    first, with the same sampler, from the items in its mask
+    that haven't been chosen yet; the rest of the sample is then
+    chosen from all of the items left. Returns the sorted
+    positions of the items.
+
+    @raise ValueError if there aren't enough items to meet a quota
+    """
+    weights = _weights(weights)
+    count = len(weights)
+    _check(count,n)
+    rng = _rng(rng)
+
+    chosen = np.zeros(count,dtype=bool)
+    for name,mask,minimum in quotas:
+        mask = np.asarray(mask,dtype=bool)
+        needed = minimum - np.count_nonzero(chosen & mask)
+        if needed <= 0:
+            continue
+        pool = np.flatnonzero(mask & ~chosen)
+        if len(pool) < needed:
+            raise ValueError("Can't choose %d %s: there are only %d"
+                             % (minimum,name,np.count_nonzero(mask)))
+        if needed > n - np.count_nonzero(chosen):
+            raise ValueError("Can't choose %d %s in a sample of %d" % (minimum,name,n))
+        chosen[pool[sampler(weights[pool],needed,rng)]] = True
+
+    pool = np.flatnonzero(~chosen)
+    chosen[pool[sampler(weights[pool],n - np.count_nonzero(chosen),rng)]] = True
+    return np.flatnonzero(chosen)
+
+"""
+The columns of a circuit, and the order they are drawn in: the
+exit first, as Tor does, then the guard, then the middle
+"""
+GUARD,MIDDLE,EXIT = range(3)
+CIRCUIT_ORDER = (EXIT,GUARD,MIDDLE)
+
+"""
+The number of times CircuitSampler.sample() redraws the relays
+that repeat one already in their circuit before giving up
+"""
+CIRCUIT_ROUNDS = 100
+
+class CircuitSampler(object):
+    """
+    Draw (guard,middle,exit) circuits of three distinct relays,
+    each chosen in proportion to its weight in <b>weights</b>
+    from the relays allowed in its position: exits from those
+    marked in <b>exits</b>, guards from those marked in
+    <b>guards</b> and middles from any relay. Each position has
+    its own AliasTable, so a circuit costs O(1) however many
+    relays there are.
+
+    @raise ValueError if a position has no relays to choose from
+    """
+
+    def __init__(self,weights,exits,guards):
+        weights = _weights(weights)
+        pools = {GUARD:np.flatnonzero(guards),
+                 MIDDLE:np.arange(len(weights)),
+                 EXIT:np.flatnonzero(exits)}
+        if len(weights) < 3:
+            raise ValueError("Circuits need at least 3 relays, but there are %d" % len(weights))
+        for position,name in ((GUARD,"guards"),(EXIT,"exits")):
+            if len(pools[position]) == 0:
+                raise ValueError("There are no %s to build circuits with" % name)
+        self.tables = dict((position,(pool,AliasTable(weights[pool])))
+                           for position,pool in pools.iteritems())
+
+    def sample(self,n,rng=None):
+        """
+        Return an n x 3 array of the relays in n circuits, with
+        the guard, middle and exit in columns GUARD, MIDDLE and
+        EXIT
+        """
+        rng = _rng(rng)
+        circuits = np.empty((n,3),dtype=np.int64)
+        for i,position in enumerate(CIRCUIT_ORDER):
+            pool,table = self.tables[position]
+            rows = np.arange(n)
+            for _ in xrange(CIRCUIT_ROUNDS):
+                if len(rows) == 0:
+                    break
+                circuits[rows,position] = pool[table.draw(len(rows),rng)]
+                repeats = np.zeros(len(rows),dtype=bool)
+                for earlier in CIRCUIT_ORDER[:i]:
+                    repeats |= circuits[rows,position] == circuits[rows,earlier]
+                rows = rows[repeats]
+            if len(rows):
+                raise ValueError("Couldn't find circuits of three different relays")
+        return circuits
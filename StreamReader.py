@@ -0,0 +1,126 @@
+"""
+Streaming readers for ModelNet .graph and .model files, and
+for TorTopology graph files.
+
+The documents are read with iterparse, and every element is
+cleared (along with any siblings that came before it) as soon
+as it has been turned into a record, so memory use doesn't grow
+with the size of the file. Records are plain dicts of the
+element's attributes, which can be used anywhere an element's
+get() method was used before.
+"""
+
+from lxml import etree
+
+def iter_records(xml_file,tags):
+    """
+    Yield a (tag,attributes) pair for every element in
+    <b>xml_file</b> whose tag is <b>tags</b> (or one of
+    <b>tags</b>, if it is a sequence), in document order.
+    """
+    if isinstance(tags,basestring):
+        tags = (tags,)
+
+    context = etree.iterparse(xml_file,events=('end',),tag=tags,huge_tree=True)
+    for _,elem in context:
+        yield elem.tag,dict(elem.attrib)
+
+        elem.clear()
+        parent = elem.getparent()
+        while elem.getprevious() is not None:
+            del parent[0]
+    del context
+
+def _records(xml_file,tag):
+    for _,record in iter_records(xml_file,tag):
+        yield record
+
+def vertices(graph_file):
+    """
+    Yield a record for each <vertex> in a .graph file
+    """
+    return _records(graph_file,'vertex')
+
+def edges(graph_file):
+    """
+    Yield a record for each <edge> in a .graph file
+    """
+    return _records(graph_file,'edge')
+
+def virtnodes(model_file):
+    """
+    Yield a record for each <virtnode> in a .model file
+    """
+    return _records(model_file,'virtnode')
+
+def hops(model_file):
+    """
+    Yield a record for each <hop> in a .model file
+    """
+    return _records(model_file,'hop')
+
+def matching_records(xml_file,tag,conditions):
+    """
+    Yield the attributes of every <b>tag</b> element in
+    <b>xml_file</b> whose attributes have the values given by
+    the (attr,value) pairs in <b>conditions</b>. Elements are
+    tested as they are parsed, and only matching ones are turned
+    into records.
+    """
+    context = etree.iterparse(xml_file,events=('end',),tag=tag,huge_tree=True)
+    for _,elem in context:
+        get = elem.get
+        for attr,value in conditions:
+            if get(attr) != value:
+                break
+        else:
+            yield dict(elem.attrib)
+
+        elem.clear()
+        parent = elem.getparent()
+        while elem.getprevious() is not None:
+            del parent[0]
+    del context
+
+def topology_records(topology_file):
+    """
+    Yield a record for each <node> and <edge> in a TorTopology
+    graph file, in document order. Nodes are ('node',id,attributes)
+    where attributes is a list of (attr,value) pairs, and edges
+    are ('edge',from,to,weight).
+    """
+    context = etree.iterparse(topology_file,events=('end',),tag=('node','edge'),huge_tree=True)
+    for _,elem in context:
+        if elem.tag == 'node':
+            yield ('node',elem.get('id'),
+                   [(attr.get('attr'),attr.get('value')) for attr in elem.iter('attribute')])
+        else:
+            yield ('edge',elem.get('from'),elem.get('to'),float(elem.get('wt')))
+
+        elem.clear()
+        parent = elem.getparent()
+        while elem.getprevious() is not None:
+            del parent[0]
+    del context
+
+def model_records(model_file):
+    """
+    Yield a record for each <virtnode> and <hop> in a .model
+    file, in document order. Virtnodes are
+    ('virtnode',int_idx,int_vn) and hops are
+    ('hop',int_idx,int_src,int_dst), with the attribute values
+    as strings (or None if missing).
+    """
+    context = etree.iterparse(model_file,events=('end',),tag=('virtnode','hop'),huge_tree=True)
+    for _,elem in context:
+        get = elem.get
+        if elem.tag == 'hop':
+            yield ('hop',get('int_idx'),get('int_src'),get('int_dst'))
+        else:
+            yield ('virtnode',get('int_idx'),get('int_vn'))
+
+        elem.clear()
+        parent = elem.getparent()
+        while elem.getprevious() is not None:
+            del parent[0]
+    del context
@@ -0,0 +1,184 @@
+"""
+Writers for the node lists and attribute lists produced by
+experimentor_tools, as YAML, JSON or msgpack, and a reader for
+them.
+
+YAML is emitted with libyaml's CSafeDumper when PyYAML was built
+with it, falling back to the pure Python SafeDumper. Both produce
+the same text for the plain dicts, lists and strings written here.
+
+A mapping is written one key at a time and a list a chunk at a
+time, so callers can hand over each piece as soon as it is ready
+and drop it. The pieces concatenate to exactly what dumping the
+whole structure at once would give. msgpack is only needed if
+that format is asked for.
+
+Documents are read back with libyaml's CSafeLoader where it is
+available, for the same reason.
+"""
+
+import json
+import yaml
+
+try:
+    from yaml import CSafeDumper as Dumper
+except ImportError:
+    from yaml import SafeDumper as Dumper
+
+try:
+    from yaml import CSafeLoader as Loader
+except ImportError:
+    from yaml import SafeLoader as Loader
+
+FORMATS = ('yaml','json','msgpack')
+
+def dump_yaml(data):
+    """
+    Return <b>data</b> as a block style YAML document
+    """
+    return yaml.dump(data,Dumper=Dumper)
+
+def _packer():
+    try:
+        import msgpack
+    except ImportError:
+        raise ValueError("msgpack output needs the msgpack module, which isn't installed")
+    return msgpack.Packer()
+
+def format_of(path):
+    """
+    Guess the format of the file <b>path</b> from its extension,
+    taking anything that isn't .json or .msgpack to be YAML
+    """
+    extension = path.rsplit('.',1)[-1].lower()
+    return extension if extension in ('json','msgpack') else 'yaml'
+
+def read(f,fmt='yaml'):
+    """
+    Read a whole document in the format <b>fmt</b> from the file
+    object <b>f</b>
+    """
+    if fmt == 'yaml':
+        return yaml.load(f,Loader=Loader)
+    elif fmt == 'json':
+        return json.load(f)
+    elif fmt == 'msgpack':
+        try:
+            import msgpack
+        except ImportError:
+            raise ValueError("Reading msgpack needs the msgpack module, which isn't installed")
+        return msgpack.unpack(f)
+    raise ValueError("Unknown input format '%s'" % fmt)
+
+def check_format(fmt):
+    """
+    Raise ValueError if output can't be written in <b>fmt</b>
+    """
+    if fmt not in FORMATS:
+        raise ValueError("Unknown output format '%s'" % fmt)
+    if fmt == 'msgpack':
+        _packer()
+
+class MappingWriter(object):
+    """
+    Write a mapping to <b>out</b> in the format <b>fmt</b>, one
+    key at a time. Keys must be written in sorted order, which is
+    the order yaml.dump uses, and a msgpack map needs its number
+    of keys, <b>size</b>, up front.
+    """
+
+    def __init__(self,out,fmt='yaml',size=None):
+        self.out = out
+        self.fmt = fmt
+        self.size = size
+        self.written = 0
+        if fmt == 'msgpack':
+            self.packer = _packer()
+        elif fmt not in FORMATS:
+            raise ValueError("Unknown output format '%s'" % fmt)
+
+    def _start(self):
+        # Nothing is written until the first key, so a caller that
+        # fails before then leaves no partial document behind.
+        if self.fmt == 'msgpack':
+            self.out.write(self.packer.pack_map_header(self.size))
+        elif self.fmt == 'json':
+            self.out.write("{")
+
+    def write(self,key,value):
+        if self.written == 0:
+            self._start()
+        if self.fmt == 'yaml':
+            self.out.write(dump_yaml({key:value}))
+        elif self.fmt == 'json':
+            self.out.write("%s%s: %s" % (", " if self.written else "",
+                                         json.dumps(key),
+                                         json.dumps(value,sort_keys=True)))
+        else:
+            self.out.write(self.packer.pack(key))
+            self.out.write(self.packer.pack(value))
+        self.written += 1
+
+    def close(self):
+        """
+        Finish the mapping. The text formats end with a newline.
+        """
+        if self.written == 0:
+            if self.fmt == 'yaml':
+                self.out.write(dump_yaml({}))
+            else:
+                self._start()
+        if self.fmt == 'yaml':
+            self.out.write("\n")
+        elif self.fmt == 'json':
+            self.out.write("}\n")
+
+def write_mapping(mapping,out,fmt='yaml'):
+    """
+    Write the whole of <b>mapping</b> to <b>out</b>
+    """
+    writer = MappingWriter(out,fmt,len(mapping))
+    for key in sorted(mapping):
+        writer.write(key,mapping[key])
+    writer.close()
+
+class ListWriter(object):
+    """
+    Write a list to <b>out</b> in the format <b>fmt</b>, a chunk
+    of items at a time. msgpack arrays need their length up
+    front, so in that format the items are held until close().
+    """
+
+    def __init__(self,out,fmt='yaml'):
+        self.out = out
+        self.fmt = fmt
+        self.written = 0
+        if fmt == 'msgpack':
+            self.packer = _packer()
+            self.items = []
+        elif fmt not in FORMATS:
+            raise ValueError("Unknown output format '%s'" % fmt)
+
+    def write(self,items):
+        if not items:
+            return
+        if self.fmt == 'yaml':
+            self.out.write(dump_yaml(items))
+        elif self.fmt == 'json':
+            self.out.write(("[" if self.written == 0 else ", ") + json.dumps(items,sort_keys=True)[1:-1])
+        else:
+            self.items.extend(items)
+        self.written += len(items)
+
+    def close(self):
+        """
+        Finish the list. The text formats end with a newline.
+        """
+        if self.fmt == 'yaml':
+            if self.written == 0:
+                self.out.write(dump_yaml([]))
+            self.out.write("\n")
+        elif self.fmt == 'json':
+            self.out.write(("[" if self.written == 0 else "") + "]\n")
+        else:
+            self.out.write(self.packer.pack(self.items))
@@ -1,14 +1,21 @@
+import os
 import sys
 import networkx as nx
 import re
 import argparse
+import collections
 import pdb
-from lxml import etree
 import random
+import signal
 import subprocess
+import threading
+import numpy as np
 from os.path import expanduser
+import RouteFiles
+import CompactGraph
+import StreamReader
 
-HOPREGEX = re.compile("\s*<path\s+int_vndst=\"[0-9]+\"\s+int_vnsrc=\"[0-9]+\"\s+hops=\"([0-9 ]+)\"\s+/>")
+HOPREGEX = re.compile("\s*<path\s+int_vndst=\"[0-9]+\"\s+int_vnsrc=\"[0-9]+\"\s+hops=\"([0-9 ]+)\"\s*/>")
 
 def pairwise(iterable):
     import itertools
@@ -30,14 +37,29 @@ def alist_append(d,attr,val):
     except KeyError:
         d[attr] = [val]
 
+"""
+Route readers that have been opened by lookup_mn_route, keyed
+by route file. None records that the route file is an XML file
+with no index.
+"""
+route_readers = dict()
+
 def lookup_mn_route(route_file,pair):
     """
     Lookup the modelnet path from a routefile from pair[0]
     to pair[1]
 
-    We use grep because routefiles are insanely large, and
-    loading the entire thing for a lookup will kill memory.
+    Binary route files are read directly, and if an XML route
+    file has been indexed with 'index_routes', the line is read
+    from its indexed offset. Otherwise we use grep because
+    routefiles are insanely large, and loading the entire thing
+    for a lookup will kill memory.
     """
+    if route_file not in route_readers:
+        route_readers[route_file] = RouteFiles.open_route_reader(route_file)
+
+    if route_readers[route_file] is not None:
+        return route_readers[route_file].lookup(pair[0][0],pair[1][0])
 
     call = []
     call.append('/bin/grep')
@@ -49,6 +71,7 @@ def lookup_mn_route(route_file,pair):
         result = subprocess.check_output(call)
     except subprocess.CalledProcessError as e:
         sys.stderr.write("Error: %s. Output: %s\n" % ( e.returncode, e.output))
+        return None
 
     m = HOPREGEX.match(result)
 
@@ -57,197 +80,600 @@ def lookup_mn_route(route_file,pair):
 
     return map(int,m.groups()[0].split())
 
-def allpairs(graph_file=None,wt_attr=None):
+def allpairs(graph_file=None,wt_attr=None,jobs=1,shard_dir=None,csr=False,route_format='xml'):
     """
     Print the shortest path for all nodes, using
     the attribute named <b>wt_attr</b> as the weighting
     function.
+
+    If <b>jobs</b> is greater than one, the source vertices
+    are split into that many contiguous slices which are routed
+    by a pool of worker processes. Each worker writes its own
+    shard of the route file (in <b>shard_dir</b>, or a temporary
+    directory), and the shards are concatenated in order so
+    the output is identical to the single process output.
+
+    If <b>csr</b> is True, the graph is loaded into a compact
+    CSRGraph instead of a networkx graph. Only int_delayms can
+    be used as the weight attribute, and destinations are
+    written in vertex order rather than networkx's order.
+
+    <b>route_format</b> is either 'xml' for a ModelNet
+    <allpairs> route file, or 'binary' for the compact
+    format described in RouteFiles.
     """
     
     if graph_file is None and wt_attr is None:
         parser = argparse.ArgumentParser()
         parser.add_argument("-w", help="Attribute to use for shortest path weight",
                             metavar="<weight attribute>")
+        parser.add_argument("-j","--jobs",type=int,default=1,
+                            help="Number of worker processes to route with. Default: 1")
+        parser.add_argument("--shard_dir",default=None,
+                            help="Directory to write the per-worker route shards to. "
+                                 "Defaults to a temporary directory")
+        parser.add_argument("--csr",action="store_true",default=False,
+                            help="Route on a compact array backed graph instead of networkx. "
+                                 "Uses much less memory, but only supports '-w int_delayms'")
+        parser.add_argument("--format",choices=sorted(RouteFiles.ROUTE_WRITERS),default='xml',
+                            help="The route file format to write. Default: xml")
         parser.add_argument("graph_file",help="Modelnet Graph File")
         args = parser.parse_args()
 
         graph_file = args.graph_file
         wt_attr = args.w
+        jobs = args.jobs
+        shard_dir = args.shard_dir
+        csr = args.csr
+        route_format = args.format
+
+    if csr:
+        if wt_attr not in (None,'int_delayms'):
+            sys.stderr.write("Error: compact graphs can only be weighted by 'int_delayms'\n")
+            sys.exit(1)
+        gr = CompactGraph.load_graph_csr(graph_file)
+    else:
+        gr = load_graph(graph_file)
+
+    write_routes(gr,sys.stdout,wt_attr,jobs,shard_dir,route_format)
+
+def write_routes(gr,out,wt_attr=None,jobs=1,shard_dir=None,route_format='xml'):
+    """
+    Write the route file for the networkx graph or CSRGraph
+    <b>gr</b> to <b>out</b>, as allpairs does.
+    """
+    if isinstance(gr,CompactGraph.CSRGraph):
+        sources = gr.virtnodes().tolist()
+    else:
+        sources = [src for src in gr.nodes() if gr.node[src]['vn'] != -1]
+
+    writer = RouteFiles.ROUTE_WRITERS[route_format](out)
 
-    gr = load_graph(graph_file)
+    if jobs > 1:
+        _route_sharded(gr,sources,wt_attr,jobs,writer,shard_dir)
+    else:
+        _route_sources(gr,sources,wt_attr,writer,progress=True)
 
-    print '<?xml version="1.0" encoding="ISO-8859-1"?>'
-    print '<allpairs>'
+    writer.close()
 
+def _route_sources(gr,sources,wt_attr,writer,progress=False):
+    """
+    Write the paths to every destination reachable from
+    each of <b>sources</b> with the route writer <b>writer</b>.
+    """
     numdone = 0
-    
-    sys.stderr.write("Routing Node %s" % str(numdone))
-    
-    for src in gr.nodes():
-        if gr.node[src]['vn'] == -1:
-            continue
-        if wt_attr:
-            sp = nx.single_source_dijkstra_path(gr,src,wt_attr)
-        else: 
-            sp = nx.single_source_shortest_path(gr,src)
-        for dst in sp:
-            if gr.node[dst]['vn'] == -1:
-                continue
-            if dst == src:
-                continue
-            
-            path = sp[dst]
-            hops = [gr[x][y]['int_idx'] for x,y in pairwise(path)]  
-
-            print ('<path int_vndst="%d" int_vnsrc="%d" hops="%s"/>'
-                    % (gr.node[dst]['vn'],
-                       gr.node[src]['vn'],
-                       " ".join(map(str,hops))))
-
-        sys.stderr.write('\b'*len(str(numdone)))
-        sys.stderr.write("%d" % int(numdone+1))
-        numdone += 1
-    print '</allpairs>'
 
-def main_fun(graph_file,model_file,sample_size,route_file,mnp_bin):
-    igraph = load_graph(graph_file)
+    if progress:
+        sys.stderr.write("Routing Node %s" % str(numdone))
 
-    sample = select_sample(model_file,sample_size)
+    for src in sources:
+        if isinstance(gr,CompactGraph.CSRGraph):
+            src_vn = int(gr.vn[src])
+            routes = gr.routes(src,weighted=bool(wt_attr))
+        else:
+            src_vn = gr.node[src]['vn']
+            routes = _nx_routes(gr,src,wt_attr)
 
-    sp = igraph.shortest_paths(igraph.vs,weights='int_delayms')
-    sp_paths = [igraph.get_shortest_paths(node.index,weights='int_delayms') for node in igraph.vs]
+        writer.write_source(src_vn,routes)
 
-    stats = dict()
+        if progress:
+            sys.stderr.write('\b'*len(str(numdone)))
+            sys.stderr.write("%d" % int(numdone+1))
+        numdone += 1
 
-    numdone = 0
-    sys.stderr.write("Pairs processed: %d" % numdone)
-    for pair in sample:
-        if pair[0][0] == pair[1][0]:
+def _nx_routes(gr,src,wt_attr):
+    """
+    Yield (dst_vn,hops) for every virtual node reachable
+    from <b>src</b> in the networkx graph <b>gr</b>.
+    """
+    if wt_attr:
+        sp = nx.single_source_dijkstra_path(gr,src,wt_attr)
+    else: 
+        sp = nx.single_source_shortest_path(gr,src)
+    for dst in sp:
+        if gr.node[dst]['vn'] == -1:
+            continue
+        if dst == src:
             continue
-        node1 = igraph.vs.select(vn_eq=pair[0][0])[0]
-        node2 = igraph.vs.select(vn_eq=pair[1][0])[0]
-        model_dist = sp[node1.index][node2.index]
+        
+        path = sp[dst]
+        hops = [gr[x][y]['int_idx'] for x,y in pairwise(path)]  
 
-        result = subprocess.check_output([expanduser(mnp_bin), pair[0][1],pair[1][1], "3"],
-                                            stderr=open('/dev/null','w'))
-        results = result.split('\n')[:-1]
-        pings = map(lambda x: int(float(x.split()[7]))/2,results)
-        pings.sort()
-        if pings[1] != model_dist:
+        yield gr.node[dst]['vn'],hops
 
-            if route_file:
-                mn_path = __route2idxlist(igraph,pair,lookup_mn_route(route_file,pair))
-                model_path = sp_paths[node1.index][node2.index]
-            else:
-                mn_path = "[Not Available]"
-                model_path = "[Not Available]"
+"""
+The graph being routed by a pool of allpairs workers. It is
+set before the pool is created so forked workers inherit it
+rather than having it pickled to them.
+"""
+_shard_graph = None
 
-            print "(%s -> %s): Model: %d ms %s; Empirically: %d ms %s; " % (
-                    pair[0],pair[1],model_dist,model_path,pings[1],mn_path)
-            alist_append(stats,'diff',abs(pings[1] - model_dist))
-            alist_append(stats,'pathlendiff',abs(len(model_path) - len(mn_path)))
-            if len(model_path) == len(mn_path):
-                alist_append(stats,'eqlpath_latencydiff',abs(pings[1] - model_dist))
+def _route_shard(task):
+    shard_path,sources,wt_attr,writer_class = task
+    with open(shard_path,'wb') as out:
+        writer = writer_class(out,header=False)
+        _route_sources(_shard_graph,sources,wt_attr,writer)
+        writer.close()
+    return shard_path
 
+def _route_sharded(gr,sources,wt_attr,jobs,writer,shard_dir=None):
+    """
+    Route <b>sources</b> with <b>jobs</b> worker processes, each
+    owning a contiguous slice of the sources and writing its
+    own shard, then merge the shards into <b>writer</b> in order.
+    """
+    import multiprocessing
+    import shutil
+    import tempfile
+
+    global _shard_graph
+
+    workdir = tempfile.mkdtemp(prefix="allpairs-",dir=shard_dir)
+    slice_len = (len(sources) + jobs - 1) / jobs if sources else 1
+    tasks = [(os.path.join(workdir,"shard-%04d" % i),
+              sources[start:start+slice_len],
+              wt_attr,
+              type(writer))
+             for i,start in enumerate(xrange(0,len(sources),slice_len))]
+
+    _shard_graph = gr
+    pool = multiprocessing.Pool(min(jobs,len(tasks)) or 1)
+    try:
+        numdone = 0
+        sys.stderr.write("Routed shard %d of %d" % (numdone,len(tasks)))
+        for shard_path in pool.imap_unordered(_route_shard,tasks):
+            sys.stderr.write('\b'*len("%d of %d" % (numdone,len(tasks))))
+            numdone += 1
+            sys.stderr.write("%d of %d" % (numdone,len(tasks)))
+        pool.close()
+        pool.join()
+
+        for task in tasks:
+            with open(task[0],'rb') as shard:
+                writer.copy_shard(shard)
+    finally:
+        pool.terminate()
+        _shard_graph = None
+        shutil.rmtree(workdir,ignore_errors=True)
+
+def main_fun(graph_file,model_file,sample_size,route_file,mnp_bin,jobs=1,timeout=None,
+             group_by_source=False,seed=None):
+    """
+    Compare the latencies modelnetping measures between a sample
+    of relay pairs with their shortest path distances in the graph.
+
+    Shortest path trees are only computed for the sources in
+    the sample, and each one is dropped as soon as the last pair
+    from its source has been checked. If <b>group_by_source</b>
+    is True, pairs are probed in source order so that only a
+    handful of trees are held at any time. The sample is drawn
+    with <b>seed</b>, so a seeded run always checks the same pairs.
+    """
+    graph = CompactGraph.load_graph_csr(graph_file)
+
+    sample = select_sample(model_file,sample_size,random.Random(seed))
+
+    stats = dict()
+
+    pairs = [pair for pair in sample if pair[0][0] != pair[1][0]]
+    if group_by_source:
+        pairs.sort(key=lambda pair: pair[0][0])
+
+    trees = dict()
+    remaining = collections.Counter(pair[0][0] for pair in pairs)
+
+    numdone = 0
+    sys.stderr.write("Pairs processed: %d" % numdone)
+    for pair,pings in probe_pairs(mnp_bin,pairs,jobs,timeout):
         sys.stderr.write("\b"*len(str(numdone)))
         numdone += 1
         sys.stderr.write("%d" % numdone)
         sys.stderr.flush()
 
-    print "Average latency difference: %d" % (sum(stats['diff'])/len(stats['diff']))
-    print "Average path length difference: %s" %( sum(stats['pathlendiff'])/len(stats['pathlendiff'])) 
+        src_vn = pair[0][0]
+        remaining[src_vn] -= 1
+        if pings is None:
+            alist_append(stats,'failed',pair)
+        else:
+            if src_vn not in trees:
+                trees[src_vn] = graph.shortest_paths(graph.vertex_for_vn(src_vn))
+            compare_pair(graph,trees[src_vn],pair,pings,route_file,stats)
+
+        if remaining[src_vn] == 0:
+            trees.pop(src_vn,None)
+
+    if 'failed' in stats:
+        sys.stderr.write("\nWarning: %d of %d pairs could not be probed\n"
+                         % (len(stats['failed']),len(pairs)))
+    if 'unreachable' in stats:
+        sys.stderr.write("\nWarning: %d of %d pairs are unreachable in the model\n"
+                         % (len(stats['unreachable']),len(pairs)))
+
+    def average(key):
+        return sum(stats[key])/len(stats[key]) if key in stats else 0
+
+    print "Average latency difference: %d" % average('diff')
+    print "Average path length difference: %s" % average('pathlendiff')
     print ("Average latency difference in equal length paths: %d" %
-            (sum(stats('eqlpath_latencydiff'))/
-                 len(stats('eqlpath_latencydiff'))))
+            average('eqlpath_latencydiff'))
 
+def compare_pair(graph,tree,pair,pings,route_file,stats):
+    """
+    Compare the measured <b>pings</b> for <b>pair</b> with
+    its distance in the shortest path tree <b>tree</b>
+    rooted at pair[0], and record any difference in
+    <b>stats</b>. Pairs the model can't route between are
+    recorded as 'unreachable' instead.
+    """
+    dist,pred = tree
+    node2 = graph.vertex_for_vn(pair[1][0])
+    model_dist = dist[node2]
+
+    if np.isinf(model_dist):
+        print "(%s -> %s): Model: unreachable; Empirically: %d ms" % (pair[0],pair[1],pings[1])
+        alist_append(stats,'unreachable',pair)
+    elif pings[1] != model_dist:
+        if route_file:
+            mn_path = __route2idxlist(graph,pair,lookup_mn_route(route_file,pair) or [])
+            model_path = graph.path_vertices(pred,node2)
+        else:
+            mn_path = "[Not Available]"
+            model_path = "[Not Available]"
 
-def __route2idxlist(igraph,pair,route):
+        print "(%s -> %s): Model: %d ms %s; Empirically: %d ms %s; " % (
+                pair[0],pair[1],model_dist,model_path,pings[1],mn_path)
+        alist_append(stats,'diff',abs(pings[1] - model_dist))
+        alist_append(stats,'pathlendiff',abs(len(model_path) - len(mn_path)))
+        if len(model_path) == len(mn_path):
+            alist_append(stats,'eqlpath_latencydiff',abs(pings[1] - model_dist))
+
+
+def _kill_group(proc,killed):
+    killed.append(proc.pid)
+    try:
+        os.killpg(proc.pid,signal.SIGKILL)
+    except OSError:
+        pass
+
+def ping_pair(mnp_bin,pair,count=3,timeout=None):
+    """
+    Ping from pair[0] to pair[1] <b>count</b> times with
+    modelnetping, killing it if it runs for more than
+    <b>timeout</b> seconds.
+
+    modelnetping runs in a process group of its own, and the
+    whole group is killed on a timeout, so a wrapper script
+    can't leave a child behind holding its output open.
+
+    Returns the sorted one-way latencies in ms, or None if
+    modelnetping failed, timed out, or returned fewer than
+    two results.
+    """
+    with open(os.devnull,'w') as devnull:
+        proc = subprocess.Popen([expanduser(mnp_bin), pair[0][1],pair[1][1], str(count)],
+                                stdout=subprocess.PIPE,stderr=devnull,preexec_fn=os.setsid)
+    timer = None
+    killed = []
+    if timeout:
+        timer = threading.Timer(timeout,_kill_group,(proc,killed))
+        timer.start()
+    try:
+        result = proc.communicate()[0]
+    finally:
+        if timer:
+            timer.cancel()
+
+    if killed or proc.returncode != 0:
+        return None
+
+    try:
+        results = result.split('\n')[:-1]
+        pings = map(lambda x: int(float(x.split()[7]))/2,results)
+    except (IndexError,ValueError):
+        return None
+    if len(pings) < 2:
+        return None
+    pings.sort()
+    return pings
+
+def probe_pairs(mnp_bin,pairs,jobs=1,timeout=None):
+    """
+    Ping every pair in <b>pairs</b> with at most <b>jobs</b>
+    modelnetping processes running at once, yielding
+    (pair,pings) as each one completes. See ping_pair().
+    """
+    from multiprocessing.pool import ThreadPool
+
+    if jobs <= 1:
+        for pair in pairs:
+            yield pair,ping_pair(mnp_bin,pair,timeout=timeout)
+        return
+
+    pool = ThreadPool(jobs)
+    try:
+        for result in pool.imap_unordered(
+                lambda pair: (pair,ping_pair(mnp_bin,pair,timeout=timeout)),pairs):
+            yield result
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
+
+def __route2idxlist(graph,pair,route):
     """
     Given a modelnet route, return the sequence of nodes
     it passes through (using the internal representation
     idx as a node id)
 
     This effectively translates modelnet vertex ID's to 
-    igraph IDs.
+    CSRGraph vertex positions.
     """
 
     idxlist = []
-    edges = igraph.es.select(int_idx_in=route)
-    srcnode = igraph.vs.select(vn_eq=pair[0][0])[0].index
+    srcnode = graph.vertex_for_vn(pair[0][0])
     idxlist.append(srcnode)
 
-    while len(route) > 0:
-        hop = route.pop(0)
+    edges = graph.route_edges(route)
+    sources = graph.sources[edges].tolist()
+    targets = graph.targets[edges].tolist()
 
-        edge = edges.select(idx=hop)[0]
-        if edge.source == idxlist[-1]:
-            idxlist.append(edge.target)
-        elif edge.target == idxlist[-1]:
-            idxlist.append(edge.source)
+    for source,target in zip(sources,targets):
+        if source == idxlist[-1]:
+            idxlist.append(target)
+        elif target == idxlist[-1]:
+            idxlist.append(source)
         else:
             sys.stderr.write("Couldn't link path")
 
     return idxlist
 
 
-def select_sample(model_file,sample_size):
+def check_route_block(graph,block,show=0):
     """
-    Select sample_size pairs of 'tor_relay' virtnodes from 
-    model_file and return them as a list of pairs
+    Check the paths in a route file block (see RouteFiles.iter_blocks)
+    against <b>graph</b>. Each path's latency is the sum of the
+    int_delayms of its hops, which is compared with the shortest
+    path distance from the block's source.
+
+    Returns (src,npaths,nbroken,nwrong,histogram,mismatches),
+    where nbroken counts paths whose hops don't form a path from
+    src to dst (including paths with hops that aren't in the
+    graph), nwrong counts the other paths whose latency isn't the
+    shortest distance, histogram counts those with a finite
+    shortest distance by latency difference, and mismatches holds
+    (dst,route_latency,shortest) for the first <b>show</b> of them.
+    A src or dst that isn't a virtnode of the graph has no
+    shortest distance, so its paths are broken mismatches.
     """
+    src,dsts,lengths,hops = block
+    srcv = int(graph.vertices_for_vns([src],strict=False)[0])
+    dstv = graph.vertices_for_vns(dsts,strict=False)
+    unknown_end = (dstv == -1) | (srcv == -1)
+
+    # Hops that aren't in the graph index a trailing sentinel
+    # edge, which has no delay and links no vertices.
+    edges = graph.route_edges(hops,strict=False)
+    unknown = edges == -1
+    sources = np.append(graph.sources,-1)
+    targets = np.append(graph.targets,-1)
+    delay = np.append(graph.delay,0)
+
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    latency = np.concatenate(([0],np.cumsum(delay[edges])))
+    latency = latency[ends] - latency[starts]
+
+    dist = np.empty(len(dsts))
+    dist.fill(CompactGraph.INF)
+    if srcv != -1:
+        dist[~unknown_end] = np.array(graph.shortest_paths(srcv)[0])[dstv[~unknown_end]]
+
+    # Every hop must leave the vertex the previous one entered,
+    # the first must leave src and the last must enter dst.
+    has_hops = lengths > 0
+    first = starts[has_hops]
+    last = ends[has_hops] - 1
+    linked = np.ones(len(edges),dtype=bool)
+    linked[1:] = sources[edges[1:]] == targets[edges[:-1]]
+    linked[first] = sources[edges[first]] == srcv
+    linked[last] &= targets[edges[last]] == dstv[has_hops]
+    linked &= ~unknown
+    broken = ~has_hops
+    if len(first):
+        broken[has_hops] = ~np.logical_and.reduceat(linked,first)
+    broken |= unknown_end
+
+    # A path with an unknown hop has no latency to compare
+    has_unknown = np.zeros(len(dsts),dtype=bool)
+    has_unknown[np.repeat(np.arange(len(dsts)),lengths)[unknown]] = True
+
+    wrong = np.flatnonzero((latency != dist) & ~has_unknown)
+    diffs = np.abs(latency[wrong] - dist[wrong])
+    diffs = diffs[np.isfinite(diffs)].astype(np.int64)
+    mismatches = [(int(dsts[i]),int(latency[i]),dist[i]) for i in wrong[:show]]
+
+    return src,len(dsts),int(broken.sum()),len(wrong),np.bincount(diffs),mismatches
+
+"""
+The graph being checked by a pool of validate_routes workers.
+Like _shard_graph, forked workers inherit it.
+"""
+_check_graph = None
+
+def _check_block(task):
+    block,show = task
+    return check_route_block(_check_graph,block,show)
+
+def validate_routes(graph_file,route_file,jobs=1,show=10):
+    """
+    Check every path in <b>route_file</b> against the graph in
+    <b>graph_file</b> without running modelnetping, by summing
+    the int_delayms of its hops and comparing the total with the
+    shortest path distance. The first <b>show</b> mismatches are
+    printed, followed by a summary. Blocks of paths are checked
+    by <b>jobs</b> worker processes.
+
+    Returns the number of mismatching or broken paths.
+    """
+    import itertools
+    import multiprocessing
 
-    with open(model_file) as f:
-        tree= etree.parse(f)
+    global _check_graph
+
+    graph = CompactGraph.load_graph_csr(graph_file)
+    tasks = ((block,show) for block in RouteFiles.iter_blocks(route_file))
+
+    pool = None
+    if jobs > 1:
+        _check_graph = graph
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(_check_block,tasks)
+    else:
+        results = itertools.imap(lambda task: check_route_block(graph,*task),tasks)
+
+    npaths = nbroken = nwrong = shown = 0
+    histogram = np.zeros(1,dtype=np.int64)
+    try:
+        for src,count,broken,wrong,hist,mismatches in results:
+            npaths += count
+            nbroken += broken
+            nwrong += wrong
+            if len(hist) > len(histogram):
+                hist[:len(histogram)] += histogram
+                histogram = hist
+            else:
+                histogram[:len(hist)] += hist
+
+            for dst,latency,shortest in mismatches[:show - shown]:
+                print "(%d -> %d): Route: %d ms; Shortest: %s ms" % (src,dst,latency,shortest)
+                shown += 1
+        if pool:
+            pool.close()
+            pool.join()
+    finally:
+        if pool:
+            pool.terminate()
+        _check_graph = None
+
+    # Mismatches where dst is unreachable, or src or dst isn't in
+    # the graph, have no difference to put in the histogram
+    nmeasured = int(histogram.sum())
+    diffs = np.arange(len(histogram))
+    print "Paths checked: %d" % npaths
+    print "Paths with the wrong latency: %d" % nwrong
+    if nwrong > nmeasured:
+        print "Paths between virtnodes the graph doesn't connect: %d" % (nwrong - nmeasured)
+    print "Paths whose hops don't link src to dst: %d" % nbroken
+    if nmeasured:
+        cumulative = np.cumsum(histogram)
+        print "Average latency difference: %d" % ((histogram * diffs).sum() / nmeasured)
+        print "Median latency difference: %d" % np.searchsorted(cumulative,(nmeasured + 1) / 2)
+        print "95th percentile latency difference: %d" % np.searchsorted(cumulative,int(np.ceil(nmeasured * 0.95)))
+        print "Maximum latency difference: %d" % diffs[histogram > 0].max()
+
+    return nwrong + nbroken
+
+def select_sample(model_file,sample_size,rng=random):
+    """
+    Select sample_size pairs of 'tor_relay' virtnodes from 
+    model_file and return them as a list of pairs, drawn from
+    <b>rng</b>
+    """
 
     virtnodes = [(int(x.get('int_vn')),x.get('vip')) 
-                 for x in tree.xpath("//virtnode[@nodetype='tor_relay']")]
+                 for x in StreamReader.virtnodes(model_file)
+                 if x.get('nodetype') == 'tor_relay']
 
     if len(virtnodes) == 0:
         sys.stderr.write("Warning, found no virtual nodes in the model file\n")
         return
 
-    set1 = random.sample(virtnodes,sample_size)
-    set2 = random.sample(virtnodes,sample_size)
+    set1 = rng.sample(virtnodes,sample_size)
+    set2 = rng.sample(virtnodes,sample_size)
 
     del virtnodes
     return zip(set1,set2)
 
-def load_graph(graph_file):
-    
-    with open(graph_file) as f:
-        tree = etree.parse(f)
-    
+def graph_from_columns(columns):
+    """
+    Build the networkx graph that load_graph() would read from
+    the graph cache <b>columns</b>
+    """
     nxgraph = nx.DiGraph()
-    vertices = tree.xpath('//vertex')
-
-    if len(vertices) == 0:
-        sys.stderr.write("warning: didn't find any virtual nodes. did you prov_ide a .graph file as input?\n")
-        return
 
     vertidx.clear()
-    nodecount = 0
-    for vertex in vertices:
-        v_id = int(vertex.get('int_idx'))
-        vtype='relay' if vertex.get('role') is not 'gateway' else 'pop'
-        vnattr = int(vertex.get('int_vn')) if vertex.get('int_vn') else -1
+    ids = columns['ids'].tolist()
+    for nodecount,(v_id,vnattr,role) in enumerate(zip(ids,columns['vn'].tolist(),
+                                                      columns['role'].tolist())):
+        vtype = 'relay' if role == CompactGraph.ROLE_VIRTNODE else 'pop'
         nxgraph.add_node(v_id,id=v_id,vn=vnattr,type=vtype)
         vertidx[v_id] = nodecount
-        nodecount += 1
 
-    del vertices
+    for src,dst,idx,delay,kbps,spec in zip(columns['sources'].tolist(),columns['targets'].tolist(),
+                                           columns['idx'].tolist(),columns['delay'].tolist(),
+                                           columns['kbps'].tolist(),columns['spec'].tolist()):
+        record = {'int_src':str(ids[src]),
+                  'int_dst':str(ids[dst]),
+                  'int_idx':str(idx),
+                  'int_delayms':str(delay),
+                  'specs':CompactGraph.SPECS[spec]}
+        if kbps == kbps:
+            record['dbl_kbps'] = str(kbps)
+        nxgraph.add_edge(ids[src],ids[dst],**record)
 
-    edges = tree.xpath("//edge")
+    return nxgraph
 
-    for edge in edges:
-        src = int(edge.get('int_src'))
-        dst = int(edge.get('int_dst'))
-        attrs = dict()
-        for key in edge.keys():
-            attrs[key] = edge.get(key)
+def load_graph(graph_file):
+    
+    columns = CompactGraph.open_graph_cache(graph_file)
+    if columns is not None:
+        if len(columns['ids']) == 0:
+            sys.stderr.write("warning: didn't find any virtual nodes. did you prov_ide a .graph file as input?\n")
+            return
+        return graph_from_columns(columns)
 
-        nxgraph.add_edge(src,dst,**attrs)
+    nxgraph = nx.DiGraph()
 
-    del edges
+    vertidx.clear()
+    nodecount = 0
+    for tag,record in StreamReader.iter_records(graph_file,('vertex','edge')):
+        if tag == 'vertex':
+            v_id = int(record.get('int_idx'))
+            vtype='relay' if record.get('role') is not 'gateway' else 'pop'
+            vnattr = int(record.get('int_vn')) if record.get('int_vn') else -1
+            nxgraph.add_node(v_id,id=v_id,vn=vnattr,type=vtype)
+            vertidx[v_id] = nodecount
+            nodecount += 1
+        elif nodecount == 0:
+            break
+        else:
+            src = int(record.get('int_src'))
+            dst = int(record.get('int_dst'))
+            nxgraph.add_edge(src,dst,**record)
+
+    if nodecount == 0:
+        sys.stderr.write("warning: didn't find any virtual nodes. did you prov_ide a .graph file as input?\n")
+        return
     
     return nxgraph
 
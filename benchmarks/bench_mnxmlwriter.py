@@ -0,0 +1,93 @@
+"""
+Time MNXMLWriter.write on a synthetic TorTopology-like graph.
+
+    python benchmarks/bench_mnxmlwriter.py [-e EDGES] [--compare OTHER_MNXMLWriter.py]
+
+The graph has relays, clients and destinations attached to a
+random network of gateways, with about EDGES edges counting
+both orientations of each link. Pass --compare with another
+copy of MNXMLWriter.py (e.g. one saved with
+'git show <rev>:MNXMLWriter.py') to time it on the same graph.
+"""
+
+import os
+import sys
+import imp
+import time
+import random
+import argparse
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+
+from pygraph.classes.graph import graph
+import MNXMLWriter
+
+class NullOut(object):
+    def write(self,s):
+        pass
+
+def synthetic_graph(num_edges,seed=0):
+    rng = random.Random(seed)
+    links = num_edges // 2
+    num_virt = links // 3
+    num_gw = max(1,num_virt // 10)
+
+    gr = graph()
+    gateways = ["as%d" % i for i in xrange(num_gw)]
+    gr.add_nodes(gateways)
+
+    for i in xrange(num_virt):
+        roll = rng.random()
+        if roll < 0.25:
+            node = "10_%d_%d_%d" % (i >> 16,(i >> 8) & 255,i & 255)
+            gr.add_node(node,[("bandwidth (kb/s)",str(rng.randint(20,10000))),
+                              ("nodetype","tor_relay"),
+                              ("flag - exit",str(rng.randint(0,1))),
+                              ("router name","r%s" % node)])
+        elif roll < 0.95:
+            node = "client_node_%d" % i
+            gr.add_node(node,[("download_bw","1000"),("upload_bw","500"),
+                              ("nodetype","client")])
+        else:
+            node = "dest_node_%d" % i
+            gr.add_node(node,[("nodetype","dest")])
+        gr.add_edge((node,rng.choice(gateways)),wt=rng.randint(1,50))
+
+    added = num_virt
+    while added < links:
+        a,b = rng.choice(gateways),rng.choice(gateways)
+        if a != b and not gr.has_edge((a,b)):
+            gr.add_edge((a,b),wt=rng.randint(1,50))
+            added += 1
+    return gr
+
+def time_write(module,gr,repeat):
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        module.write(gr,NullOut())
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best,elapsed)
+    return best
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-e","--edges",type=int,default=1000000,
+                        help="The approximate number of edges. Default: 1000000")
+    parser.add_argument("-r","--repeat",type=int,default=3,
+                        help="Report the best of REPEAT runs. Default: 3")
+    parser.add_argument("--compare",default=None,
+                        help="Another MNXMLWriter.py to time on the same graph")
+    args = parser.parse_args()
+
+    start = time.time()
+    gr = synthetic_graph(args.edges)
+    sys.stdout.write("built %d vertices, %d edges in %.1fs\n"
+                     % (len(gr.nodes()),len(gr.edges()),time.time() - start))
+
+    current = time_write(MNXMLWriter,gr,args.repeat)
+    sys.stdout.write("MNXMLWriter: %.2fs\n" % current)
+    if args.compare:
+        other = imp.load_source("MNXMLWriter_compare",args.compare)
+        previous = time_write(other,gr,args.repeat)
+        sys.stdout.write("%s: %.2fs (%.2fx)\n" % (args.compare,previous,previous / current))
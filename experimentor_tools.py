@@ -3,11 +3,11 @@
 import os
 import sys
 import argparse
-import pdb
 import yaml
 import random
+import socket
+import struct
 import MNXMLWriter
-import ModelFunctions
 
 def mk_struct(node,*args):
     """
@@ -34,67 +34,116 @@ def mk_struct(node,*args):
     return ret
 
 def extract_attributes(args):
-    from lxml import etree
+    import ModelCache
+    import StreamReader
+    import StructuredOutput
+
+    conditions = args.condition or []
+    includes = args.include or []
+
+    # A cached model has already been parsed, so just filter its
+    # records. Otherwise test the conditions on each element as it
+    # is parsed, so only matching virtnodes are ever built.
+    records = None if args.no_cache else ModelCache.cached_virtnodes(args.model_file)
+    if records is not None:
+        nodes = (node for node in records
+                 if all(node.get(cond_attr) == cond_val for cond_attr,cond_val in conditions))
+    else:
+        nodes = StreamReader.matching_records(args.model_file,'virtnode',conditions)
 
-    with open(args.model_file) as f:
-        tree = etree.parse(f)
-
-    virtnodes = tree.xpath("//virtnode")
-    if len(virtnodes) == 0:
-        sys.stderr.write("Warning: didn't find any virtual nodes. Did you provide a .model file as input?\n")
-    
-    nodes = []
-    for node in virtnodes:
-      saved = dict()
-      try:
-        for (cond_attr,cond_val) in args.condition:
-          try:
-            if node.get( cond_attr ) != cond_val:
-              raise RuntimeError
-            else:
-              saved[cond_attr] = node.get( cond_attr )
-          except KeyError:
-            raise RuntimeError
-      except RuntimeError:
-        continue
-      
-      for included in args.include:
-        try:
-          if node.get(included):
-            saved[included] = node.get( included ) 
-          else: raise KeyError()
-        except KeyError:
-            sys.stderr.write("Failed to include '%s' because it was not found in the model file.\n"%included)
+    try:
+        writer = StructuredOutput.ListWriter(sys.stdout,args.format)
+    except ValueError as e:
+        sys.stderr.write("Error: %s\n" % e)
+        sys.exit(1)
+
+    # Write the nodes in chunks, each a piece of one list
+    chunk = []
+    for node in nodes:
+      saved = dict(conditions)
+      for included in includes:
+        if node.get(included):
+          saved[included] = node.get(included)
+        else:
+          sys.stderr.write("Failed to include '%s' because it was not found in the model file.\n"%included)
 
-      nodes.append(saved)
+      chunk.append(saved)
+      if len(chunk) == 1000:
+        writer.write(chunk)
+        chunk = []
+    writer.write(chunk)
 
-    print yaml.dump(nodes)
+    if writer.written == 0:
+      sys.stderr.write("Warning: didn't find any matching virtual nodes. Did you provide a .model file as input?\n")
+    writer.close()
 
 
 def extract_node_list(args):
+    import StructuredOutput
     try:
-        nodelist = build_node_list(args)
-    except IOError as e:
+        writer = StructuredOutput.MappingWriter(sys.stdout,args.format,len(NODELIST_SECTIONS))
+        rng = random.Random(args.seed)
+        if args.stream:
+            select_node_list(args,emit=writer.write,rng=rng)
+        else:
+            nodelist = select_node_list(args,rng=rng)
+            for section in NODELIST_SECTIONS:
+                writer.write(section,nodelist[section])
+        writer.close()
+    except (IOError,ValueError) as e:
         sys.stderr.write("Error: %s\n" % e)
         return
 
+"""
+The sections of a node list, in the order they are written
+"""
+NODELIST_SECTIONS = ('authorities','clients','destinations','relays')
+
+def select_node_list(args,nodelist=None,emit=None,rng=random):
+    """
+    Build the node list for <b>args.model_file</b> and select
+    the relays and clients to use from it, as set by the
+    extract_node_list options in <b>args</b>.
+
+    If <b>nodelist</b> is given, the selection is made from it
+    instead of building the list again. It is modified in place.
+
+    If <b>emit</b> is given, emit(section,nodes) is called for
+    each section in NODELIST_SECTIONS order as soon as its
+    selection is final, and the section is then dropped from the
+    list, so it can be written out without waiting for the rest.
+
+    Every choice is drawn from <b>rng</b>, a random.Random, so
+    a seeded one always selects the same nodes.
+    """
+    if nodelist is None:
+        nodelist = build_node_list(args)
+
+    counts = {}
+    def finished(*sections):
+        for section in sections:
+            counts[section] = len(nodelist[section])
+            if emit is not None:
+                emit(section,nodelist.pop(section))
+
     # Shuffle so we get a random order of nodes in our resultant list.
     # This will hopefully make it better if we don't use all of the nodes in our sample
     # Arrange the relays in order of descending bandwidth so the distribution
     # we sample has a bit of everything.
-    [random.shuffle(nodetype) for nodetype in nodelist.itervalues() if nodetype != 'relays']
+    [rng.shuffle(nodetype) for nodetype in nodelist.itervalues() if nodetype != 'relays']
+    finished('authorities')
 
-    if args.num_relays != 'all':
+    if args.num_relays not in (None,'all'):
         nodelist['relays'].sort(key=lambda x: float(x['bw']),reverse=True)
-        nodelist['relays'] = choose_uniformly(nodelist['relays'],
-                                              int(args.num_relays))
+        nodelist['relays'] = choose_relays(nodelist['relays'],int(args.num_relays),args,rng)
 
     if all(map(lambda node: node['exit'] != '1', nodelist['relays'])):
         sys.stderr.write("Warning: Did not select any exit nodes\n")
 
     if args.num_clients:
-        tmp = random.sample(nodelist['clients'],args.num_clients)
+        tmp = rng.sample(nodelist['clients'],args.num_clients)
         nodelist['clients'] = tmp
+    finished('clients','destinations')
 
     for relay in nodelist['relays']:
         bw = relay['bw']
@@ -103,46 +152,177 @@ def extract_node_list(args):
         relay['bw'] = str('%d %s'% (int(float(bw)),args.bw_units))
         relay['avg_bw'] = "%d %s"% (int(float(avg_bw)),args.bw_units)
         relay['burst_bw'] = "%d %s"% (int(float(burst_bw)),args.bw_units)
-
+    finished('relays')
 
     sys.stderr.write("Wrote %s clients, %s destinations, %s relays,and %s authorities\n"
-                        % (len(nodelist['clients']),len(nodelist['destinations']),
-                            len(nodelist['relays']),len(nodelist['authorities'])))
+                        % (counts['clients'],counts['destinations'],
+                            counts['relays'],counts['authorities']))
 
-    print yaml.dump(nodelist)
+    return nodelist
 
-def choose_uniformly(l,n):
+"""
+The keys a sweep entry may set, and the extract_node_list
+options they override
+"""
+SWEEP_KEYS = {'num_relays':'num_relays',
+              'num_clients':'num_clients',
+              'min_relay_bandwidth':'min_relay_bandwidth',
+              'seed':'seed',
+              'output':'output'}
+
+"""
+The unfiltered node list shared by the extract_node_lists
+workers. It is set before the pool is created so forked workers
+inherit it rather than having it pickled to them.
+"""
+_sweep_nodelist = None
+
+def read_sweep(sweep_file,pattern,defaults):
+    """
+    Read the list of sweep entries in the YAML file
+    <b>sweep_file</b>, filling in missing keys from the dict
+    <b>defaults</b>. Entries without an 'output' are written to
+    the file named by <b>pattern</b> % the entry (which also has
+    its 'index' in the list).
     """
-    Choose n elements from l, by partitioning l
-    into n buckets, and selecting one element at
-    random from each bucket.
+    with open(sweep_file) as f:
+        entries = yaml.safe_load(f)
+    if not isinstance(entries,list):
+        raise ValueError("'%s' should hold a list of sweep entries" % sweep_file)
+
+    sweep = []
+    for index,entry in enumerate(entries):
+        if not isinstance(entry,dict):
+            raise ValueError("Sweep entry %d is not a mapping" % index)
+        unknown = set(entry) - set(SWEEP_KEYS)
+        if unknown:
+            raise ValueError("Sweep entry %d has unknown key(s) %s. Expected some of %s"
+                             % (index,", ".join(sorted(unknown)),", ".join(sorted(SWEEP_KEYS))))
+
+        entry = dict(entry)
+        for key in SWEEP_KEYS:
+            entry.setdefault(key,defaults.get(key))
+        entry['num_relays'] = str(entry['num_relays'] or 'all')
+        entry['index'] = index
+        if entry['output'] is None:
+            entry['output'] = pattern % entry
+        sweep.append(entry)
+    return sweep
+
+def _select_sweep_entry(task):
+    import StructuredOutput
+
+    args,entry = task
+    entry_args = argparse.Namespace(**vars(args))
+    for key,option in SWEEP_KEYS.iteritems():
+        setattr(entry_args,option,entry[key])
+
+    # Entries without a seed get a fresh one from the OS, not a
+    # copy of the random state the worker was forked with.
+    rng = random.Random(entry['seed'])
+
+    min_bw = entry['min_relay_bandwidth']
+    nodelist = dict((nodetype,[dict(node) for node in nodes
+                               if not (nodetype == 'relays' and min_bw
+                                       and float(node['bw']) < min_bw)])
+                    for nodetype,nodes in _sweep_nodelist.iteritems())
+    nodelist = select_node_list(entry_args,nodelist,rng=rng)
+
+    with open(entry['output'],'wb') as out:
+        StructuredOutput.write_mapping(nodelist,out,args.format)
+    return entry['output']
+
+def extract_node_lists(args):
+    import multiprocessing
+    import Sampling
+    import StructuredOutput
+
+    global _sweep_nodelist
+
+    try:
+        StructuredOutput.check_format(args.format)
+        defaults = dict((key,getattr(args,option,None)) for key,option in SWEEP_KEYS.iteritems())
+        # --seed seeds the sweep, not each entry: entries without a
+        # seed of their own get one derived from it and their index,
+        # so the results don't depend on --jobs.
+        defaults['seed'] = None
+        sweep = read_sweep(args.sweep_file,args.pattern,defaults)
+        if args.seed is not None:
+            for entry in sweep:
+                if entry['seed'] is None:
+                    entry['seed'] = Sampling.derive_seed(args.seed,entry['index'])
+        if args.output_dir:
+            for entry in sweep:
+                entry['output'] = os.path.join(args.output_dir,entry['output'])
+
+        # Parse once, keeping every relay; each entry applies its
+        # own bandwidth threshold.
+        base_args = argparse.Namespace(**vars(args))
+        base_args.min_relay_bandwidth = None
+        _sweep_nodelist = build_node_list(base_args)
+    except (IOError,ValueError,yaml.YAMLError) as e:
+        sys.stderr.write("Error: %s\n" % e)
+        sys.exit(1)
+
+    tasks = [(args,entry) for entry in sweep]
+    try:
+        if args.jobs > 1:
+            pool = multiprocessing.Pool(min(args.jobs,len(tasks)) or 1)
+            try:
+                outputs = pool.map(_select_sweep_entry,tasks)
+                pool.close()
+                pool.join()
+            finally:
+                pool.terminate()
+        else:
+            outputs = map(_select_sweep_entry,tasks)
+    except ValueError as e:
+        sys.stderr.write("Error: %s\n" % e)
+        sys.exit(1)
+    _sweep_nodelist = None
 
-    The list elements chose will be in the same order
-    as in l.
+    sys.stderr.write("Wrote %d node lists\n" % len(outputs))
 
-    @raise IndexError
+def choose_relays(relays,n,args,rng=random):
     """
-    ret = []
-    for i,chunk in enumerate(_chunks(l,len(l)/n)):
-        if i == n:
-            break
-        ret.append(random.choice(chunk))
-    return ret
+    Choose n of <b>relays</b> with the sampler named by
+    <b>args.sampler</b>, weighted by bandwidth, including at
+    least args.min_exits exits and args.min_guards guards.
+    The relays chosen stay in the same order as in relays. The
+    sampler's draws are seeded from <b>rng</b>.
+
+    @raise ValueError if there aren't enough relays to choose
+    from
+    """
+    import Sampling
+
+    quotas = []
+    if args.min_exits:
+        quotas.append(('exits',[relay['exit'] == '1' for relay in relays],args.min_exits))
+    if args.min_guards:
+        quotas.append(('guards',[relay['guard'] == '1' for relay in relays],args.min_guards))
 
-def _chunks(l,n):
-    return (l[i:i+n] for i in xrange(0,len(l),n))
+    chosen = Sampling.sample_with_quotas(Sampling.SAMPLERS[args.sampler],
+                                         [float(relay['bw']) for relay in relays],n,quotas,
+                                         Sampling.numpy_rng(rng))
+    return [relays[i] for i in chosen]
 
-def build_node_list(args):
-    from lxml import etree
+def build_node_list(args,with_guards=False):
+    """
+    Read the clients, destinations, relays and authorities of
+    args.model_file into a node list. Relays are flagged as guards
+    if <b>with_guards</b> or --min_guards is given.
+    """
+    import ModelCache
 
-    with open(args.model_file) as f:
-        tree = etree.parse(f)
+    relay_attrs = ['bw',(args.exit_key,'exit'),'avg_bw','burst_bw']
+    if with_guards or getattr(args,'min_guards',None):
+        relay_attrs.append((args.guard_key,'guard'))
 
     nodelist = { 'clients':[],'destinations':[],'relays':[],'authorities':[] }
-    virtnodes = tree.xpath("//virtnode")
-    if len(virtnodes) == 0:
-        sys.stderr.write("Warning: didn't find any virtual nodes. Did you provide a .model file as input?\n")
-    for node in virtnodes:
+    found = 0
+    for node in ModelCache.virtnodes(args.model_file,not args.no_cache):
+        found += 1
         if node.get('nodetype') == 'client':
             nodelist['clients'].append(mk_struct(node))
         elif node.get('nodetype') == 'dest':
@@ -151,11 +331,13 @@ def build_node_list(args):
               and node.get(args.authority_key) != '1'):
             if args.min_relay_bandwidth and float(node.get('bw')) < args.min_relay_bandwidth:
                 continue
-            nodelist['relays'].append(mk_struct(node,'bw',(args.exit_key,'exit'),'avg_bw','burst_bw'))
+            nodelist['relays'].append(mk_struct(node,*relay_attrs))
         elif (node.get('nodetype') == args.relay_nodetype
               and node.get(args.authority_key) == '1'):
             nodelist['authorities'].append(mk_struct(node,'bw',(args.exit_key,'exit'),'avg_bw','burst_bw'))
 
+    if found == 0:
+        sys.stderr.write("Warning: didn't find any virtual nodes. Did you provide a .model file as input?\n")
 
     if len(nodelist['relays']) + len(nodelist['authorities']) == 0:
       sys.stderr.write("Warning: didn't find any relays. Did you "
@@ -164,20 +346,239 @@ def build_node_list(args):
 
     return nodelist
 
+"""
+The CircuitSampler shared by the sample_circuits workers, set
+before the pool is created so forked workers inherit it
+"""
+_circuit_sampler = None
+
+def _sample_circuit_chunk(task):
+    import numpy
+    import Sampling
+
+    seed,index,count = task
+    rng = numpy.random.RandomState(Sampling.derive_seed(seed,index))
+    return _circuit_sampler.sample(count,rng)
+
+def read_relays(args):
+    """
+    Return the relays in args.input: a node list, or a ModelNet
+    model file, whose relays are read as extract_node_list would
+    with guard flags added
+    """
+    import StructuredOutput
+
+    with open(args.input,'rb') as f:
+        is_model = f.read(1024).lstrip().startswith('<')
+        if not is_model:
+            f.seek(0)
+            nodelist = StructuredOutput.read(f,StructuredOutput.format_of(args.input))
+    if is_model:
+        model_args = argparse.Namespace(**vars(args))
+        model_args.model_file = args.input
+        nodelist = build_node_list(model_args,with_guards=True)
+    if not isinstance(nodelist,dict) or not isinstance(nodelist.get('relays'),list):
+        raise ValueError("'%s' isn't a node list with a list of relays" % args.input)
+    return nodelist['relays']
+
+def _bandwidth(bw):
+    # Node lists written with --bw_units have bw values like
+    # '4782 bytes'
+    return float(str(bw).split()[0])
+
+def _ip_number(ip):
+    try:
+        return struct.unpack("!I",socket.inet_aton(ip))[0]
+    except (TypeError,socket.error):
+        raise ValueError("Relay has a bad IP address '%s'" % ip)
+
+def sample_circuits(args):
+    import multiprocessing
+    import numpy
+    import Sampling
+
+    global _circuit_sampler
+
+    fmt = args.format or ('csv' if args.output.endswith('.csv') else 'npy')
+    seed = args.seed if args.seed is not None else random.SystemRandom().getrandbits(32)
+    try:
+        if args.num_circuits < 0 or args.chunk_size < 1:
+            raise ValueError("NUM_CIRCUITS can't be negative and --chunk_size must be positive")
+        relays = read_relays(args)
+        weights = [_bandwidth(relay.get('bw',0)) for relay in relays]
+        exits = [str(relay.get('exit')) == '1' for relay in relays]
+        guards = [str(relay.get('guard')) == '1' for relay in relays]
+        if not any(guards):
+            sys.stderr.write("Warning: no relays are flagged as guards, so any relay "
+                             "can be a guard\n")
+            guards = [True] * len(relays)
+        _circuit_sampler = Sampling.CircuitSampler(weights,exits,guards)
+        if fmt == 'npy':
+            ips = numpy.array([_ip_number(relay.get('ip')) for relay in relays],dtype='<u4')
+        else:
+            ips = numpy.array([relay.get('ip') for relay in relays],dtype=object)
+    except (IOError,ValueError,yaml.YAMLError) as e:
+        sys.stderr.write("Error: %s\n" % e)
+        sys.exit(1)
+
+    # Each chunk draws from its own stream, derived from the seed
+    # and the chunk's index, so the circuits don't depend on --jobs.
+    tasks = [(seed,index,min(args.chunk_size,args.num_circuits - start))
+             for index,start in enumerate(xrange(0,args.num_circuits,args.chunk_size))]
+    pool = None
+    try:
+        with open(args.output,'wb') as out:
+            if fmt == 'npy':
+                numpy.lib.format.write_array_header_1_0(out,{'descr':'<u4',
+                                                             'fortran_order':False,
+                                                             'shape':(args.num_circuits,3)})
+            else:
+                out.write("guard,middle,exit\n")
+
+            if args.jobs > 1 and len(tasks) > 1:
+                pool = multiprocessing.Pool(min(args.jobs,len(tasks)))
+                chunks = pool.imap(_sample_circuit_chunk,tasks)
+            else:
+                chunks = (_sample_circuit_chunk(task) for task in tasks)
+            for circuits in chunks:
+                if fmt == 'npy':
+                    out.write(ips[circuits].tostring())
+                else:
+                    out.write("".join("%s,%s,%s\n" % tuple(row) for row in ips[circuits]))
+        if pool is not None:
+            pool.close()
+            pool.join()
+    except (IOError,ValueError) as e:
+        sys.stderr.write("Error: %s\n" % e)
+        sys.exit(1)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    _circuit_sampler = None
+
+    sys.stderr.write("Wrote %d circuits to '%s'\n" % (args.num_circuits,args.output))
+
 
 def gen_modelnet_graph(args):
+    if args.cache and args.output is None:
+        sys.stderr.write("Error: --cache needs the .graph file to be written with -o\n")
+        sys.exit(1)
     try:
-        MNXMLWriter.main_fun(args.graph_xml)
+        MNXMLWriter.main_fun(args.graph_xml,args.streaming,args.output)
+        if args.cache:
+            import CompactGraph
+            CompactGraph.build_graph_cache(args.output)
         sys.stderr.write("\n".join(["Successfully Wrote .graph file. Use the Modelnet tools 'allpairs'",
                          "and 'mkmodel' to generate topology files"]))
     except IOError:
         sys.stderr.write("Failed to read '%s'" % args.graph_xml)
+    except ValueError as e:
+        sys.stderr.write("Error: %s\n" % e)
+
+def build_experiment(args):
+    import CompactGraph
+    import RouteFiles
+    import StructuredOutput
+    import ValidatePathDistances
+
+    if args.csr and args.w not in (None,'int_delayms'):
+        sys.stderr.write("Error: compact graphs can only be weighted by 'int_delayms'\n")
+        sys.exit(1)
+
+    graph_file = args.prefix + ".graph"
+    route_file = args.prefix + (".route" if args.format == 'xml' else ".route.bin")
+    try:
+        writer = MNXMLWriter.convert(args.graph_xml,args.streaming,graph_file,columns=True)
+        columns = writer.graph_columns()
+        del writer
+        sys.stderr.write("Wrote '%s'\n" % graph_file)
+
+        if args.cache:
+            CompactGraph.write_graph_cache(columns,CompactGraph.cache_path(graph_file))
+            sys.stderr.write("Wrote '%s'\n" % CompactGraph.cache_path(graph_file))
+
+        if args.csr:
+            gr = CompactGraph.csr_from_columns(columns)
+        else:
+            gr = ValidatePathDistances.graph_from_columns(columns)
+        del columns
+
+        with open(route_file,'wb') as out:
+            ValidatePathDistances.write_routes(gr,out,args.w,args.jobs,args.shard_dir,args.format)
+        del gr
+        sys.stderr.write("\nWrote '%s'\n" % route_file)
+
+        if args.model_file:
+            nodelist = select_node_list(args,rng=random.Random(args.seed))
+            with open(args.prefix + ".nodes.yaml",'w') as out:
+                StructuredOutput.write_mapping(nodelist,out)
+            sys.stderr.write("Wrote '%s'\n" % (args.prefix + ".nodes.yaml"))
+        else:
+            sys.stderr.write("Run mkmodel on '%s' and '%s', then pass the model with "
+                             "--model_file to write the node list\n" % (graph_file,route_file))
+    except (IOError,ValueError) as e:
+        sys.stderr.write("Error: %s\n" % e)
+        sys.exit(1)
+
+def model_cache(args):
+    import ModelCache
+    import sqlite3
+    import time
+
+    try:
+        db = ModelCache.connect()
+        if args.action == 'warm':
+            if not args.model_files:
+                sys.stderr.write("Error: 'warm' needs at least one model file\n")
+                sys.exit(1)
+            for model_file,count in zip(args.model_files,ModelCache.warm(args.model_files,db)):
+                sys.stderr.write("Cached %d virtnodes from '%s'\n" % (count,model_file))
+        elif args.action == 'show':
+            sys.stdout.write("Model cache '%s'\n" % ModelCache.cache_path())
+            for path,size,mtime,sha1,count,cached,stale in ModelCache.entries(db):
+                sys.stdout.write("%s\n  %d bytes, %d virtnodes, sha1 %s, cached %s%s\n"
+                                 % (path,size,count,sha1,
+                                    time.strftime("%Y-%m-%d %H:%M:%S",time.localtime(cached)),
+                                    " (stale)" if stale else ""))
+        else:
+            removed = ModelCache.clear(db,args.model_files or None)
+            sys.stderr.write("Removed %d cached model(s)\n" % removed)
+        db.close()
+    except (IOError,OSError,sqlite3.Error) as e:
+        sys.stderr.write("Error: %s\n" % e)
+        sys.exit(1)
+
+def cache_graph(args):
+    import CompactGraph
+    try:
+        cache_file = CompactGraph.build_graph_cache(args.graph_file)
+        sys.stderr.write("Wrote graph cache '%s'\n" % cache_file)
+    except (IOError,ValueError) as e:
+        sys.stderr.write("Error: %s\n" % e)
+        sys.exit(1)
 
 def check_model(args):
+    import ModelFunctions
     try:
-        ModelFunctions.check_model(args.model_file)
-    except IOError:
-        sys.stderr.write("Failed to read '%s'" % args.model_file)
+        report = ModelFunctions.check_model(args.model_file,args.examples)
+    except IOError as e:
+        sys.stderr.write("Error: %s\n" % e)
+        sys.exit(1)
+    report.write(sys.stdout)
+    if not report.ok():
+        sys.exit(1)
+
+def cross_check(args):
+    import CrossCheck
+    try:
+        report = CrossCheck.cross_check(args.graph_file,args.model_file,
+                                        args.route_file,args.examples)
+    except (IOError,ValueError) as e:
+        sys.stderr.write("Error: %s\n" % e)
+        sys.exit(1)
+    report.write(sys.stdout)
+    if not report.ok():
+        sys.exit(1)
 
 def validate_distances(args):
     import ValidatePathDistances
@@ -186,10 +587,110 @@ def validate_distances(args):
                                        args.model_xml,
                                        args.sample_size,
                                        args.route_xml,
-                                       args.modelnetping_bin)
+                                       args.modelnetping_bin,
+                                       args.jobs,
+                                       args.timeout,
+                                       args.group_by_source,
+                                       args.seed)
     except IOError as e:
         sys.stderr.write("%s" % e)
 
+def validate_routes(args):
+    import ValidatePathDistances
+    try:
+        bad = ValidatePathDistances.validate_routes(args.graph_xml,args.route_file,
+                                                    args.jobs,args.show)
+    except (IOError,ValueError) as e:
+        sys.stderr.write("Error: %s\n" % e)
+        sys.exit(1)
+    if bad:
+        sys.exit(2)
+
+def index_routes(args):
+    import RouteFiles
+    try:
+        index_file = RouteFiles.build_route_index(args.route_file,args.output)
+        sys.stderr.write("Wrote route index '%s'\n" % index_file)
+    except IOError as e:
+        sys.stderr.write("Error: %s\n" % e)
+
+def convert_routes(args):
+    import RouteFiles
+    try:
+        with open(args.output,'wb') as out:
+            RouteFiles.convert_routes(args.route_file,out)
+    except IOError as e:
+        sys.stderr.write("Error: %s\n" % e)
+        sys.exit(1)
+
+def update_routes(args):
+    import IncrementalRoutes
+    try:
+        rerouted = IncrementalRoutes.update_routes(args.old_graph,args.new_graph,
+                                                   args.route_file,sys.stdout,
+                                                   args.w,args.csr)
+        sys.stderr.write("Rerouted %d sources\n" % rerouted)
+    except (IOError,ValueError) as e:
+        sys.stderr.write("Error: %s\n" % e)
+        sys.exit(1)
+
+def add_node_list_options(parser):
+    """
+    Add the options that control which nodes go in a node list
+    to <b>parser</b>
+    """
+    parser.add_argument("-r","--num_relays", type=str,
+                            help="Select NUM_RELAYS relays from the list at random")
+    parser.add_argument("-c","--num_clients", type=int,
+                            help="Select NUM_RELAYS clients from the list at random")
+    add_model_options(parser)
+    parser.add_argument('--seed',type=int,default=None,
+                help="Seed the random choices, so the same seed always gives the same node list")
+    parser.add_argument('--sampler',choices=['uniform','stratified','systematic','weighted'],
+                            default='uniform',
+                help="How to choose NUM_RELAYS relays: 'uniform' picks one uniformly from each of "
+                     "NUM_RELAYS runs of the relays sorted by bandwidth, 'stratified' picks one "
+                     "from each run weighted by bandwidth, 'systematic' uses probability "
+                     "proportional to bandwidth systematic sampling and 'weighted' draws relays "
+                     "by bandwidth, as Tor does. Default: uniform")
+    parser.add_argument('--min_exits',type=int,default=None,
+                help="Choose at least this many exits among the NUM_RELAYS relays")
+    parser.add_argument('--min_guards',type=int,default=None,
+                help="Choose at least this many guards among the NUM_RELAYS relays")
+
+def add_model_options(parser):
+    """
+    Add the options that control how relays are read from a
+    model to <b>parser</b>
+    """
+    parser.add_argument("-b","--min_relay_bandwidth",type=int,
+                            help="Only print relays with bandwidth greater than this value")
+    parser.add_argument('--relay_nodetype',type=str,
+                            default='tor_relay',
+                help="The nodetype of Tor relays in the model. Defaults to 'tor_relay'")
+    parser.add_argument('--bw_units',type=str,
+                            default='bytes',
+                            help="The units the bw numbers are measured in")
+    parser.add_argument('--exit_key',type=str,
+                            default='exit',
+                help="The name of the key used to designate exits in the model. Default: 'exit'")
+    parser.add_argument('--guard_key',type=str,
+                            default='guard',
+                help="The name of the key used to designate guards in the model. Default: 'guard'")
+    parser.add_argument('--authority_key',type=str,
+                            default='authority',
+                help="The name of the key used to designate authorities in the model. Default: 'authority'")
+    parser.add_argument('--no_cache',action="store_true",default=False,
+                help="Parse the model file instead of reading its virtnodes from the model cache")
+
+def add_format_option(parser):
+    """
+    Add the option that sets the output format to <b>parser</b>
+    """
+    parser.add_argument('--format',choices=['yaml','json','msgpack'],default='yaml',
+                help="The format to write the output in. msgpack needs the msgpack "
+                     "module. Default: yaml")
+
 def main():
     parser = argparse.ArgumentParser()
     cmd_parser = parser.add_subparsers(title="Commands")
@@ -200,37 +701,114 @@ def main():
                               +"a Guard attibute with the value 1. This can be specified "+
                               "multiple times and the conditions will be ANDed together.", nargs=2,action="append")
     guard_parser.add_argument("--include",help="The additional attributes to include for each node",action="append")
+    guard_parser.add_argument('--no_cache',action="store_true",default=False,
+                help="Parse the model file instead of reading its virtnodes from the model cache")
+    add_format_option(guard_parser)
     guard_parser.set_defaults(func=extract_attributes)
 
     xnl_parser = cmd_parser.add_parser('extract_node_list',
                             help="Extract a node list for use with ExperimenTor")
     xnl_parser.add_argument("model_file",help="The ModelNet model file")
-    xnl_parser.add_argument("-r","--num_relays", type=str,
-                            help="Select NUM_RELAYS relays from the list at random")
-    xnl_parser.add_argument("-c","--num_clients", type=int,
-                            help="Select NUM_RELAYS clients from the list at random")
-    xnl_parser.add_argument("-b","--min_relay_bandwidth",type=int,
-                            help="Only print relays with bandwidth greater than this value")
-    xnl_parser.add_argument('--relay_nodetype',type=str,
-                            default='tor_relay',
-                help="The nodetype of Tor relays in the model. Defaults to 'tor_relay'")
-    xnl_parser.add_argument('--bw_units',type=str,
-                            default='bytes',
-                            help="The units the bw numbers are measured in")
-    xnl_parser.add_argument('--exit_key',type=str,
-                            default='exit',
-                help="The name of the key used to designate exits in the model. Default: 'exit'")
-    xnl_parser.add_argument('--authority_key',type=str,
-                            default='authority',
-                help="The name of the key used to designate authorities in the model. Default: 'authority'")
-
+    add_node_list_options(xnl_parser)
+    add_format_option(xnl_parser)
+    xnl_parser.add_argument('--stream',action="store_true",default=False,
+                help="Write each section of the node list as soon as it has been selected")
     xnl_parser.set_defaults(func=extract_node_list)
 
+    xnls_parser = cmd_parser.add_parser('extract_node_lists',
+                            help="Extract a node list for every entry of a parameter sweep, parsing the model once")
+    xnls_parser.add_argument("model_file",help="The ModelNet model file")
+    xnls_parser.add_argument("sweep_file",
+                help="A YAML list of sweep entries, each a mapping with any of the keys "
+                     "num_relays, num_clients, min_relay_bandwidth, seed and output. Keys an "
+                     "entry leaves out default to the command line options")
+    xnls_parser.add_argument("-d","--output_dir",default=None,
+                help="The directory to write the node lists to. Default: the current directory")
+    xnls_parser.add_argument("--pattern",default="nodelist_%(index)03d.yaml",
+                help="The name of the node list for entries without an 'output', formatted with "
+                     "the entry's keys and its 'index'. Default: 'nodelist_%%(index)03d.yaml'")
+    xnls_parser.add_argument("-j","--jobs",type=int,default=1,
+                help="The number of processes to select node lists with. Default: 1")
+    add_node_list_options(xnls_parser)
+    add_format_option(xnls_parser)
+    xnls_parser.set_defaults(func=extract_node_lists)
+
+    circ_parser = cmd_parser.add_parser('sample_circuits',
+                            help="Sample Tor circuits, weighted by bandwidth, from a node list or model")
+    circ_parser.add_argument("input",
+                help="A node list written by extract_node_list (YAML unless it ends in .json or "
+                     ".msgpack), or a ModelNet model file")
+    circ_parser.add_argument("num_circuits",type=int,help="The number of circuits to sample")
+    circ_parser.add_argument("-o","--output",required=True,
+                help="The file to write the circuits to")
+    circ_parser.add_argument("--format",choices=['npy','csv'],default=None,
+                help="'npy' writes an NUM_CIRCUITS x 3 array of the guard, middle and exit IPs "
+                     "as unsigned 32 bit ints, 'csv' writes them as dotted quads. Default: csv "
+                     "if OUTPUT ends in .csv, npy otherwise")
+    circ_parser.add_argument("-j","--jobs",type=int,default=1,
+                help="The number of processes to sample circuits with. Default: 1")
+    circ_parser.add_argument("--chunk_size",type=int,default=1000000,
+                help="The number of circuits sampled at a time. Default: 1000000")
+    circ_parser.add_argument('--seed',type=int,default=None,
+                help="Seed the sampler, so the same seed always gives the same circuits")
+    add_model_options(circ_parser)
+    circ_parser.set_defaults(func=sample_circuits)
+
     gengr_parser = cmd_parser.add_parser('gen_modelnet_graph',
                             help="Generate a modelnet graph from a TorTopology xml file")
     gengr_parser.add_argument("graph_xml", help="The TorTopology xml file")
+    gengr_parser.add_argument("--streaming",action="store_true",default=False,
+                     help="Stream the TorTopology file instead of loading it into memory. "
+                          "Vertices are numbered in file order, so the output differs from "
+                          "the default, which numbers them in the graph's iteration order")
+    gengr_parser.add_argument("-o","--output",default=None,
+                     help="Write the .graph file to OUTPUT instead of stdout")
+    gengr_parser.add_argument("--cache",action="store_true",default=False,
+                     help="Also write a columnar cache of the graph to OUTPUT.cache, which "
+                          "allpairs, validate_paths and validate_routes load instead of the XML")
     gengr_parser.set_defaults(func=gen_modelnet_graph)
 
+    mcache_parser = cmd_parser.add_parser('model_cache',
+                            help="Pre-parse model files into the virtnode cache used by extract_node_list "
+                                 "and extract_attribute_list, or show or clear the cache")
+    mcache_parser.add_argument("action",choices=['warm','show','clear'],
+                help="'warm' caches the given model files, 'show' lists the cached models, "
+                     "'clear' removes the given model files (or everything) from the cache")
+    mcache_parser.add_argument("model_files",nargs="*",help="The ModelNet model files")
+    mcache_parser.set_defaults(func=model_cache)
+
+    cache_parser = cmd_parser.add_parser('cache_graph',
+                            help="Write the columnar cache of an existing ModelNet .graph file")
+    cache_parser.add_argument("graph_file",help="The ModelNet .graph file")
+    cache_parser.set_defaults(func=cache_graph)
+
+    build_parser = cmd_parser.add_parser('build_experiment',
+                            help="Generate the .graph file, the routes and the node list from a TorTopology xml file in one process")
+    build_parser.add_argument("graph_xml",help="The TorTopology xml file")
+    build_parser.add_argument("prefix",
+                help="Write PREFIX.graph, PREFIX.route (PREFIX.route.bin with '--format binary') "
+                     "and PREFIX.nodes.yaml")
+    build_parser.add_argument("--streaming",action="store_true",default=False,
+                help="Convert the TorTopology file as 'gen_modelnet_graph --streaming' does")
+    build_parser.add_argument("--cache",action="store_true",default=False,
+                help="Also write the columnar cache PREFIX.graph.cache")
+    build_parser.add_argument("-w",default=None,metavar="<weight attribute>",
+                help="Attribute to use for shortest path weight, as for allpairs")
+    build_parser.add_argument("-j","--jobs",type=int,default=1,
+                help="Number of worker processes to route with. Default: 1")
+    build_parser.add_argument("--shard_dir",default=None,
+                help="Directory to write the per-worker route shards to. "
+                     "Defaults to a temporary directory")
+    build_parser.add_argument("--csr",action="store_true",default=False,
+                help="Route on the compact graph, as 'allpairs --csr' does")
+    build_parser.add_argument("--format",choices=['binary','xml'],default='xml',
+                help="The route file format to write. Default: xml")
+    build_parser.add_argument("--model_file",default=None,
+                help="The ModelNet model file mkmodel built from the outputs of an earlier run. "
+                     "The node list is only written if this is given")
+    add_node_list_options(build_parser)
+    build_parser.set_defaults(func=build_experiment)
+
     validate_paths = cmd_parser.add_parser('validate_paths',
                             help="Validate that the latencies in the resultant topology are appropriate for the distances in the original graph")
     validate_paths.add_argument("graph_xml", help="The TorTopology xml file") 
@@ -242,11 +820,67 @@ def main():
                      help="The path to modelnetping. Default: ~/routing-metrics/tcpping/modelnetping",
                      default="~/routing-metrics/tcpping/modelnetping",
                      nargs="?")
-
-#    chk_model_parser =cmd_parser.add_parser("check_model",
-#                            help="Check that a Model file appears to have the right number of hops etc.")
-#    chk_model_parser.add_argument("model_file",help="The ModelNet model file")
-#    chk_model_parser.set_defaults(func=check_model)
+    validate_paths.add_argument("-j","--jobs",type=int,default=1,
+                     help="The number of pairs to probe with modelnetping at once. Default: 1")
+    validate_paths.add_argument("--timeout",type=float,default=None,
+                     help="Give up on a pair if modelnetping hasn't finished after TIMEOUT seconds")
+    validate_paths.add_argument("--group_by_source",action="store_true",default=False,
+                     help="Probe the sampled pairs in order of their source, so each source's "
+                          "shortest path tree is computed once and then discarded")
+    validate_paths.add_argument("--seed",type=int,default=None,
+                     help="Seed the choice of pairs, so the same seed always checks the same sample")
+
+    valroutes_parser = cmd_parser.add_parser('validate_routes',
+                            help="Check that the latency of every path in a route file matches the shortest path distance in the graph, without running modelnetping")
+    valroutes_parser.add_argument("graph_xml",help="The ModelNet .graph file")
+    valroutes_parser.add_argument("route_file",help="The XML or binary route file")
+    valroutes_parser.add_argument("-j","--jobs",type=int,default=1,
+                help="The number of worker processes to check paths with. Default: 1")
+    valroutes_parser.add_argument("--show",type=int,default=10,
+                help="Print the first SHOW mismatching paths. Default: 10")
+    valroutes_parser.set_defaults(func=validate_routes)
+
+    idx_parser = cmd_parser.add_parser('index_routes',
+                            help="Build a byte offset index of a ModelNet route file so path lookups don't scan the whole file")
+    idx_parser.add_argument("route_file",help="The ModelNet route file")
+    idx_parser.add_argument("-o","--output",default=None,
+                help="Where to write the index. Defaults to ROUTE_FILE.idx, where it is found automatically")
+    idx_parser.set_defaults(func=index_routes)
+
+    conv_parser = cmd_parser.add_parser('convert_routes',
+                            help="Convert a ModelNet XML route file to the compact binary route format, or back")
+    conv_parser.add_argument("route_file",help="The XML or binary route file to convert")
+    conv_parser.add_argument("output",help="Where to write the converted route file")
+    conv_parser.set_defaults(func=convert_routes)
+
+    upd_parser = cmd_parser.add_parser('update_routes',
+                            help="Regenerate a route file after editing a .graph file, rerouting only the sources the edits can affect")
+    upd_parser.add_argument("old_graph",help="The .graph file the route file was generated from")
+    upd_parser.add_argument("new_graph",help="The edited .graph file")
+    upd_parser.add_argument("route_file",help="The route file generated by allpairs from OLD_GRAPH")
+    upd_parser.add_argument("-w",default=None,metavar="<weight attribute>",
+                help="The weight attribute allpairs was run with. Only 'int_delayms' is supported")
+    upd_parser.add_argument("--csr",action="store_true",default=False,
+                help="Reroute with the compact graph, as 'allpairs --csr' does")
+    upd_parser.set_defaults(func=update_routes)
+
+    chk_model_parser =cmd_parser.add_parser("check_model",
+                            help="Check that a Model file appears to have the right number of hops etc.")
+    chk_model_parser.add_argument("model_file",help="The ModelNet model file")
+    chk_model_parser.add_argument("--examples",type=int,default=10,
+                help="The number of examples of each problem to list. Default: 10")
+    chk_model_parser.set_defaults(func=check_model)
+
+    xchk_parser = cmd_parser.add_parser("cross_check",
+                            help="Check that a .graph file, its .model file and a route file "
+                                 "number the virtnodes and hops the same way")
+    xchk_parser.add_argument("graph_file",help="The ModelNet .graph file")
+    xchk_parser.add_argument("model_file",help="The ModelNet model file built from the graph")
+    xchk_parser.add_argument("route_file",nargs='?',default=None,
+                help="The XML or binary route file to check against the model")
+    xchk_parser.add_argument("--examples",type=int,default=10,
+                help="The number of examples of each problem to list. Default: 10")
+    xchk_parser.set_defaults(func=cross_check)
 
     args = parser.parse_args()
     args.func(args)
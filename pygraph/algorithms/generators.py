@@ -34,12 +34,12 @@ Random graph generators.
 from pygraph.classes.graph import graph
 from pygraph.classes.digraph import digraph
 from pygraph.classes.hypergraph import hypergraph
-from random import randint, choice, shuffle
+import random
 
 
 # Generator
 
-def generate(num_nodes, num_edges, directed=False, weight_range=(1, 1)):
+def generate(num_nodes, num_edges, directed=False, weight_range=(1, 1), rng=random):
     """
     Create a random graph.
     
@@ -55,6 +55,10 @@ def generate(num_nodes, num_edges, directed=False, weight_range=(1, 1)):
     @type  weight_range: tuple
     @param weight_range: tuple of two integers as lower and upper limits on randomly generated
     weights (uniform distribution).
+
+    @type  rng: random.Random
+    @param rng: Source of random numbers. Pass a seeded instance to generate the same graph
+    every time. Defaults to the random module.
     """
     # Graph creation
     if directed:
@@ -76,7 +80,7 @@ def generate(num_nodes, num_edges, directed=False, weight_range=(1, 1)):
     
     # Randomize the list
     for i in range(len(edges)):
-        r = randint(0, len(edges)-1)
+        r = rng.randint(0, len(edges)-1)
         edges[i], edges[r] = edges[r], edges[i]
     
         # Add edges to the graph
@@ -84,12 +88,12 @@ def generate(num_nodes, num_edges, directed=False, weight_range=(1, 1)):
         max_wt = max(weight_range)
     for i in range(num_edges):
         each = edges[i]
-        random_graph.add_edge((each[0], each[1]), wt = randint(min_wt, max_wt))
+        random_graph.add_edge((each[0], each[1]), wt = rng.randint(min_wt, max_wt))
 
     return random_graph
 
 
-def generate_hypergraph(num_nodes, num_edges, r = 0):
+def generate_hypergraph(num_nodes, num_edges, r = 0, rng=random):
     """
     Create a random hyper graph.
     
@@ -101,6 +105,9 @@ def generate_hypergraph(num_nodes, num_edges, r = 0):
     
     @type  r: number
     @param r: Uniform edges of size r.
+
+    @type  rng: random.Random
+    @param rng: Source of random numbers. Defaults to the random module.
     """
     # Graph creation
     random_graph = hypergraph()
@@ -118,14 +125,14 @@ def generate_hypergraph(num_nodes, num_edges, r = 0):
         # Add each edge with 50/50 probability
         for e in edges:
             for n in nodes:
-                if choice([True, False]):
+                if rng.choice([True, False]):
                     random_graph.link(n, e)
     
     else:
         # Add only uniform edges
         for e in edges:
             # First shuffle the nodes
-            shuffle(nodes)
+            rng.shuffle(nodes)
             
             # Then take the first r nodes
             for i in range(r):
@@ -69,14 +69,8 @@ class euclidean(object):
         """
         for start in graph.nodes():
             for end in graph.nodes():
-                for each in graph.node_attributes(start):
-                    if (each[0] == 'position'):
-                        start_attr = each[1]
-                        break
-                for each in graph.node_attributes(end):
-                    if (each[0] == 'position'):
-                        end_attr = each[1]
-                        break
+                start_attr = graph.node_attribute(start, 'position')
+                end_attr = graph.node_attribute(end, 'position')
                 dist = 0
                 for i in range(len(start_attr)):
                     dist = dist + (float(start_attr[i]) - float(end_attr[i]))**2
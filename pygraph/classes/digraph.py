@@ -133,7 +133,7 @@ class digraph (basegraph, common, labeling):
         if (node not in self.node_neighbors):
             self.node_neighbors[node] = []
             self.node_incidence[node] = []
-            self.node_attr[node] = attrs
+            self.add_node_labeling(node, attrs)
         else:
             raise AdditionError("Node %s already in digraph" % node)
 
@@ -117,7 +117,7 @@ class graph ( basegraph, common, labeling, ):
         """
         if (not node in self.node_neighbors):
             self.node_neighbors[node] = []
-            self.node_attr[node] = attrs
+            self.add_node_labeling(node, attrs)
         else:
             raise AdditionError("Node %s already in graph" % node)
 
@@ -162,7 +162,7 @@ class graph ( basegraph, common, labeling, ):
             if (each != node):
                 self.del_edge((each, node))
         del(self.node_neighbors[node])
-        del(self.node_attr[node])
+        self.del_node_labeling(node)
 
 
     def del_edge(self, edge):
@@ -179,7 +179,7 @@ class hypergraph (basegraph, common, labeling):
         """
         if (not node in self.node_links):
             self.node_links[node] = []
-            self.node_attr[node] = []
+            self.add_node_labeling(node)
             self.graph.add_node((node,'n'))
         else:
             raise AdditionError("Node %s already in graph" % node)
@@ -197,6 +197,7 @@ class hypergraph (basegraph, common, labeling):
                 self.edge_links[e].remove(node)
 
             self.node_links.pop(node)
+            self.del_node_labeling(node)
             self.graph.del_node((node,'n'))
 
 
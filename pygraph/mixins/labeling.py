@@ -28,8 +28,9 @@ class labeling( object ):
     Generic labeling support for graphs
     
     @sort: __eq__, __init__, add_edge_attribute, add_edge_attributes, add_node_attribute,
-    del_edge_labeling, del_node_labeling, edge_attributes, edge_label, edge_weight,
-    get_edge_properties, node_attributes, set_edge_label, set_edge_properties, set_edge_weight 
+    add_node_labeling, del_edge_labeling, del_node_labeling, edge_attributes, edge_label, edge_weight,
+    get_edge_properties, node_attribute, node_attribute_values, node_attributes,
+    set_edge_label, set_edge_properties, set_edge_weight 
     """
     WEIGHT_ATTRIBUTE_NAME = "weight"
     DEFAULT_WEIGHT = 1
@@ -44,11 +45,28 @@ class labeling( object ):
         
         # Metadata bout nodes
         self.node_attr = {}          # Pairing: Node -> Attributes
+        self.node_attr_index = {}    # Node -> Dict mapping, attribute -> list of values
         
+    def add_node_labeling( self, node, attrs=[] ):
+        """
+        Start the attributes of a new node, and their index, with the given attributes.
+
+        @type  node: node
+        @param node: Node identifier
+
+        @type  attrs: list
+        @param attrs: List of node attributes specified as (attribute, value) tuples.
+        """
+        self.node_attr[node] = []
+        self.node_attr_index[node] = {}
+        for attr in attrs:
+            self.add_node_attribute(node, attr)
+
     def del_node_labeling( self, node ):
         if node in self.node_attr:
             # Since attributes and properties are lazy, they might not exist.
             del( self.node_attr[node] )
+        self.node_attr_index.pop(node, None)
         
     def del_edge_labeling( self, edge ):
         
@@ -164,7 +182,42 @@ class labeling( object ):
         @type  attr: tuple
         @param attr: Node attribute specified as a tuple in the form (attribute, value).
         """
-        self.node_attr[node] = self.node_attr[node] + [attr]
+        self.node_attr[node].append(attr)
+        self.node_attr_index[node].setdefault(attr[0], []).append(attr[1])
+
+    def node_attribute(self, node, name, default=None):
+        """
+        Return the value of the named attribute of the given node.
+
+        @type  node: node
+        @param node: Node identifier
+
+        @type  name: string
+        @param name: Attribute name.
+
+        @param default: Value returned if the node doesn't have the attribute.
+
+        @return: The value of the first attribute with the given name, or default.
+        """
+        values = self.node_attr_index[node].get(name)
+        if (values):
+            return values[0]
+        return default
+
+    def node_attribute_values(self, node, name):
+        """
+        Return the values of every attribute of the given node with the given name.
+
+        @type  node: node
+        @param node: Node identifier
+
+        @type  name: string
+        @param name: Attribute name.
+
+        @rtype:  list
+        @return: List of values, in the order the attributes were added.
+        """
+        return list(self.node_attr_index[node].get(name, []))
 
 
     def node_attributes(self, node):
@@ -175,9 +228,10 @@ class labeling( object ):
         @param node: Node identifier
 
         @rtype:  list
-        @return: List of attributes specified tuples in the form (attribute, value).
+        @return: A copy of the list of attributes specified tuples in the form
+        (attribute, value). Use add_node_attribute() to add attributes.
         """
-        return self.node_attr[node]
+        return list(self.node_attr[node])
 
 
     def edge_attributes(self, edge):
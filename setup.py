@@ -11,8 +11,13 @@ setup(
     install_requires = [
                 "pyyaml",
                 "lxml",
+                "numpy",
                 "argparse"],
 
+    extras_require = {
+        'msgpack': ["msgpack-python"]
+    },
+
     entry_points = {
         'console_scripts': [
             "experimentor_tools = experimentor_tools:main",
@@ -0,0 +1,57 @@
+"""
+Small ModelNet .graph and .model files for the tests.
+"""
+
+import os
+import sys
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+
+def write_graph(path,num_virtnodes,num_gateways,links):
+    """
+    Write a .graph file to <b>path</b> with virtnodes 0 to
+    num_virtnodes-1 (int_vn equal to int_idx), gateways after
+    them, and an edge each way for each (u,v,delay) in
+    <b>links</b>. Edge int_idx values are numbered in order, and a
+    None in <b>links</b> leaves out a link but keeps its numbers,
+    so the other edges keep their int_idx.
+    """
+    with open(path,'w') as out:
+        out.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n<topology>\n<vertices>\n')
+        for v in xrange(num_virtnodes):
+            out.write('<vertex int_idx="%d" role="virtnode" int_vn="%d" nodetype="client"/>\n'
+                      % (v,v))
+        for v in xrange(num_virtnodes,num_virtnodes + num_gateways):
+            out.write('<vertex int_idx="%d" role="gateway"/>\n' % v)
+        out.write('</vertices>\n<edges>\n')
+        idx = 0
+        for link in links:
+            if link is None:
+                idx += 2
+                continue
+            u,v,delay = link
+            for src,dst in ((u,v),(v,u)):
+                out.write('<edge int_dst="%d" int_src="%d" int_idx="%d" specs="stub-stub" '
+                          'int_delayms="%d"/>\n' % (dst,src,idx,delay))
+                idx += 1
+        out.write('</edges>\n<specs>\n'
+                  '<client-stub dbl_plr="0" dbl_kbps="10000" int_delayms="1" int_qlen="10"/>\n'
+                  '<stub-stub dbl_plr="0" dbl_kbps="10000" int_delayms="0" int_qlen="100"/>\n'
+                  '</specs>\n</topology>\n')
+
+def write_model(path,virtnodes,hops):
+    """
+    Write a .model file to <b>path</b> with a virtnode for each
+    (int_idx,int_vn) in <b>virtnodes</b> and a hop for each
+    (int_idx,int_src,int_dst) in <b>hops</b>
+    """
+    with open(path,'w') as out:
+        out.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n<model>\n<hosts>\n')
+        for idx,vn in virtnodes:
+            out.write('<virtnode int_idx="%d" int_vn="%d" nodetype="client" vip="10.0.0.%d"/>\n'
+                      % (idx,vn,vn % 250 + 1))
+        out.write('</hosts>\n<hops>\n')
+        for idx,src,dst in hops:
+            out.write('<hop int_idx="%d" int_src="%d" int_dst="%d" int_emul="0" '
+                      'specs="stub-stub"/>\n' % (idx,src,dst))
+        out.write('</hops>\n</model>\n')
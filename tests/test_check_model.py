@@ -0,0 +1,71 @@
+"""
+Check check_model's consistency checks.
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+import graphs
+
+import ModelFunctions
+
+"""
+An id far beyond the others, which check_model must handle without
+memory in proportion to it
+"""
+HUGE_ID = 400000000
+
+"""
+Virtnodes 0 and 1 linked through gateway 2
+"""
+VIRTNODES = [(0,0),(1,1)]
+HOPS = [(0,0,2),(1,2,0),(2,1,2),(3,2,1)]
+
+MEASURE = """
+import resource
+import ModelFunctions
+report = ModelFunctions.check_model(%r)
+print report.counts['dangling_hops'],resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+"""
+
+class CheckModelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def model(self,virtnodes,hops):
+        path = os.path.join(self.dir,"test.model")
+        graphs.write_model(path,virtnodes,hops)
+        return path
+
+    def test_consistent(self):
+        report = ModelFunctions.check_model(self.model(VIRTNODES,HOPS))
+        self.assertTrue(report.ok())
+
+    def test_huge_id(self):
+        report = ModelFunctions.check_model(self.model(VIRTNODES,HOPS + [(4,2,HUGE_ID)]))
+        self.assertEqual(dict((problem,count) for problem,count in report.counts.items() if count),
+                         {'dangling_hops':1,'asymmetric_hops':1})
+        self.assertEqual(report.examples['dangling_hops'],["hop 4: 2 -> %d" % HUGE_ID])
+
+    def test_huge_id_memory(self):
+        # Run in a process of its own, so the peak RSS is just this
+        # check's
+        model_file = self.model(VIRTNODES,HOPS + [(4,2,HUGE_ID),(5,HUGE_ID,HUGE_ID - 1)])
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir)
+        output = subprocess.check_output([sys.executable,"-c",MEASURE % model_file],cwd=root)
+        dangling,maxrss = map(int,output.split())
+        self.assertEqual(dangling,1)
+        self.assertLess(maxrss,200 * 1024)
+
+if __name__ == '__main__':
+    unittest.main()
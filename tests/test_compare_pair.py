@@ -0,0 +1,62 @@
+"""
+Check how validate_paths compares measured latencies with the
+model.
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import graphs
+
+import CompactGraph
+import ValidatePathDistances
+
+"""
+Virtnodes 0 and 1 hang off gateway 3, and 2 off gateway 4. The
+first link, 0's, is left out, so nothing reaches 0.
+"""
+LINKS = [None,(1,3,2),(2,4,3),(3,4,10)]
+
+class ComparePairTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        path = os.path.join(self.dir,"cut.graph")
+        graphs.write_graph(path,3,2,LINKS)
+        self.graph = CompactGraph.load_graph_csr(path)
+        self.tree = self.graph.shortest_paths(self.graph.vertex_for_vn(1))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def compare(self,dst_vn,pings):
+        stats = dict()
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            ValidatePathDistances.compare_pair(self.graph,self.tree,
+                                               ((1,"10.0.0.1"),(dst_vn,"10.0.0.2")),
+                                               pings,None,stats)
+            return stats,sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_reachable(self):
+        stats,report = self.compare(2,[12,15,15])
+        self.assertEqual(stats,{})
+        stats,report = self.compare(2,[20,20,21])
+        self.assertEqual(stats['diff'],[5])
+
+    def test_unreachable(self):
+        stats,report = self.compare(0,[20,20,21])
+        self.assertEqual(stats.keys(),['unreachable'])
+        self.assertIn("Model: unreachable",report)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+"""
+Check cross_check against a .graph, .model and route file that
+disagree.
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+import graphs
+
+import CompactGraph
+import CrossCheck
+import ValidatePathDistances
+
+"""
+An int_vn far beyond the others, which cross_check must handle
+without memory in proportion to it
+"""
+HUGE_ID = 200000000
+
+VIRTNODES = 3
+GATEWAYS = 2
+
+"""
+Virtnodes 0 and 1 hang off gateway 3, and 2 off gateway 4
+"""
+LINKS = [(0,3,1),(1,3,2),(2,4,3),(3,4,10)]
+
+MEASURE = """
+import resource
+import CrossCheck
+report = CrossCheck.cross_check(%r,%r,%r)
+print report.counts['model_virtnodes_missing'],resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+"""
+
+def model_of(links,vns=None):
+    """
+    The (virtnodes,hops) of the model mkmodel would build from the
+    graph written for <b>links</b>, with the int_vn of each
+    virtnode taken from <b>vns</b> if given
+    """
+    vns = vns or range(VIRTNODES)
+    hops = []
+    for u,v,_ in links:
+        hops += [(len(hops),u,v),(len(hops) + 1,v,u)]
+    return zip(range(VIRTNODES),vns),hops
+
+class CrossCheckTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.graph_file = os.path.join(self.dir,"test.graph")
+        graphs.write_graph(self.graph_file,VIRTNODES,GATEWAYS,LINKS)
+        self.route_file = os.path.join(self.dir,"test.route")
+        with open(self.route_file,'w') as out:
+            ValidatePathDistances.write_routes(CompactGraph.load_graph_csr(self.graph_file),
+                                               out,'int_delayms')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def model(self,vns=None):
+        path = os.path.join(self.dir,"test.model")
+        graphs.write_model(path,*model_of(LINKS,vns))
+        return path
+
+    def problems(self,report):
+        return dict((problem,count) for problem,count in report.counts.items() if count)
+
+    def test_consistent(self):
+        report = CrossCheck.cross_check(self.graph_file,self.model(),self.route_file)
+        self.assertTrue(report.ok())
+
+    def test_huge_vn(self):
+        report = CrossCheck.cross_check(self.graph_file,self.model([0,1,HUGE_ID]),
+                                        self.route_file)
+        # The paths from and to int_vn 2 name a virtnode the model
+        # doesn't have
+        self.assertEqual(self.problems(report),{'graph_virtnodes_missing':1,
+                                                'model_virtnodes_missing':1,
+                                                'route_endpoints_unknown':4})
+        self.assertEqual(report.examples['model_virtnodes_missing'],
+                         ["virtnode 2 (int_vn %d)" % HUGE_ID])
+
+    def test_huge_vn_memory(self):
+        # Run in a process of its own, so the peak RSS is just this
+        # check's
+        model_file = self.model([0,1,HUGE_ID])
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir)
+        output = subprocess.check_output(
+            [sys.executable,"-c",MEASURE % (self.graph_file,model_file,self.route_file)],cwd=root)
+        missing,maxrss = map(int,output.split())
+        self.assertEqual(missing,1)
+        self.assertLess(maxrss,200 * 1024)
+
+if __name__ == '__main__':
+    unittest.main()
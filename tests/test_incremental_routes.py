@@ -0,0 +1,92 @@
+"""
+Check that update_routes gives the same paths as routing the new
+graph from scratch.
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import graphs
+
+import CompactGraph
+import IncrementalRoutes
+import ValidatePathDistances
+
+VIRTNODES = 10
+GATEWAYS = 6
+
+def full_links(seed=0):
+    """
+    A connected network of gateways with every virtnode linked to
+    one of them. Link i of the first VIRTNODES is virtnode i's.
+    """
+    rng = random.Random(seed)
+    gateways = range(VIRTNODES,VIRTNODES + GATEWAYS)
+    links = [(v,rng.choice(gateways),rng.randint(1,5)) for v in xrange(VIRTNODES)]
+    links += [(gateways[i],gateways[i + 1],rng.randint(1,20)) for i in xrange(GATEWAYS - 1)]
+    links += [(rng.choice(gateways),rng.choice(gateways),rng.randint(1,20)) for _ in xrange(4)]
+    return [(u,v,delay) for u,v,delay in links if u != v]
+
+class UpdateRoutesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def graph(self,name,links):
+        path = os.path.join(self.dir,name)
+        graphs.write_graph(path,VIRTNODES,GATEWAYS,links)
+        return path
+
+    def routes(self,graph_file,csr):
+        if csr:
+            gr = CompactGraph.load_graph_csr(graph_file)
+        else:
+            gr = ValidatePathDistances.load_graph(graph_file)
+        out = StringIO()
+        ValidatePathDistances.write_routes(gr,out,'int_delayms')
+        path = graph_file + ".route"
+        with open(path,'w') as f:
+            f.write(out.getvalue())
+        return path
+
+    def check_update(self,old_links,new_links,csr=True):
+        old_graph = self.graph("old.graph",old_links)
+        new_graph = self.graph("new.graph",new_links)
+        old_routes = self.routes(old_graph,csr)
+        with open(self.routes(new_graph,csr)) as f:
+            expected = f.read()
+
+        out = StringIO()
+        IncrementalRoutes.update_routes(old_graph,new_graph,old_routes,out,'int_delayms',csr)
+        updated = out.getvalue()
+        self.assertTrue(updated.endswith("</allpairs>\n"))
+        self.assertEqual(sorted(updated.splitlines()),sorted(expected.splitlines()))
+
+    def test_reconnected_source(self):
+        # Virtnode 0 has no paths in the old route file at all
+        links = full_links()
+        self.check_update([None] + links[1:],links)
+        self.check_update([None] + links[1:],links,csr=False)
+
+    def test_removed_link(self):
+        links = full_links()
+        self.check_update(links,[None] + links[1:])
+
+    def test_changed_delays(self):
+        links = full_links()
+        changed = [(u,v,delay * 3 if i % 3 == 0 else max(1,delay - 2))
+                   for i,(u,v,delay) in enumerate(links)]
+        self.check_update(links,changed)
+        self.check_update(changed,links)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""
+Check that the labeling mixin's attribute index stays in step with
+its attribute lists.
+
+    python -m unittest discover -s tests
+"""
+
+import unittest
+
+import graphs  # puts the repository on sys.path
+
+from pygraph.classes.graph import graph
+from pygraph.classes.digraph import digraph
+from pygraph.classes.hypergraph import hypergraph
+
+class NodeAttributeTest(unittest.TestCase):
+
+    def check_graph(self,gr):
+        gr.add_node('a',[('bw','10'),('role','gateway')])
+        gr.add_node_attribute('a',('bw','20'))
+        self.assertEqual(gr.node_attribute('a','bw'),'10')
+        self.assertEqual(gr.node_attribute_values('a','bw'),['10','20'])
+        self.assertEqual(gr.node_attribute('a','missing','x'),'x')
+        self.assertEqual(gr.node_attributes('a'),[('bw','10'),('role','gateway'),('bw','20')])
+
+        # Changing the returned list doesn't touch the node
+        gr.node_attributes('a').append(('exit','1'))
+        self.assertEqual(gr.node_attribute('a','exit'),None)
+        self.assertEqual(len(gr.node_attributes('a')),3)
+
+        # A node added again starts afresh
+        gr.del_node('a')
+        gr.add_node('a')
+        self.assertEqual(gr.node_attributes('a'),[])
+        self.assertEqual(gr.node_attribute('a','bw'),None)
+
+    def test_graph(self):
+        self.check_graph(graph())
+
+    def test_digraph(self):
+        self.check_graph(digraph())
+
+    def test_hypergraph(self):
+        gr = hypergraph()
+        gr.add_node('a')
+        gr.add_node_attribute('a',('bw','10'))
+        self.assertEqual(gr.node_attribute('a','bw'),'10')
+        gr.del_node('a')
+        gr.add_node('a')
+        self.assertEqual(gr.node_attribute('a','bw'),None)
+
+    def test_shared_attrs(self):
+        # add_node doesn't keep a reference to the caller's list
+        attrs = [('bw','10')]
+        gr = graph()
+        gr.add_node('a',attrs)
+        gr.add_node('b',attrs)
+        gr.add_node_attribute('a',('bw','20'))
+        self.assertEqual(attrs,[('bw','10')])
+        self.assertEqual(gr.node_attribute_values('b','bw'),['10'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+"""
+Check the streaming TorTopology to .graph conversion.
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import graphs  # puts the repository on sys.path
+
+import MNXMLWriter
+
+NODES = ['as0','as1','as2']
+
+EDGE = re.compile(r'<edge int_dst="(\d+)" int_src="(\d+)" int_idx="\d+" .*int_delayms="(\d+)"')
+
+def write_topology(path,edges):
+    """
+    Write a TorTopology graph file with the gateways in NODES and
+    the directed (from,to,wt) <b>edges</b>
+    """
+    with open(path,'w') as out:
+        out.write('<?xml version="1.0" ?>\n<graph>\n')
+        for node in NODES:
+            out.write('\t<node id="%s"/>\n' % node)
+        for src,dst,wt in edges:
+            out.write('\t<edge from="%s" label="" to="%s" wt="%d"/>\n' % (src,dst,wt))
+        out.write('</graph>\n')
+
+class StreamingWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def convert(self,edges,streaming):
+        topology = os.path.join(self.dir,"topology.xml")
+        write_topology(topology,edges)
+        output = os.path.join(self.dir,"out.graph")
+        MNXMLWriter.convert(topology,streaming,output)
+        with open(output) as f:
+            return f.read()
+
+    def test_both_orientations(self):
+        # The streaming writer numbers the gateways in file order
+        edges = [('as0','as1',5),('as1','as0',5),('as2','as1',7),('as1','as2',7)]
+        written = sorted((int(src),int(dst),int(delay)) for dst,src,delay
+                         in EDGE.findall(self.convert(edges,True)))
+        self.assertEqual(written,[(0,1,5),(1,0,5),(1,2,7),(2,1,7)])
+
+    def test_unbalanced_links(self):
+        # One link only high to low and another only low to high:
+        # as many edges each way, but neither link is complete
+        edges = [('as1','as0',5),('as1','as2',7)]
+        with self.assertRaises(ValueError):
+            self.convert(edges,True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+"""
+Check that the model cache falls back to parsing the model when
+SQLite fails.
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import graphs  # puts the repository on sys.path
+
+import ModelCache
+
+MODEL = """<?xml version="1.0" encoding="ISO-8859-1"?>
+<model>
+<hosts>
+<virtnode int_idx="0" int_vn="0" nodetype="client" vip="10.0.0.1"/>
+<virtnode int_idx="1" int_vn="1" nodetype="tor_relay" vip="10.0.0.2"/>
+</hosts>
+</model>
+"""
+
+class ModelCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.model_file = os.path.join(self.dir,"test.model")
+        with open(self.model_file,'w') as f:
+            f.write(MODEL)
+        self.environ = os.environ.get("EXPERIMENTOR_MODEL_CACHE")
+        os.environ["EXPERIMENTOR_MODEL_CACHE"] = os.path.join(self.dir,"cache.sqlite")
+        self.store = ModelCache._store
+        self.stderr = sys.stderr
+        sys.stderr = StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+        ModelCache._store = self.store
+        if self.environ is None:
+            del os.environ["EXPERIMENTOR_MODEL_CACHE"]
+        else:
+            os.environ["EXPERIMENTOR_MODEL_CACHE"] = self.environ
+        shutil.rmtree(self.dir)
+
+    def vips(self):
+        return [node['vip'] for node in ModelCache.virtnodes(self.model_file)]
+
+    def test_cached(self):
+        self.assertEqual(self.vips(),["10.0.0.1","10.0.0.2"])
+        self.assertEqual(len(ModelCache.cached_virtnodes(self.model_file)),2)
+        self.assertEqual(self.vips(),["10.0.0.1","10.0.0.2"])
+        self.assertEqual(sys.stderr.getvalue(),"")
+
+    def test_store_fails(self):
+        def locked(*args):
+            raise sqlite3.OperationalError("database is locked")
+        ModelCache._store = locked
+
+        self.assertEqual(self.vips(),["10.0.0.1","10.0.0.2"])
+        self.assertIn("Warning: not using the model cache",sys.stderr.getvalue())
+        self.assertIn("database is locked",sys.stderr.getvalue())
+        self.assertEqual(ModelCache.cached_virtnodes(self.model_file),None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+"""
+Check validate_paths' modelnetping probes against
+tests/fake_modelnetping.
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import time
+import unittest
+
+import graphs  # puts the repository on sys.path
+
+import ValidatePathDistances
+
+FAKE_MNP = os.path.join(os.path.dirname(os.path.abspath(__file__)),"fake_modelnetping")
+
+def pair(last_octet):
+    return ((0,"10.0.0.1"),(1,"10.0.0.%d" % last_octet))
+
+class PingPairTest(unittest.TestCase):
+
+    def test_success(self):
+        # Round trips of 40, 41 and 42 ms
+        self.assertEqual(ValidatePathDistances.ping_pair(FAKE_MNP,pair(20),timeout=10),
+                         [20,20,21])
+
+    def test_failure(self):
+        self.assertEqual(ValidatePathDistances.ping_pair(FAKE_MNP,pair(250),timeout=10),None)
+
+    def test_timeout(self):
+        start = time.time()
+        self.assertEqual(ValidatePathDistances.ping_pair(FAKE_MNP,pair(251),timeout=1),None)
+        self.assertLess(time.time() - start,10)
+
+    def test_probe_pairs(self):
+        pairs = [pair(20),pair(250),pair(251),pair(251),pair(251),pair(30)]
+        start = time.time()
+        results = dict((p[1][1],pings) for p,pings in
+                       ValidatePathDistances.probe_pairs(FAKE_MNP,pairs,jobs=3,timeout=1))
+        self.assertLess(time.time() - start,10)
+        self.assertEqual(results,{"10.0.0.20":[20,20,21],"10.0.0.30":[30,30,31],
+                                  "10.0.0.250":None,"10.0.0.251":None})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+"""
+Check validate_routes against route files that no longer match
+the graph.
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import numpy as np
+
+import graphs
+
+import CompactGraph
+import ValidatePathDistances
+
+VIRTNODES = 4
+GATEWAYS = 2
+
+"""
+Virtnodes 0 and 1 hang off gateway 4, and 2 and 3 off gateway 5
+"""
+LINKS = [(0,4,1),(1,4,2),(2,5,3),(3,5,4),(4,5,10)]
+
+class ValidateRoutesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.route_file = os.path.join(self.dir,"full.route")
+        gr = CompactGraph.load_graph_csr(self.graph("full.graph",LINKS))
+        with open(self.route_file,'w') as out:
+            ValidatePathDistances.write_routes(gr,out,'int_delayms')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def graph(self,name,links):
+        path = os.path.join(self.dir,name)
+        graphs.write_graph(path,VIRTNODES,GATEWAYS,links)
+        return path
+
+    def validate(self,graph_file):
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            bad = ValidatePathDistances.validate_routes(graph_file,self.route_file)
+            return bad,sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_matching_graph(self):
+        bad,report = self.validate(self.graph("same.graph",LINKS))
+        self.assertEqual(bad,0)
+        self.assertIn("Paths checked: 12\n",report)
+
+    def test_removed_edge(self):
+        # Every path to or from virtnode 0 uses a hop that is gone
+        bad,report = self.validate(self.graph("cut.graph",[None] + LINKS[1:]))
+        self.assertEqual(bad,6)
+        self.assertIn("Paths whose hops don't link src to dst: 6\n",report)
+        self.assertIn("Paths with the wrong latency: 0\n",report)
+
+    def test_unknown_virtnode(self):
+        # Vertex 3 is a gateway rather than a virtnode, so the paths
+        # from and to virtnode 3 have an endpoint the graph lacks
+        path = os.path.join(self.dir,"novn.graph")
+        graphs.write_graph(path,VIRTNODES - 1,GATEWAYS + 1,LINKS)
+        bad,report = self.validate(path)
+        self.assertIn("Paths checked: 12\n",report)
+        self.assertIn("Paths whose hops don't link src to dst: 6\n",report)
+        self.assertIn("Paths between virtnodes the graph doesn't connect: 6\n",report)
+        self.assertIn("(3 -> 0): Route: 15 ms; Shortest: inf ms\n",report)
+        self.assertIn("(0 -> 3): Route: 15 ms; Shortest: inf ms\n",report)
+
+    def test_unreachable_destination(self):
+        # A path from 1 to 0 over hops that exist but lead to 2,
+        # when nothing reaches 0 any more
+        graph = CompactGraph.load_graph_csr(self.graph("cut.graph",[None] + LINKS[1:]))
+        hops = np.array([2,8,5])
+        block = (1,np.array([0]),np.array([3]),hops)
+        src,npaths,nbroken,nwrong,histogram,mismatches = \
+            ValidatePathDistances.check_route_block(graph,block,show=5)
+        self.assertEqual((npaths,nbroken,nwrong,int(histogram.sum())),(1,1,1,0))
+        self.assertEqual(mismatches[0][:2],(0,15))
+        self.assertTrue(np.isinf(mismatches[0][2]))
+
+if __name__ == '__main__':
+    unittest.main()